@@ -1,9 +1,14 @@
 import os
+import random
+import threading
 import numpy as np
-from openai import OpenAI
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 import time
+from embedding_cache import SQLiteEmbeddingStore, make_cache_key
+from rate_limiter import RateLimiter
+from text_utils import estimate_tokens, split_by_tokens, truncate_to_tokens
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -12,26 +17,66 @@ logger = logging.getLogger(__name__)
 class AliYunEmbedder:
     """阿里云百炼大模型文本嵌入生成器"""
     
-    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 cache_path: Optional[str] = None, max_concurrency: int = 4,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_retries: int = 5,
+                 max_batch_items: int = 10, max_batch_tokens: int = 32000,
+                 max_input_tokens: int = 8192, overflow: str = 'split'):
         """
         初始化阿里云嵌入模型
         
         Args:
             api_key: 阿里云API Key，如果为None则从环境变量获取
             base_url: 阿里云API基础URL，如果为None使用默认值
+            cache_path: 嵌入缓存文件路径（SQLite），按文本内容哈希、模型和维度缓存
+                embed_batch的结果，为None时不缓存
+            max_concurrency: embed_batch同时进行的最大请求数
+            requests_per_minute: 每分钟最大请求数，为None时不限制
+            tokens_per_minute: 每分钟最大token数（按估计值计算），为None时不限制
+            max_retries: 遇到429、超时或服务端错误时的最大重试次数
+            max_batch_items: 单个请求的最大文本条数（text-embedding-v4为10）
+            max_batch_tokens: 单个请求的估计token预算，短文本会合并到同一请求
+            max_input_tokens: 单条输入的最大token数（text-embedding-v4为8192）
+            overflow: 超长输入的处理方式，'split' 切分后按长度加权平均，'truncate' 截断
         """
+        if overflow not in ('split', 'truncate'):
+            raise ValueError(f"不支持的超长输入处理方式: {overflow}")
+        if max_retries < 0:
+            raise ValueError(f"最大重试次数不能为负数: {max_retries}")
         self.api_key = api_key or os.getenv("ALIYUN_API_KEY", "sk-8a1b33b774344ba98cf22fc660b6c9a2")
         self.base_url = base_url or "https://dashscope.aliyuncs.com/compatible-mode/v1"
         self.client = None
+        self.model = "text-embedding-v4"
         self.embedding_dim = 1024  # 默认维度，可根据需要调整
-        self._initialize_client()
+        self.cache = SQLiteEmbeddingStore(cache_path, table='content_embeddings') if cache_path else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.max_input_tokens = max_input_tokens
+        self.overflow = overflow
+        self.api_calls = 0  # 请求次数（含重试）
+        self.successful_requests = 0
+        self.input_tokens = 0  # 成功请求的估计token总数
+        self._stats_lock = threading.Lock()
+        self._client_lock = threading.Lock()
     
     def _initialize_client(self):
-        """初始化OpenAI客户端"""
+        """
+        初始化OpenAI客户端
+        
+        在第一次调用API时执行：导入openai耗时较长，只使用缓存或预计算嵌入时不需要客户端，
+        服务启动不必等待。
+        """
+        from openai import OpenAI
         try:
+            # 重试由本类统一处理，以便所有线程共享速率限制和退避
             self.client = OpenAI(
                 api_key=self.api_key,
-                base_url=self.base_url
+                base_url=self.base_url,
+                max_retries=0
             )
             logger.info("阿里云嵌入模型客户端初始化成功")
         except Exception as e:
@@ -49,16 +94,8 @@ class AliYunEmbedder:
         Returns:
             numpy数组表示的嵌入向量
         """
-        if not self.client:
-            raise ValueError("客户端未初始化")
-        
         try:
-            response = self.client.embeddings.create(
-                model="text-embedding-v4",
-                input=text,
-                dimensions=dimensions,
-                encoding_format="float"
-            )
+            response = self._create_embeddings(truncate_to_tokens(text, self.max_input_tokens), dimensions)
             
             embedding = np.array(response.data[0].embedding)
             self.embedding_dim = dimensions
@@ -68,46 +105,228 @@ class AliYunEmbedder:
             logger.error(f"嵌入生成失败: {e}")
             raise
     
-    def embed_batch(self, texts: List[str], dimensions: int = 1024, batch_size: int = 10) -> np.ndarray:
+    def embed_batch(self, texts: List[str], dimensions: int = 1024,
+                    batch_size: Optional[int] = None) -> np.ndarray:
         """
         批量生成文本嵌入向量
         
+        请求按估计的token预算组批：短文本合并到同一请求，超长文本按overflow设置
+        切分或截断，因此单条长文本不会导致整个批次失败。
+        
         Args:
             texts: 文本列表
             dimensions: 向量维度
-            batch_size: 批量处理大小
+            batch_size: 单个请求的最大文本条数，为None时使用max_batch_items
             
         Returns:
-            嵌入向量矩阵 (n_samples, dimensions)
+            嵌入向量矩阵 (n_samples, dimensions)，与输入顺序一致
         """
-        if not self.client:
-            raise ValueError("客户端未初始化")
+        # 按内容哈希查找缓存，只有未命中的文本才调用API
+        keys = [self._cache_key(text, dimensions) for text in texts]
+        embeddings = self.cache.get_many(keys) if self.cache is not None else {}
+        
+        # 同一批次中重复的文本只请求一次
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in embeddings:
+                pending.setdefault(key, text)
+        if self.cache is not None:
+            hits = sum(1 for key in keys if key not in pending)
+            logger.info(f"嵌入缓存命中 {hits}/{len(texts)} 个文本")
         
-        embeddings = []
+        # 超长文本切分为多个片段，每个片段是一个请求条目: (缓存键, 文本, 估计token数)
+        items = []
+        for key, text in pending.items():
+            for piece in self._prepare_input(text):
+                items.append((key, piece, estimate_tokens(piece)))
+        batches = self._form_batches(items, batch_size or self.max_batch_items)
         
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i + batch_size]
+        remaining = {}
+        for key, _, _ in items:
+            remaining[key] = remaining.get(key, 0) + 1
+        parts = {key: [] for key in remaining}
+        
+        # 多个批次并发请求，速率由共享的限制器控制
+        done = 0
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches)) or 1) as executor:
+            futures = {
+                executor.submit(self._request_embeddings, [piece for _, piece, _ in batch], dimensions): batch
+                for batch in batches
+            }
+            try:
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    finished = {}
+                    for (key, _, tokens), vector in zip(batch, future.result()):
+                        parts[key].append((tokens, vector))
+                        remaining[key] -= 1
+                        if remaining[key] == 0:
+                            finished[key] = self._combine_parts(parts.pop(key))
+                    embeddings.update(finished)
+                    
+                    # 每个批次完成后立即写入缓存，中途失败时已完成的结果不会丢失
+                    if self.cache is not None:
+                        self.cache.put_many(finished)
+                    
+                    done += len(finished)
+                    logger.info(f"已处理 {done}/{len(pending)} 个文本")
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        if batches:
+            total_tokens = sum(tokens for _, _, tokens in items)
+            logger.info(f"共 {len(batches)} 个请求，平均每个请求 {total_tokens / len(batches):.0f} token、"
+                        f"{len(items) / len(batches):.1f} 条输入")
+        
+        self.embedding_dim = dimensions
+        return np.array([embeddings[key] for key in keys])
+    
+    def _cache_key(self, text: str, dimensions: int) -> str:
+        """
+        文本的内容缓存键
+        
+        超长文本的向量取决于overflow和max_input_tokens，这两项计入缓存键，
+        修改设置后不会取到按旧方式生成的向量；未超长的文本不受影响，缓存键保持不变。
+        """
+        variant = ''
+        if estimate_tokens(text) > self.max_input_tokens:
+            variant = f"{self.overflow}:{self.max_input_tokens}"
+        return make_cache_key(text, self.model, dimensions, variant)
+    
+    def _prepare_input(self, text: str) -> List[str]:
+        """将单条文本处理为不超过max_input_tokens的一个或多个片段"""
+        if self.overflow == 'truncate':
+            return [truncate_to_tokens(text, self.max_input_tokens)]
+        return split_by_tokens(text, self.max_input_tokens)
+    
+    def _form_batches(self, items: List[Tuple[str, str, int]], max_items: int) -> List[List[Tuple[str, str, int]]]:
+        """按条数上限和token预算贪心地将请求条目分组"""
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for item in items:
+            tokens = item[2]
+            if batch and (len(batch) >= max_items or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(item)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    @staticmethod
+    def _combine_parts(parts: List[Tuple[int, np.ndarray]]) -> np.ndarray:
+        """将切分片段的向量按token数加权平均并重新标准化"""
+        if len(parts) == 1:
+            return parts[0][1]
+        weights = np.array([tokens for tokens, _ in parts], dtype=np.float32)
+        vector = np.average(np.vstack([vector for _, vector in parts]), axis=0, weights=weights)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).astype(np.float32)
+    
+    def _request_embeddings(self, batch_texts: List[str], dimensions: int) -> List[np.ndarray]:
+        """
+        调用API为一个批次的文本生成嵌入向量
+        
+        批次被API拒绝（400）时对半拆分重试，只有真正有问题的单条输入会导致失败。
+        
+        Args:
+            batch_texts: 文本列表
+            dimensions: 向量维度
             
+        Returns:
+            与输入顺序一致的向量列表
+        """
+        import openai
+        try:
+            response = self._create_embeddings(batch_texts, dimensions)
+            return [np.array(item.embedding, dtype=np.float32) for item in response.data]
+        
+        except openai.BadRequestError as e:
+            if len(batch_texts) == 1:
+                logger.error(f"批量嵌入生成失败: {e}")
+                raise
+            middle = len(batch_texts) // 2
+            logger.warning(f"批次被拒绝，拆分为两个批次重试: {e}")
+            return (self._request_embeddings(batch_texts[:middle], dimensions)
+                    + self._request_embeddings(batch_texts[middle:], dimensions))
+        except Exception as e:
+            logger.error(f"批量嵌入生成失败: {e}")
+            raise
+    
+    def get_stats(self) -> Dict:
+        """获取API调用统计，tokens_per_request可用于调节组批参数"""
+        return {
+            'api_calls': self.api_calls,
+            'successful_requests': self.successful_requests,
+            'input_tokens': self.input_tokens,
+            'tokens_per_request': (self.input_tokens / self.successful_requests
+                                   if self.successful_requests else 0.0)
+        }
+    
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """读取响应中的Retry-After头（秒），没有时返回None"""
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        value = response.headers.get('retry-after')
+        try:
+            return max(0.0, float(value)) if value is not None else None
+        except ValueError:
+            return None
+    
+    def _create_embeddings(self, texts: Union[str, List[str]], dimensions: int):
+        """
+        在速率限制下调用嵌入API，遇到429、超时和服务端错误时退避重试
+        
+        Args:
+            texts: 单个文本或文本列表
+            dimensions: 向量维度
+        
+        Returns:
+            API响应对象
+        """
+        import openai
+        if self.client is None:
+            with self._client_lock:
+                if self.client is None:
+                    self._initialize_client()
+        
+        batch = [texts] if isinstance(texts, str) else texts
+        tokens = sum(estimate_tokens(text) for text in batch)
+        
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(tokens)
+            with self._stats_lock:
+                self.api_calls += 1
             try:
                 response = self.client.embeddings.create(
-                    model="text-embedding-v4",
-                    input=batch_texts,
+                    model=self.model,
+                    input=texts,
                     dimensions=dimensions,
                     encoding_format="float"
                 )
-                
-                batch_embeddings = [np.array(item.embedding) for item in response.data]
-                embeddings.extend(batch_embeddings)
-                
-                logger.info(f"已处理 {min(i + batch_size, len(texts))}/{len(texts)} 个文本")
-                time.sleep(0.1)  # 避免速率限制
-                
-            except Exception as e:
-                logger.error(f"批量嵌入生成失败: {e}")
-                raise
+                with self._stats_lock:
+                    self.successful_requests += 1
+                    self.input_tokens += tokens
+                return response
+            except (openai.RateLimitError, openai.APITimeoutError,
+                    openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                # 指数退避并加入随机抖动，避免所有线程同时重试
+                delay = min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+                if isinstance(e, openai.RateLimitError):
+                    delay = max(delay, self._retry_after(e) or 0.0)
+                    self.rate_limiter.pause(delay)
+                logger.warning(f"嵌入请求失败（第 {attempt + 1} 次），{delay:.1f} 秒后重试: {e}")
+                time.sleep(delay)
         
-        return np.array(embeddings)
-    
     def get_embedding_dim(self) -> int:
         """获取嵌入向量的维度"""
         return self.embedding_dim
@@ -3,7 +3,8 @@ import pandas as pd
 from vector_store import KnowledgeBase
 from aliyun_embedder import AliYunEmbedder
 from doubao_ai import DoubaoAI
-from file_processor import process_uploaded_file
+from file_processor import iter_docx_paragraphs, iter_xlsx_records
+from chunker import Chunker
 import os
 import time
 
@@ -21,8 +22,9 @@ def init_knowledge_base():
     aliyun_api_key = os.getenv("ALIYUN_API_KEY", "sk-8a1b33b774344ba98cf22fc660b6c9a2")
     doubao_api_key = os.getenv("DOUBAO_API_KEY", "af304f26-0164-4318-84e7-d70ac67f2e07")
     
-    # 初始化嵌入器
-    embedder = AliYunEmbedder(api_key=aliyun_api_key)
+    # 初始化嵌入器（按内容哈希缓存嵌入，重复上传未变化的文件不会再调用API）
+    embedding_cache_path = os.getenv("KB_EMBEDDING_CACHE_PATH", "cache/content_embeddings.sqlite")
+    embedder = AliYunEmbedder(api_key=aliyun_api_key, cache_path=embedding_cache_path or None)
     
     # 初始化知识库
     kb = KnowledgeBase(embedder=embedder)
@@ -116,9 +118,9 @@ def main():
         
         # 知识库统计
         st.subheader("知识库统计")
-        if hasattr(kb.vector_store, 'texts'):
-            st.write(f"文档数量: {len(kb.vector_store.texts)}")
-            st.write(f"向量维度: {kb.vector_store.embedding_dim}")
+        stats = kb.vector_store.get_stats()
+        st.write(f"文档数量: {stats['total_documents']}")
+        st.write(f"向量维度: {stats['embedding_dim']}")
         
         st.divider()
         
@@ -148,11 +150,27 @@ def main():
             if file_ext in ['docx', 'xlsx']:
                 with st.spinner("处理文件中..."):
                     try:
-                        texts = process_uploaded_file(uploaded_file, file_ext)
-                        if texts:
-                            metadata = {"category": file_category, "source": file_source}
-                            kb.add_documents(texts, [metadata] * len(texts))
-                            st.success(f"文件上传成功！提取了 {len(texts)} 条文本")
+                        progress_bar = st.progress(0.0)
+                        status = st.empty()
+                        
+                        def show_progress(progress):
+                            # 解析结束前总数未知，按已解析的块数估计进度
+                            total = max(progress['parsed'], 1)
+                            progress_bar.progress(min(progress['indexed'] / total, 1.0))
+                            status.text(f"已解析 {progress['parsed']} 条，已写入 {progress['indexed']} 条")
+                        
+                        metadata = {"category": file_category, "source": file_source}
+                        if file_ext == 'docx':
+                            # 短段落合并、长段落按句子拆分后再嵌入
+                            documents = Chunker().chunk(iter_docx_paragraphs(uploaded_file), metadata,
+                                                        parent_id=uploaded_file.name)
+                        else:
+                            # 表格每行是一条独立的记录，不再合并分块
+                            documents = iter_xlsx_records(uploaded_file)
+                            metadata = {**metadata, "parent_id": uploaded_file.name}
+                        ids = kb.add_documents_stream(documents, metadata, progress_callback=show_progress)
+                        if ids:
+                            st.success(f"文件上传成功！生成了 {len(ids)} 个文本块")
                             time.sleep(1)
                             st.rerun()
                         else:
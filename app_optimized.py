@@ -1,11 +1,65 @@
 from flask import Flask, request, jsonify, render_template_string
+import heapq
 import json
+import math
 import os
-import re
-from typing import List, Dict, Any
+from collections import Counter
+from typing import List, Dict, Any, Tuple
+from text_utils import tokenize
 
 app = Flask(__name__)
 
+class InvertedIndex:
+    """
+    增量倒排索引（BM25打分，纯Python实现，不依赖numpy）
+    
+    中文按相邻二字组切分，英文与数字按完整标识符切分（见text_utils.tokenize）。
+    每个词保存 文档ID -> 词频 的倒排表，文档长度和总长度在写入时累计，
+    查询时只对倒排表中出现的候选文档打分。
+    """
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # 词 -> {文档ID: 词频}
+        self.doc_lengths = {}  # 文档ID -> 词数
+        self.total_length = 0
+    
+    def add(self, doc_id: int, text: str):
+        """将文档加入索引"""
+        terms = tokenize(text)
+        self.doc_lengths[doc_id] = len(terms)
+        self.total_length += len(terms)
+        for term, freq in Counter(terms).items():
+            self.postings.setdefault(term, {})[doc_id] = freq
+    
+    def idf(self, term: str) -> float:
+        """词的逆文档频率，文档频率即倒排表长度"""
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.doc_lengths) - df + 0.5) / (df + 0.5))
+    
+    def score(self, query: str) -> Tuple[Dict[int, float], float]:
+        """
+        为包含查询词的候选文档打分
+        
+        Returns:
+            (文档ID -> BM25分数, 查询词全部命中时的参考满分)
+        """
+        if not self.doc_lengths:
+            return {}, 0.0
+        
+        avg_length = self.total_length / len(self.doc_lengths)
+        scores = {}
+        full_score = 0.0
+        for term, query_freq in Counter(tokenize(query)).items():
+            idf = self.idf(term)
+            # 满分按词频为1、文档长度为平均长度估算
+            full_score += query_freq * idf
+            for doc_id, freq in self.postings.get(term, {}).items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + query_freq * idf * freq * (self.k1 + 1) / (freq + norm)
+        return scores, full_score
+
 # 优化的知识库存储
 class OptimizedKnowledgeBase:
     def __init__(self):
@@ -22,58 +76,61 @@ class OptimizedKnowledgeBase:
             {"id": 10, "text": "知识图谱将信息组织成结构化的语义网络，便于推理和查询", "category": "知识表示", "source": "数据结构"}
         ]
         self.next_id = 11
+        
+        # 正文和分类分别建立倒排索引，分类命中作为加分项
+        self.docs_by_id = {}
+        self.text_index = InvertedIndex()
+        self.category_index = InvertedIndex()
+        for doc in self.documents:
+            self._index_document(doc)
+    
+    def _index_document(self, doc: Dict[str, Any]):
+        """将文档加入倒排索引"""
+        self.docs_by_id[doc["id"]] = doc
+        self.text_index.add(doc["id"], doc["text"])
+        self.category_index.add(doc["id"], doc["category"])
     
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """改进的搜索算法，支持多关键词和模糊匹配"""
-        query_lower = query.lower()
-        query_words = re.findall(r'\w+', query_lower)
+        """基于倒排索引的BM25检索，只对包含查询词的候选文档打分"""
+        text_scores, full_score = self.text_index.score(query)
+        category_scores, category_full_score = self.category_index.score(query)
+        if not text_scores and not category_scores:
+            return []
         
-        results = []
-        for doc in self.documents:
-            text_lower = doc["text"].lower()
-            
-            # 计算匹配分数
-            score = 0
-            
-            # 完整查询匹配
-            if query_lower in text_lower:
-                score += 1.0
-            
-            # 关键词匹配
-            word_matches = sum(1 for word in query_words if word in text_lower)
-            if word_matches > 0:
-                score += word_matches / len(query_words) * 0.8
-            
-            # 分类匹配
-            if query_lower in doc["category"].lower():
-                score += 0.6
-            
-            if score > 0:
-                results.append({
-                    "text": doc["text"],
-                    "similarity": min(score, 1.0),
-                    "metadata": {
-                        "category": doc["category"],
-                        "source": doc["source"],
-                        "id": doc["id"]
-                    }
-                })
+        # 分类命中按满分的0.6倍加分
+        scores = dict(text_scores)
+        for doc_id, score in category_scores.items():
+            bonus = 0.6 * full_score * score / category_full_score if category_full_score else 0.0
+            scores[doc_id] = scores.get(doc_id, 0.0) + bonus
         
-        # 按相似度排序
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        return results[:top_k]
+        results = []
+        for doc_id, score in heapq.nlargest(top_k, scores.items(), key=lambda item: item[1]):
+            doc = self.docs_by_id[doc_id]
+            results.append({
+                "text": doc["text"],
+                # 相对于查询词全部命中时的满分，限制在[0, 1]
+                "similarity": min(score / full_score, 1.0) if full_score else 0.0,
+                "metadata": {
+                    "category": doc["category"],
+                    "source": doc["source"],
+                    "id": doc["id"]
+                }
+            })
+        return results
     
     def add_document(self, text: str, category: str = "其他", source: str = "用户添加") -> bool:
         """添加新文档"""
         if not text.strip():
             return False
         
-        self.documents.append({
+        doc = {
             "id": self.next_id,
             "text": text.strip(),
             "category": category or "其他",
             "source": source or "用户添加"
-        })
+        }
+        self.documents.append(doc)
+        self._index_document(doc)
         self.next_id += 1
         return True
     
@@ -87,6 +144,7 @@ class OptimizedKnowledgeBase:
         return {
             "total_documents": len(self.documents),
             "categories": categories,
+            "indexed_terms": len(self.text_index.postings),
             "latest_id": self.next_id - 1
         }
 
@@ -1,6 +1,9 @@
 from flask import Flask, request, jsonify, render_template_string
+import hashlib
 import json
-import re
+import os
+import tempfile
+from collections import deque
 from datetime import datetime
 
 app = Flask(__name__)
@@ -154,21 +157,162 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
+class KeywordMatcher:
+    """
+    Aho–Corasick关键词自动机
+    
+    所有主题的关键词编译为一个自动机，一次扫描查询文本即可找出全部命中的关键词，
+    耗时与查询长度和命中数有关，与关键词数量无关。
+    """
+    
+    def __init__(self, keywords):
+        """
+        编译自动机
+        
+        Args:
+            keywords: (关键词, 主题) 列表
+        """
+        self.keywords = [list(item) for item in keywords]
+        self.goto = [{}]  # 状态 -> {字符: 下一状态}
+        self.fail = [0]
+        self.output = [[]]  # 状态 -> 在该状态结束的关键词下标（含失败链上的）
+        
+        for index, (keyword, _) in enumerate(self.keywords):
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(index)
+        
+        # 按层次遍历计算失败指针，并把失败状态的输出合并进来
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+    
+    def iter_matches(self, text):
+        """
+        扫描文本
+        
+        Args:
+            text: 转为小写的文本
+        
+        Returns:
+            依次产生 (结束位置, 关键词下标)
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                yield position, index
+    
+    def match(self, text):
+        """
+        找出文本中命中的关键词，命中规则与逐个关键词做子串判断相同
+        
+        Args:
+            text: 转为小写的文本
+        
+        Returns:
+            主题 -> 命中的关键词集合
+        """
+        matched = {}
+        for _, index in self.iter_matches(text):
+            keyword, topic = self.keywords[index]
+            matched.setdefault(topic, set()).add(keyword)
+        return matched
+    
+    def to_dict(self):
+        """导出为可JSON序列化的字典"""
+        return {'keywords': self.keywords, 'goto': self.goto, 'fail': self.fail, 'output': self.output}
+    
+    @classmethod
+    def from_dict(cls, data):
+        """由to_dict的结果恢复自动机，无需重新编译"""
+        matcher = cls.__new__(cls)
+        matcher.keywords = data['keywords']
+        matcher.goto = data['goto']
+        matcher.fail = data['fail']
+        matcher.output = data['output']
+        return matcher
+
+# 编译结果的缓存目录（Vercel上只有/tmp可写，同一实例的后续冷启动可直接复用）
+MATCHER_CACHE_DIR = os.getenv('KB_MATCHER_CACHE_DIR', tempfile.gettempdir())
+
+def build_keyword_table(knowledge_data):
+    """由知识数据生成 (关键词, 主题) 列表，同一主题的重复关键词只保留一个"""
+    table = []
+    for title, data in knowledge_data.items():
+        table.extend((keyword, title) for keyword in dict.fromkeys(data["keywords"]) if keyword)
+    return table
+
+def load_matcher(knowledge_data, cache_dir=None):
+    """
+    获取知识数据对应的关键词自动机
+    
+    以关键词表的SHA-256摘要为键，优先读取缓存文件，未命中时编译并写入缓存；
+    缓存目录不可写时只在内存中使用。
+    
+    Args:
+        knowledge_data: 主题 -> {"keywords": [...], "content": ...}
+        cache_dir: 缓存目录，为None时使用MATCHER_CACHE_DIR
+    
+    Returns:
+        KeywordMatcher
+    """
+    table = build_keyword_table(knowledge_data)
+    digest = hashlib.sha256(json.dumps(table, ensure_ascii=False).encode('utf-8')).hexdigest()
+    path = os.path.join(cache_dir or MATCHER_CACHE_DIR, f"keyword_matcher_{digest[:16]}.json")
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('digest') == digest:
+            return KeywordMatcher.from_dict(data['matcher'])
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    matcher = KeywordMatcher(table)
+    try:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'digest': digest, 'matcher': matcher.to_dict()}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return matcher
+
+KEYWORD_MATCHER = load_matcher(KNOWLEDGE_DATA)
+
 def search_knowledge(query):
-    """简单的关键词匹配搜索"""
-    results = []
-    query_lower = query.lower()
+    """关键词匹配搜索：一次扫描找出所有命中的关键词，按主题累加评分"""
+    matched = KEYWORD_MATCHER.match(query.lower())
     
-    for title, data in KNOWLEDGE_DATA.items():
-        # 检查关键词匹配
-        for keyword in data["keywords"]:
-            if keyword in query_lower:
-                results.append({
-                    "title": title,
-                    "content": data["content"],
-                    "score": len(keyword)  # 简单评分
-                })
-                break
+    results = []
+    for title, keywords in matched.items():
+        results.append({
+            "title": title,
+            "content": KNOWLEDGE_DATA[title]["content"],
+            "score": sum(len(keyword) for keyword in keywords)  # 命中关键词越多、越长，评分越高
+        })
     
     # 按评分排序
     results.sort(key=lambda x: x["score"], reverse=True)
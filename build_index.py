@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+批量构建知识库索引（可断点续建）
+
+语料按顺序切分为固定大小的分段，每个分段嵌入完成后立即写入工作目录并提交到清单文件。
+嵌入API失败、触发限流或进程被中断时，已提交的分段不会丢失，重新运行同一条命令即从
+最后提交的分段之后继续。全部分段完成后合并为VectorStore.save格式的索引，并输出构建报告。
+
+用法:
+    python build_index.py docs/ faq.jsonl -o data/kb_index
+    python build_index.py docs/ -o data/kb_index --index-factory ivf_sq8 --segment-size 2000
+    python build_index.py docs/ -o data/snapshots/v2/kb --publish data/snapshots
+
+语料可以是目录（递归读取DOCX/XLSX）、单个DOCX/XLSX文件或JSONL文件。JSONL每行为
+{"text": "...", "metadata": {...}}，没有metadata字段时其余字段均作为元数据。
+解析失败的DOCX/XLSX文件被跳过并记入构建报告；JSONL中无法解析的行使构建失败并报告行号。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+from aliyun_embedder import AliYunEmbedder
+from document_store import validate_metadata
+from ingest_pipeline import iter_files, parse_files
+from snapshot import publish_snapshot
+from vector_store import VectorStore
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+def expand_inputs(paths: List[str]) -> List[Tuple[str, str]]:
+    """展开语料路径为 (文件路径, parent_id) 列表，JSONL文件单独识别"""
+    files = []
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"语料不存在: {path}")
+        if os.path.isfile(path) and path.lower().endswith('.jsonl'):
+            files.append((path, os.path.basename(path)))
+        else:
+            files.extend(iter_files([path]))
+    return files
+
+def iter_jsonl(path: str, parent_id: str) -> Iterator[Tuple[str, Dict]]:
+    """逐行读取JSONL语料，无法解析的行或无法保存为JSON的元数据报告文件和行号"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if isinstance(record, str):
+                    text, metadata = record, {}
+                else:
+                    text = record.get('text', '')
+                    metadata = record.get('metadata')
+                    if metadata is None:
+                        metadata = {key: value for key, value in record.items() if key != 'text'}
+                    validate_metadata(metadata)
+            except (ValueError, AttributeError) as e:
+                raise ValueError(f"{path} 第 {line_number} 行: {e}") from e
+            if text and text.strip():
+                yield text, {'parent_id': parent_id, 'line': line_number, **metadata}
+
+def iter_corpus(files: List[Tuple[str, str]], workers: int, memory_limit_mb: Optional[int],
+                target_tokens: int, overlap_tokens: int,
+                on_file: Optional[Callable[[Dict], None]] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    按固定顺序产生语料中的所有记录
+    
+    DOCX/XLSX在进程池中并行解析（见ingest_pipeline.parse_files），但结果严格按文件顺序产生：
+    续建时依靠记录顺序跳过已提交的部分。解析失败的文件不产生记录，通过on_file报告。
+    
+    Args:
+        files: (文件路径, parent_id) 列表
+        workers: 解析进程数
+        memory_limit_mb: 每个解析进程的内存上限（MB）
+        target_tokens: DOCX分块的目标token数
+        overlap_tokens: DOCX分块的重叠token数
+        on_file: 每个文件得到结果后以该文件的报告调用
+    
+    Returns:
+        (文本, 元数据) 的生成器
+    """
+    return parse_files(files, workers, memory_limit_mb, target_tokens=target_tokens,
+                       overlap_tokens=overlap_tokens, ordered=True, local_readers={'.jsonl': iter_jsonl},
+                       on_file=on_file)
+
+class BuildCheckpoint:
+    """
+    构建工作目录：已嵌入的分段和提交清单
+    
+    每个分段保存为 segment-NNNNN.npy（嵌入向量）和 segment-NNNNN.jsonl（文本与元数据），
+    两个文件写完后才在manifest.json中登记，清单以原子替换方式更新，登记即为提交。
+    
+    解析失败的文件随之后的分段一起登记，续建时跳过这些文件，保证记录顺序与已提交的分段一致。
+    """
+    
+    def __init__(self, work_dir: str, fingerprint: Dict, fresh: bool = False):
+        """
+        打开或创建工作目录
+        
+        Args:
+            work_dir: 工作目录
+            fingerprint: 语料文件（路径、大小、修改时间）和构建参数，与已有清单不一致时拒绝续建
+            fresh: 清空已有的分段重新开始
+        """
+        self.work_dir = work_dir
+        self.manifest_path = os.path.join(work_dir, 'manifest.json')
+        if fresh and os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+        os.makedirs(work_dir, exist_ok=True)
+        
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            if self.manifest.get('fingerprint') != fingerprint:
+                raise ValueError(f"语料或构建参数与工作目录 {work_dir} 中的记录不一致，"
+                                 "请使用 --fresh 重新构建")
+        else:
+            self.manifest = {
+                'version': MANIFEST_VERSION,
+                'fingerprint': fingerprint,
+                'segments': [],
+                'failed_files': [],
+                'documents': 0,
+                'api_calls': 0,
+                'input_tokens': 0,
+                'embed_seconds': 0.0
+            }
+            self._write_manifest()
+    
+    @property
+    def documents(self) -> int:
+        """已提交的记录数"""
+        return self.manifest['documents']
+    
+    @property
+    def failed_files(self) -> List[Dict]:
+        """解析失败的文件（path为绝对路径，error为原因）"""
+        return self.manifest.setdefault('failed_files', [])
+    
+    def mark_failed(self, path: str, error: str):
+        """记录解析失败的文件，在下一次提交分段时写入清单"""
+        self.failed_files.append({'path': os.path.abspath(path), 'error': error})
+    
+    def _write_manifest(self):
+        """原子替换清单文件"""
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+    
+    def commit(self, records: List[Tuple[str, Dict]], embeddings: np.ndarray, stats: Dict):
+        """
+        写入并提交一个分段
+        
+        Args:
+            records: (文本, 元数据) 列表
+            embeddings: 对应的嵌入向量
+            stats: 本分段的api_calls、input_tokens、embed_seconds
+        """
+        name = f"segment-{len(self.manifest['segments']):05d}"
+        prefix = os.path.join(self.work_dir, name)
+        np.save(f"{prefix}.tmp.npy", np.asarray(embeddings, dtype=np.float32))
+        with open(f"{prefix}.jsonl.tmp", 'w', encoding='utf-8') as f:
+            for text, metadata in records:
+                f.write(json.dumps([text, metadata], ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{prefix}.tmp.npy", f"{prefix}.npy")
+        os.replace(f"{prefix}.jsonl.tmp", f"{prefix}.jsonl")
+        
+        self.manifest['segments'].append({'name': name, 'documents': len(records)})
+        self.manifest['documents'] += len(records)
+        for key in ('api_calls', 'input_tokens', 'embed_seconds'):
+            self.manifest[key] += stats[key]
+        self._write_manifest()
+    
+    def iter_segments(self) -> Iterator[Tuple[List[str], List[Dict], np.ndarray]]:
+        """按顺序读取已提交的分段，返回 (文本列表, 元数据列表, 嵌入向量)"""
+        for segment in self.manifest['segments']:
+            prefix = os.path.join(self.work_dir, segment['name'])
+            texts, metadata = [], []
+            with open(f"{prefix}.jsonl", 'r', encoding='utf-8') as f:
+                for line in f:
+                    text, meta = json.loads(line)
+                    texts.append(text)
+                    metadata.append(meta)
+            yield texts, metadata, np.load(f"{prefix}.npy")
+
+def create_embedder() -> AliYunEmbedder:
+    """按与main.py相同的环境变量创建嵌入器"""
+    return AliYunEmbedder(
+        api_key=os.getenv("ALIYUN_API_KEY"),
+        cache_path=os.getenv("KB_EMBEDDING_CACHE_PATH", "cache/content_embeddings.sqlite") or None,
+        max_concurrency=int(os.getenv("KB_EMBED_CONCURRENCY", "4")),
+        requests_per_minute=float(os.getenv("KB_EMBED_RPM", "0")) or None,
+        tokens_per_minute=float(os.getenv("KB_EMBED_TPM", "0")) or None,
+        max_batch_tokens=int(os.getenv("KB_EMBED_BATCH_TOKENS", "32000")),
+        overflow=os.getenv("KB_EMBED_OVERFLOW", "split")
+    )
+
+def file_fingerprint(files: List[Tuple[str, str]]) -> List[List]:
+    """语料文件的路径、大小和修改时间，文件变化后已提交的分段不再可信"""
+    fingerprint = []
+    for path, _ in files:
+        stat = os.stat(path)
+        fingerprint.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+def embed_segments(corpus: Iterator[Tuple[str, Dict]], checkpoint: BuildCheckpoint,
+                   embedder, segment_size: int) -> int:
+    """
+    跳过已提交的记录，其余按分段嵌入并提交
+    
+    Returns:
+        本次新嵌入的记录数
+    """
+    committed = checkpoint.documents
+    skipped = 0
+    embedded = 0
+    segment = []
+    
+    def flush():
+        before = embedder.get_stats()
+        started = time.time()
+        embeddings = embedder.embed_batch([text for text, _ in segment])
+        after = embedder.get_stats()
+        checkpoint.commit(segment, embeddings, {
+            'api_calls': after['api_calls'] - before['api_calls'],
+            'input_tokens': after['input_tokens'] - before['input_tokens'],
+            'embed_seconds': time.time() - started
+        })
+        logger.info(f"已提交分段 {len(checkpoint.manifest['segments'])}，累计 {checkpoint.documents} 条记录")
+    
+    for record in corpus:
+        if skipped < committed:
+            skipped += 1
+            continue
+        segment.append(record)
+        if len(segment) >= segment_size:
+            flush()
+            embedded += len(segment)
+            segment = []
+    if segment:
+        flush()
+        embedded += len(segment)
+    
+    if skipped < committed:
+        raise ValueError(f"语料只有 {skipped} 条记录，少于已提交的 {committed} 条，请使用 --fresh 重新构建")
+    return embedded
+
+def assemble_index(checkpoint: BuildCheckpoint, output: str, embedding_dim: int,
+                   index_factory: str, rerank_dtype: Optional[str], coarse_dim: Optional[int],
+                   train_size: int) -> VectorStore:
+    """
+    将所有分段写入VectorStore并保存
+    
+    需要训练的索引在首次添加时训练，因此先合并前若干分段，使首批向量不少于train_size。
+    """
+    store = VectorStore(embedding_dim, index_factory, rerank_dtype=rerank_dtype, coarse_dim=coarse_dim)
+    pending = []
+    pending_count = 0
+    for texts, metadata, embeddings in checkpoint.iter_segments():
+        if store.index.is_trained:
+            store.add_documents(texts, embeddings, metadata)
+            continue
+        pending.append((texts, metadata, embeddings))
+        pending_count += len(texts)
+        if pending_count >= train_size:
+            store.add_documents(*_concat_segments(pending))
+            pending = []
+    if pending:
+        store.add_documents(*_concat_segments(pending))
+    store.save(output)
+    return store
+
+def _concat_segments(segments: List[Tuple[List[str], List[Dict], np.ndarray]]) -> Tuple[List[str], np.ndarray, List[Dict]]:
+    """合并多个分段为add_documents的参数"""
+    texts = [text for segment in segments for text in segment[0]]
+    metadata = [meta for segment in segments for meta in segment[1]]
+    return texts, np.vstack([segment[2] for segment in segments]), metadata
+
+def output_bytes(output: str) -> int:
+    """统计输出文件的总大小"""
+    directory = os.path.dirname(output) or '.'
+    prefix = os.path.basename(output) + '.'
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(prefix)]
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+def build(args: argparse.Namespace, embedder=None) -> Dict:
+    """
+    执行构建
+    
+    Args:
+        args: 命令行参数
+        embedder: 嵌入器，为None时按环境变量创建AliYunEmbedder
+    
+    Returns:
+        构建报告
+    """
+    started = time.time()
+    embedder = embedder or create_embedder()
+    embedding_dim = embedder.get_embedding_dim()
+    files = expand_inputs(args.corpus)
+    fingerprint = {
+        'files': file_fingerprint(files),
+        'model': getattr(embedder, 'model', None),
+        'embedding_dim': embedding_dim,
+        'target_tokens': args.target_tokens,
+        'overlap_tokens': args.overlap_tokens
+    }
+    work_dir = args.work_dir or f"{args.output}.build"
+    checkpoint = BuildCheckpoint(work_dir, fingerprint, fresh=args.fresh)
+    resumed_segments = len(checkpoint.manifest['segments'])
+    if resumed_segments:
+        logger.info(f"从断点继续：已提交 {resumed_segments} 个分段，{checkpoint.documents} 条记录")
+    
+    # 之前解析失败的文件已不在已提交的记录中，续建时同样跳过，否则记录顺序会错位
+    skipped = {entry['path'] for entry in checkpoint.failed_files}
+    if skipped:
+        logger.warning(f"跳过之前解析失败的 {len(skipped)} 个文件，使用 --fresh 可重新尝试")
+    
+    def on_file(file_report: Dict):
+        if file_report['status'] != 'ok':
+            checkpoint.mark_failed(file_report['path'], file_report['error'])
+    
+    corpus = iter_corpus([item for item in files if os.path.abspath(item[0]) not in skipped],
+                         args.workers or os.cpu_count() or 1, args.memory_limit_mb,
+                         args.target_tokens, args.overlap_tokens, on_file=on_file)
+    try:
+        embedded = embed_segments(corpus, checkpoint, embedder, args.segment_size)
+    finally:
+        # 嵌入失败时立即关闭解析进程池
+        corpus.close()
+    
+    assemble_started = time.time()
+    store = assemble_index(checkpoint, args.output, embedding_dim, args.index_factory,
+                           args.rerank_dtype, args.coarse_dim, args.train_size)
+    manifest = checkpoint.manifest
+    elapsed = time.time() - started
+    report = {
+        'output': args.output,
+        'files': len(files),
+        'failed_files': checkpoint.failed_files,
+        'documents': len(store.documents),
+        'segments': len(manifest['segments']),
+        'resumed_segments': resumed_segments,
+        'embedded_this_run': embedded,
+        'api_calls': manifest['api_calls'],
+        'input_tokens': manifest['input_tokens'],
+        'embed_seconds': manifest['embed_seconds'],
+        'embed_docs_per_second': manifest['documents'] / manifest['embed_seconds'] if manifest['embed_seconds'] else 0.0,
+        'assemble_seconds': time.time() - assemble_started,
+        'elapsed_seconds': elapsed,
+        'docs_per_second': embedded / elapsed if elapsed > 0 else 0.0,
+        'output_bytes': output_bytes(args.output),
+        'index': store.get_stats()
+    }
+    with open(f"{args.output}.build.json", 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if not args.keep_segments:
+        shutil.rmtree(work_dir)
+    if args.publish:
+        report['published'] = publish_snapshot(args.publish, args.output, args.keep_snapshots)
+    return report
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="批量构建知识库索引（可断点续建）")
+    parser.add_argument('corpus', nargs='+', help="语料目录、DOCX/XLSX文件或JSONL文件")
+    parser.add_argument('-o', '--output', required=True, help="输出文件路径前缀（VectorStore.save格式）")
+    parser.add_argument('--work-dir', help="分段和清单的工作目录，默认为 {output}.build")
+    parser.add_argument('--segment-size', type=int, default=1000, help="每个分段的记录数")
+    parser.add_argument('--fresh', action='store_true', help="丢弃已有的分段重新构建")
+    parser.add_argument('--keep-segments', action='store_true', help="构建完成后保留工作目录")
+    parser.add_argument('--publish', metavar='SNAPSHOT_DIR',
+                        help="构建完成后将输出发布为该快照目录的当前快照（输出应位于其子目录中）")
+    parser.add_argument('--keep-snapshots', type=int, default=2, help="发布时保留的快照目录数")
+    parser.add_argument('--index-factory', default=os.getenv("KB_INDEX_FACTORY", "Flat"),
+                        help="FAISS索引工厂字符串或存储预设名")
+    parser.add_argument('--rerank-dtype', default=os.getenv("KB_RERANK_DTYPE") or None,
+                        choices=['float16', 'float32'], help="重排序副本精度")
+    parser.add_argument('--coarse-dim', type=int, default=int(os.getenv("KB_COARSE_DIM", "0")) or None,
+                        help="粗筛维度")
+    parser.add_argument('--train-size', type=int, default=50000, help="需要训练的索引使用的最少训练向量数")
+    parser.add_argument('--workers', type=int, help="解析进程数，默认为CPU核数")
+    parser.add_argument('--memory-limit-mb', type=int, help="每个解析进程的内存上限（MB）")
+    parser.add_argument('--target-tokens', type=int, default=400, help="DOCX分块的目标token数")
+    parser.add_argument('--overlap-tokens', type=int, default=50, help="DOCX分块的重叠token数")
+    args = parser.parse_args(argv)
+    if args.segment_size < 1:
+        parser.error("--segment-size必须为正数")
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    try:
+        report = build(args)
+    except KeyboardInterrupt:
+        print("\n构建已中断，已提交的分段已保存，重新运行同一命令即可继续", file=sys.stderr)
+        return 130
+    except Exception as e:
+        logger.error(f"构建失败: {e}")
+        print("已提交的分段已保存，排除问题后重新运行同一命令即可从断点继续", file=sys.stderr)
+        return 1
+    
+    print(f"✅ 构建完成: {report['documents']} 个文档，{report['segments']} 个分段"
+          f"（续用 {report['resumed_segments']} 个）")
+    print(f"   嵌入: {report['api_calls']} 次API调用，{report['input_tokens']} tokens，"
+          f"{report['embed_docs_per_second']:.1f} 文档/秒")
+    print(f"   输出: {report['output']}（{report['output_bytes'] / 1024 / 1024:.1f} MB），"
+          f"报告: {report['output']}.build.json")
+    for failed in report['failed_files']:
+        print(f"   ⚠️ 解析失败已跳过: {failed['path']}: {failed['error']}", file=sys.stderr)
+    if 'published' in report:
+        print(f"   已发布为当前快照: {report['published']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+from text_utils import estimate_tokens, split_by_tokens
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 句末标点（含中文标点），后面可跟引号、括号和空白；英文句点要求后面是空白，避免切开小数和缩写
+_SENTENCE_END = re.compile(r'(?:[。！？!?；;…]+|\.(?=\s))[”’」』）)"\']*\s*')
+
+def split_sentences(text: str) -> List[str]:
+    """
+    按句末标点切分文本
+    
+    Args:
+        text: 输入文本
+    
+    Returns:
+        句子列表，首尾相接即为原文本（空白保留在前一个句子末尾）
+    """
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        if match.end() > start:
+            sentences.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+class Chunker:
+    """
+    基于token预算的文本分块器
+    
+    将一个文档的段落序列切分为长度接近target_tokens的块：相邻的短段落合并到同一块，
+    过长的段落按句子边界拆分，单个句子仍超限时按token数硬切分。相邻块之间重复
+    末尾不超过overlap_tokens的完整句子，避免跨块的内容在检索时丢失上下文。
+    
+    段落按换行符拼接视为父文档，每个块的元数据记录其在父文档中的字符区间和段落区间，
+    检索命中后可据此定位原文。
+    """
+    
+    def __init__(self, target_tokens: int = 400, overlap_tokens: int = 50):
+        """
+        初始化分块器
+        
+        Args:
+            target_tokens: 每块的目标（最大）估计token数
+            overlap_tokens: 相邻块之间重叠的最大估计token数，0表示不重叠
+        """
+        if target_tokens < 1:
+            raise ValueError("target_tokens必须为正数")
+        if not 0 <= overlap_tokens < target_tokens:
+            raise ValueError("overlap_tokens必须在0和target_tokens之间")
+        self.target_tokens = target_tokens
+        self.overlap_tokens = overlap_tokens
+    
+    def _units(self, paragraphs: Iterable[str]) -> Iterator[Tuple[str, int, int, int]]:
+        """
+        将段落流切分为不超过目标大小的句子单元
+        
+        Returns:
+            依次产生 (文本, 父文档中的起始字符位置, 段落序号, 估计token数)
+        """
+        position = 0
+        for paragraph_index, paragraph in enumerate(paragraphs):
+            for sentence in split_sentences(paragraph):
+                for piece in split_by_tokens(sentence, self.target_tokens):
+                    yield piece, position, paragraph_index, estimate_tokens(piece)
+                    position += len(piece)
+            position += 1  # 段落之间的换行符
+    
+    @staticmethod
+    def _build_chunk(units: List[Tuple[str, int, int, int]]) -> Tuple[str, Dict]:
+        """由连续的句子单元拼出块文本和位置信息"""
+        parts = [units[0][0]]
+        for previous, unit in zip(units, units[1:]):
+            # 跨段落时补回段落之间的换行符（空段落各占一个）
+            parts.append('\n' * (unit[1] - previous[1] - len(previous[0])) + unit[0])
+        text = ''.join(parts)
+        
+        # 去掉首尾空白，字符区间随之调整
+        stripped = text.strip()
+        char_start = units[0][1] + len(text) - len(text.lstrip())
+        location = {
+            'char_start': char_start,
+            'char_end': char_start + len(stripped),
+            'paragraph_start': units[0][2],
+            'paragraph_end': units[-1][2]
+        }
+        return stripped, location
+    
+    def chunk(self, paragraphs: Iterable[str], metadata: Optional[Dict] = None,
+              parent_id: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        对一个文档的段落流分块（边读取边产生，不需要一次读入整个文档）
+        
+        Args:
+            paragraphs: 段落的可迭代对象，如file_processor.iter_uploaded_file的结果
+            metadata: 所有块共用的元数据
+            parent_id: 父文档标识（如文件名），写入每个块的元数据
+        
+        Returns:
+            依次产生 (块文本, 元数据)，可直接传给KnowledgeBase.add_documents_stream
+        """
+        base = dict(metadata or {})
+        if parent_id is not None:
+            base['parent_id'] = parent_id
+        
+        window = []
+        tokens = 0
+        chunk_index = 0
+        
+        def emit():
+            text, location = self._build_chunk(window)
+            return text, {**base, 'chunk_index': chunk_index, **location}
+        
+        for unit in self._units(paragraphs):
+            unit_tokens = unit[3]
+            if window and tokens + unit_tokens > self.target_tokens:
+                text, chunk_metadata = emit()
+                if text:
+                    yield text, chunk_metadata
+                    chunk_index += 1
+                
+                # 保留末尾的完整句子作为下一块的开头，并保证加入新单元后不超过目标大小
+                overlap = []
+                overlap_tokens = 0
+                for previous in reversed(window[1:]):
+                    if overlap_tokens + previous[3] > self.overlap_tokens:
+                        break
+                    overlap.insert(0, previous)
+                    overlap_tokens += previous[3]
+                while overlap and overlap_tokens + unit_tokens > self.target_tokens:
+                    overlap_tokens -= overlap.pop(0)[3]
+                window, tokens = overlap, overlap_tokens
+            
+            window.append(unit)
+            tokens += unit_tokens
+        
+        if window:
+            text, chunk_metadata = emit()
+            if text:
+                yield text, chunk_metadata
+    
+    def chunk_text(self, text: str, metadata: Optional[Dict] = None,
+                   parent_id: Optional[str] = None) -> List[Tuple[str, Dict]]:
+        """
+        对单个长文本分块，字符区间对应原文本
+        
+        Args:
+            text: 输入文本
+            metadata: 所有块共用的元数据
+            parent_id: 父文档标识
+        
+        Returns:
+            (块文本, 元数据) 列表
+        """
+        return list(self.chunk(text.split('\n'), metadata, parent_id))
@@ -0,0 +1 @@
+# 使测试可以直接导入仓库根目录下的模块
@@ -94,7 +94,7 @@ def main():
     # 加载知识库演示
     kb_new = KnowledgeBase()
     kb_new.load(save_path)
-    print(f"知识库加载成功，包含 {len(kb_new.vector_store.texts)} 个文档")
+    print(f"知识库加载成功，包含 {kb_new.vector_store.get_stats()['total_documents']} 个文档")
     
     print("\n✅ 演示完成！")
     print("\n下一步建议:")
@@ -0,0 +1,190 @@
+import json
+import mmap
+import os
+import numpy as np
+from typing import Dict, Iterator, Optional, Tuple
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# {filepath}.docstore 文件头：魔数 + 文档ID数量（int64），之后为偏移量数组和数据块
+DOCSTORE_MAGIC = b'KBDOCS01'
+HEADER_SIZE = len(DOCSTORE_MAGIC) + 8
+
+def validate_metadata(metadata: Optional[Dict]):
+    """
+    检查元数据能否保存为JSON并原样读回
+    
+    Args:
+        metadata: 元数据字典，None表示空元数据
+    
+    Raises:
+        ValueError: 元数据不是字典，或包含无法原样往返JSON的值（如日期、numpy数值、
+            元组、非字符串键、NaN）
+    """
+    if metadata is None:
+        return
+    if not isinstance(metadata, dict):
+        raise ValueError(f"元数据必须是字典，实际为 {type(metadata).__name__}")
+    try:
+        restored = json.loads(json.dumps(metadata, ensure_ascii=False, allow_nan=False))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"元数据无法保存为JSON: {e}")
+    if restored != metadata:
+        raise ValueError(f"元数据保存为JSON后无法原样读回（键必须为字符串，值不能为元组等类型）: {metadata!r}")
+
+class DocumentStore:
+    """
+    文档文本和元数据存储
+    
+    磁盘格式为单个文件（{filepath}.docstore）：文件头、偏移量数组和数据块，文档ID即数组下标。
+    偏移量和数据块在同一个文件中，保存时一次原子替换，读取者不会把新数据块与旧偏移量配对。
+    加载时以内存映射方式打开，只有被访问的文档才会解码，加载耗时与文档数量无关。
+    加载后新增或修改的文档保存在内存中，直到下次保存。
+    """
+    
+    def __init__(self):
+        """初始化空的文档存储"""
+        # 已保存的文档: (偏移量数组, 数据块)，偏移量长度为文档数+1，数据块加载后为mmap；
+        # 两者放在同一个元组中整体替换，保证并发读取时总是成对一致
+        self._base = (np.zeros(1, dtype=np.int64), b'')
+        self._overlay = {}  # 加载后新增或修改的文档: ID -> (文本, 元数据)
+        self._deleted = set()  # 已保存但被删除的文档ID
+        self._size = 0  # 文档ID上界（不含）
+        self._count = 0  # 有效文档数量
+    
+    @staticmethod
+    def _encode(text: str, metadata: Dict) -> bytes:
+        """将文档编码为UTF-8 JSON记录（元数据需已通过validate_metadata检查）"""
+        return json.dumps([text, metadata], ensure_ascii=False).encode('utf-8')
+    
+    @property
+    def _base_count(self) -> int:
+        """已保存到磁盘的文档ID数量"""
+        return len(self._base[0]) - 1
+    
+    def _in_base(self, doc_id: int, offsets: Optional[np.ndarray] = None) -> bool:
+        """文档是否存在于已保存的数据块中"""
+        if offsets is None:
+            offsets = self._base[0]
+        return (0 <= doc_id < len(offsets) - 1 and doc_id not in self._deleted
+                and offsets[doc_id + 1] > offsets[doc_id])
+    
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self._overlay or self._in_base(doc_id)
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def get(self, doc_id: int) -> Optional[Tuple[str, Dict]]:
+        """
+        获取文档
+        
+        Args:
+            doc_id: 文档ID
+        
+        Returns:
+            (文本, 元数据)，文档不存在时返回None
+        """
+        document = self._overlay.get(doc_id)
+        if document is not None:
+            return document
+        offsets, blob = self._base
+        if not self._in_base(doc_id, offsets):
+            return None
+        start, end = int(offsets[doc_id]), int(offsets[doc_id + 1])
+        text, metadata = json.loads(bytes(blob[start:end]).decode('utf-8'))
+        return text, metadata
+    
+    def put(self, doc_id: int, text: str, metadata: Optional[Dict] = None):
+        """新增或替换文档"""
+        if doc_id not in self:
+            self._count += 1
+        self._overlay[doc_id] = (text, metadata or {})
+        self._deleted.discard(doc_id)
+        self._size = max(self._size, doc_id + 1)
+    
+    def delete(self, doc_id: int) -> bool:
+        """删除文档，返回文档是否存在"""
+        if doc_id not in self:
+            return False
+        self._overlay.pop(doc_id, None)
+        if doc_id < self._base_count:
+            self._deleted.add(doc_id)
+        self._count -= 1
+        return True
+    
+    def ids(self) -> Iterator[int]:
+        """按顺序遍历所有有效的文档ID"""
+        for doc_id in range(self._size):
+            if doc_id in self:
+                yield doc_id
+    
+    def save(self, filepath: str):
+        """
+        保存为 {filepath}.docstore，保存后切换为内存映射读取
+        
+        先写入临时文件再原子替换，正在映射旧文件的进程不受影响。偏移量为文件内的绝对位置，
+        先写数据块，最后回填文件头和偏移量。
+        """
+        size = self._size
+        data_start = HEADER_SIZE + 8 * (size + 1)
+        offsets = np.zeros(size + 1, dtype='<i8')
+        offsets[0] = data_start
+        path = f"{filepath}.docstore"
+        with open(f"{path}.tmp", 'wb') as f:
+            f.seek(data_start)
+            position = data_start
+            for doc_id in range(size):
+                document = self.get(doc_id)
+                if document is not None:
+                    record = self._encode(*document)
+                    f.write(record)
+                    position += len(record)
+                offsets[doc_id + 1] = position
+            f.seek(0)
+            f.write(DOCSTORE_MAGIC)
+            f.write(np.array(size, dtype='<i8').tobytes())
+            f.write(offsets.tobytes())
+        os.replace(f"{path}.tmp", path)
+        self.load(filepath)
+    
+    def load(self, filepath: str):
+        """
+        以内存映射方式打开已保存的 {filepath}.docstore
+        
+        偏移量和数据块从同一个打开的文件映射，加载期间文件被替换也不会混用新旧内容。
+        旧的映射不主动关闭，由垃圾回收在没有读取者引用时释放。
+        """
+        path = f"{filepath}.docstore"
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE or header[:len(DOCSTORE_MAGIC)] != DOCSTORE_MAGIC:
+                raise ValueError(f"文档存储文件格式错误: {path}")
+            size = int(np.frombuffer(header, dtype='<i8', offset=len(DOCSTORE_MAGIC))[0])
+            offsets = np.memmap(f, dtype='<i8', mode='r', offset=HEADER_SIZE, shape=(size + 1,))
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        self._base = (offsets, blob)
+        self._overlay = {}
+        self._deleted = set()
+        self._size = self._base_count
+        self._count = int(np.count_nonzero(np.diff(offsets)))
+        logger.info(f"文档存储已映射: {filepath}，包含 {self._count} 个文档")
+    
+    @classmethod
+    def from_dicts(cls, texts: Dict[int, str], metadata: Dict[int, Dict]) -> 'DocumentStore':
+        """由ID到文本、元数据的字典构造（用于加载旧格式文件）"""
+        store = cls()
+        for doc_id, text in texts.items():
+            store.put(doc_id, text, metadata.get(doc_id, {}))
+        return store
+    
+    def close(self):
+        """释放内存映射并清空存储"""
+        blob = self._base[1]
+        self.__init__()
+        if isinstance(blob, mmap.mmap):
+            blob.close()
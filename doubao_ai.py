@@ -1,6 +1,6 @@
 import os
 from openai import OpenAI
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
 import logging
 
 # 配置日志
@@ -64,6 +64,58 @@ class DoubaoAI:
             logger.error(f"豆包AI调用失败: {e}")
             raise
     
+    def chat_completion_stream(self, 
+                              model: str, 
+                              messages: List[Dict], 
+                              **kwargs) -> Iterator[str]:
+        """
+        以流式方式调用豆包AI进行聊天补全
+        
+        Args:
+            model: 模型端点ID
+            messages: 消息列表
+            **kwargs: 其他参数
+            
+        Returns:
+            逐段产出AI回复内容的迭代器
+        """
+        if not self.client:
+            raise ValueError("客户端未初始化")
+        
+        try:
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **kwargs
+            )
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        yield content
+            finally:
+                # 客户端断开时生成器被关闭，同时关闭上游连接
+                stream.close()
+        except Exception as e:
+            logger.error(f"豆包AI流式调用失败: {e}")
+            raise
+    
+    @staticmethod
+    def _build_qa_messages(query: str, context: str, system_prompt: Optional[str] = None) -> List[Dict]:
+        """构建知识库问答的消息列表"""
+        if not system_prompt:
+            system_prompt = """你是一个专业的AI助手，请根据提供的知识库上下文内容回答用户的问题。
+如果上下文中有相关信息，请基于上下文回答；如果没有相关信息，请如实告知用户你不知道。
+请保持回答准确、简洁、有帮助。"""
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"知识库上下文：\n{context}\n\n用户问题：{query}"}
+        ]
+    
     def knowledge_base_qa(self, 
                          model: str,
                          query: str, 
@@ -81,18 +133,29 @@ class DoubaoAI:
         Returns:
             AI回复内容
         """
-        if not system_prompt:
-            system_prompt = """你是一个专业的AI助手，请根据提供的知识库上下文内容回答用户的问题。
-如果上下文中有相关信息，请基于上下文回答；如果没有相关信息，请如实告知用户你不知道。
-请保持回答准确、简洁、有帮助。"""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"知识库上下文：\n{context}\n\n用户问题：{query}"}
-        ]
-        
+        messages = self._build_qa_messages(query, context, system_prompt)
         return self.chat_completion(model, messages)
     
+    def knowledge_base_qa_stream(self, 
+                                model: str,
+                                query: str, 
+                                context: str,
+                                system_prompt: Optional[str] = None) -> Iterator[str]:
+        """
+        基于知识库上下文进行流式问答
+        
+        Args:
+            model: 模型端点ID
+            query: 用户查询
+            context: 知识库检索到的上下文
+            system_prompt: 系统提示词
+            
+        Returns:
+            逐段产出AI回复内容的迭代器
+        """
+        messages = self._build_qa_messages(query, context, system_prompt)
+        return self.chat_completion_stream(model, messages)
+    
     def multi_turn_conversation(self, 
                                model: str,
                                conversation_history: List[Dict],
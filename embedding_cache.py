@@ -0,0 +1,240 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Optional
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本：Unicode NFKC、合并空白、去除首尾空白"""
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+def make_cache_key(text: str, model: str, dimensions: int, variant: str = '') -> str:
+    """
+    由文本、模型名和向量维度生成缓存键
+    
+    Args:
+        text: 文本
+        model: 嵌入模型名
+        dimensions: 向量维度
+        variant: 影响嵌入结果的其他处理参数（如超长文本的处理方式），为空时不参与计算，
+            与未使用该参数时生成的键相同
+    
+    Returns:
+        十六进制的SHA-256摘要
+    """
+    key = f"{model}\x00{dimensions}\x00{text}"
+    if variant:
+        key = f"{variant}\x00{key}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class SQLiteEmbeddingStore:
+    """基于SQLite的持久化嵌入向量存储，可被多个进程（如gunicorn worker）共享"""
+    
+    def __init__(self, path: str, table: str = 'embeddings'):
+        """
+        初始化SQLite存储
+        
+        Args:
+            path: 数据库文件路径
+            table: 表名，不同用途的缓存可使用不同的表
+        """
+        if not re.fullmatch(r'\w+', table):
+            raise ValueError(f"非法的表名: {table}")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        
+        conn = self._connection()
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                     "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)")
+        conn.commit()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程使用独立的连接，WAL模式允许多进程并发读"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        读取向量
+        
+        Args:
+            key: 缓存键
+            max_age: 最大有效期（秒），为None时不过期
+        
+        Returns:
+            向量，不存在或已过期时返回None
+        """
+        return self.get_many([key], max_age).get(key)
+    
+    def get_many(self, keys, max_age: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """批量读取向量，返回命中的键到向量的映射"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        conn = self._connection()
+        # SQLite单条语句的参数数量有限，分批查询
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT key, vector, created_at FROM {self.table} WHERE key IN ({placeholders})",
+                chunk
+            ).fetchall()
+            now = time.time()
+            for key, blob, created_at in rows:
+                if max_age is None or now - created_at <= max_age:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+    
+    def put(self, key: str, vector: np.ndarray):
+        """写入向量"""
+        self.put_many({key: vector})
+    
+    def put_many(self, items: Dict[str, np.ndarray]):
+        """批量写入向量"""
+        if not items:
+            return
+        now = time.time()
+        conn = self._connection()
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {self.table} (key, vector, created_at) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+        )
+        conn.commit()
+    
+    def __len__(self) -> int:
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+class QueryEmbeddingCache:
+    """
+    两级查询嵌入缓存
+    
+    第一级为进程内LRU缓存（带过期时间），第二级为共享的SQLite文件，
+    同一台机器上的所有worker进程都可以读取其他进程写入的查询向量。
+    """
+    
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600,
+                 path: Optional[str] = None, disk_ttl: Optional[float] = 7 * 24 * 3600):
+        """
+        初始化查询缓存
+        
+        Args:
+            max_entries: 进程内缓存的最大条目数
+            ttl: 进程内缓存条目的有效期（秒）
+            path: SQLite文件路径，为None时只使用进程内缓存
+            disk_ttl: 磁盘缓存条目的有效期（秒），为None时不过期
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        self.disk = SQLiteEmbeddingStore(path, table='query_embeddings') if path else None
+        self._memory = OrderedDict()  # 缓存键 -> (写入时间, 向量)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key_for(query: str, model: str, dimensions: int) -> str:
+        """由规范化后的查询文本、模型名和维度生成缓存键"""
+        return make_cache_key(normalize_query(query), model, dimensions)
+    
+    def _get_memory(self, key: str) -> Optional[np.ndarray]:
+        """读取进程内缓存，过期条目会被移除"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            created_at, vector = entry
+            if time.time() - created_at > self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return vector
+    
+    def _put_memory(self, key: str, vector: np.ndarray):
+        """写入进程内缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._memory[key] = (time.time(), vector)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+    
+    def get(self, query: str, model: str, dimensions: int) -> Optional[np.ndarray]:
+        """
+        读取查询向量，依次查询进程内缓存和磁盘缓存
+        
+        Args:
+            query: 查询文本
+            model: 嵌入模型名称
+            dimensions: 向量维度
+        
+        Returns:
+            查询向量，未命中时返回None
+        """
+        key = self.key_for(query, model, dimensions)
+        vector = self._get_memory(key)
+        if vector is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return vector
+        
+        if self.disk is not None:
+            try:
+                vector = self.disk.get(key, self.disk_ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"读取查询缓存失败: {e}")
+                vector = None
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put_memory(key, vector)
+                return vector
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, query: str, model: str, dimensions: int, vector: np.ndarray):
+        """写入查询向量到两级缓存"""
+        key = self.key_for(query, model, dimensions)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._put_memory(key, vector)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, vector)
+            except sqlite3.Error as e:
+                logger.warning(f"写入查询缓存失败: {e}")
+    
+    def get_stats(self) -> Dict:
+        """获取缓存命中统计"""
+        with self._lock:
+            memory_hits, disk_hits, misses = self.memory_hits, self.disk_hits, self.misses
+            memory_entries = len(self._memory)
+        lookups = memory_hits + disk_hits + misses
+        return {
+            'memory_hits': memory_hits,
+            'disk_hits': disk_hits,
+            'misses': misses,
+            'hit_rate': (memory_hits + disk_hits) / lookups if lookups else 0.0,
+            'memory_entries': memory_entries
+        }
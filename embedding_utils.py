@@ -1,5 +1,4 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from typing import List, Tuple
 import logging
 
@@ -26,6 +25,8 @@ class TextEmbedder:
     def _load_model(self):
         """加载预训练模型"""
         try:
+            # 延迟导入，仅使用相似度计算的轻量部署无需安装sentence-transformers
+            from sentence_transformers import SentenceTransformer
             self.model = SentenceTransformer(self.model_name)
             # 测试获取向量维度
             test_embedding = self.model.encode(["测试文本"])
@@ -88,6 +89,88 @@ def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
     norm2 = np.linalg.norm(vec2)
     return dot_product / (norm1 * norm2)
 
+def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    """
+    按行L2标准化向量矩阵，标准化后内积即为余弦相似度
+    
+    Args:
+        vectors: 向量或向量矩阵
+        
+    Returns:
+        float32类型的标准化矩阵 (n_samples, dim)，零向量保持为零
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _merge_top_k(scores: np.ndarray, indices: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """从每行候选中选出前k个（argpartition选取，仅对k个结果排序）"""
+    if scores.shape[1] > top_k:
+        part = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        indices = np.take_along_axis(indices, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+def top_k_similar(
+    query_vectors: np.ndarray,
+    vectors: np.ndarray,
+    top_k: int = 5,
+    chunk_size: int = 65536,
+    query_chunk_size: int = 1024,
+    normalized: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    分块计算多个查询向量在向量集合中的前k个最相似向量
+    
+    向量集合按chunk_size分块读取（可以是np.memmap，无需整体载入内存），
+    每块通过一次矩阵乘法计算相似度，并与当前的前k个结果合并。
+    
+    Args:
+        query_vectors: 查询向量或矩阵 (n_queries, dim)
+        vectors: 向量集合 (n_samples, dim)
+        top_k: 每个查询返回的结果数
+        chunk_size: 每次处理的向量集合行数
+        query_chunk_size: 每次处理的查询数
+        normalized: 向量集合是否已标准化，为False时逐块标准化
+        
+    Returns:
+        (索引矩阵, 相似度矩阵)，形状均为 (n_queries, min(top_k, n_samples))，
+        按相似度降序排列
+    """
+    queries = normalize_vectors(query_vectors)
+    n_samples = len(vectors)
+    k = min(top_k, n_samples)
+    if k <= 0:
+        empty = np.empty((len(queries), 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    
+    all_indices = np.empty((len(queries), k), dtype=np.int64)
+    all_scores = np.empty((len(queries), k), dtype=np.float32)
+    
+    for q_start in range(0, len(queries), query_chunk_size):
+        q_block = queries[q_start:q_start + query_chunk_size]
+        best_scores = np.empty((len(q_block), 0), dtype=np.float32)
+        best_indices = np.empty((len(q_block), 0), dtype=np.int64)
+        
+        for start in range(0, n_samples, chunk_size):
+            block = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            if not normalized:
+                block = normalize_vectors(block)
+            scores = q_block @ block.T
+            indices = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            best_scores, best_indices = _merge_top_k(
+                np.hstack([best_scores, scores]),
+                np.hstack([best_indices, indices]),
+                k
+            )
+        
+        all_scores[q_start:q_start + len(q_block)] = best_scores
+        all_indices[q_start:q_start + len(q_block)] = best_indices
+    
+    return all_indices, all_scores
+
 def find_similar_vectors(
     query_vector: np.ndarray, 
     vectors: np.ndarray, 
@@ -104,18 +187,8 @@ def find_similar_vectors(
     Returns:
         (索引列表, 相似度分数列表)
     """
-    similarities = []
-    for i, vector in enumerate(vectors):
-        similarity = cosine_similarity(query_vector, vector)
-        similarities.append((i, similarity))
-    
-    # 按相似度降序排序
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    
-    indices = [idx for idx, _ in similarities[:top_k]]
-    scores = [score for _, score in similarities[:top_k]]
-    
-    return indices, scores
+    indices, scores = top_k_similar(query_vector, vectors, top_k)
+    return indices[0].tolist(), scores[0].tolist()
 
 if __name__ == "__main__":
     # 测试代码
@@ -1,13 +1,120 @@
 import io
+from datetime import date, datetime
 from docx import Document
-import pandas as pd
-from typing import List, Tuple
+from openpyxl import load_workbook
+from typing import Dict, Iterator, List, Tuple
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _open_binary(file):
+    """可随机访问的文件对象直接使用，否则读入内存"""
+    if isinstance(file, str) or (hasattr(file, 'seekable') and file.seekable()):
+        return file
+    return io.BytesIO(file.read())
+
+def iter_docx_paragraphs(file) -> Iterator[str]:
+    """
+    逐段产生DOCX文件中的非空段落
+    
+    Args:
+        file: 文件路径或上传的文件对象
+    
+    Returns:
+        段落文本的生成器
+    """
+    doc = Document(_open_binary(file))
+    count = 0
+    for paragraph in doc.paragraphs:
+        text = paragraph.text.strip()
+        if text:  # 忽略空段落
+            count += 1
+            yield text
+    logger.info(f"从DOCX文件中提取了 {count} 个段落")
+
+def _format_cell(value) -> str:
+    """将单元格的值转换为文本，整数值的浮点数去掉小数部分"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime) and (value.hour or value.minute or value.second):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return str(value).strip()
+
+def iter_xlsx_records(file) -> Iterator[Tuple[str, Dict]]:
+    """
+    以只读流式方式逐行读取XLSX文件的所有工作表
+    
+    每个工作表的第一个非空行作为表头，之后每一行生成一条记录，文本形如
+    "[工作表] 列名: 值；列名: 值"，使每条记录脱离表格后仍保留字段含义。
+    openpyxl只读模式按行解析XML，内存占用与工作表大小无关。
+    
+    Args:
+        file: 文件路径或上传的文件对象
+    
+    Returns:
+        (记录文本, {"sheet": 工作表名, "row": 行号}) 的生成器
+    """
+    workbook = load_workbook(_open_binary(file), read_only=True, data_only=True)
+    count = 0
+    try:
+        for sheet in workbook.worksheets:
+            header = None
+            for row_number, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+                values = [_format_cell(value) for value in row]
+                if not any(values):
+                    continue
+                if header is None:
+                    header = [value or f"列{i + 1}" for i, value in enumerate(values)]
+                    continue
+                
+                fields = []
+                for i, value in enumerate(values):
+                    if value:
+                        name = header[i] if i < len(header) else f"列{i + 1}"
+                        fields.append(f"{name}: {value}")
+                count += 1
+                yield f"[{sheet.title}] " + "；".join(fields), {'sheet': sheet.title, 'row': row_number}
+    finally:
+        workbook.close()
+    logger.info(f"从XLSX文件中提取了 {count} 条记录")
+
+def iter_xlsx_texts(file) -> Iterator[str]:
+    """
+    逐行产生XLSX文件中的记录文本（格式见iter_xlsx_records）
+    
+    Args:
+        file: 文件路径或上传的文件对象
+    
+    Returns:
+        记录文本的生成器
+    """
+    for text, _ in iter_xlsx_records(file):
+        yield text
+
+def iter_uploaded_file(file, file_type: str) -> Iterator[str]:
+    """
+    根据文件类型逐条产生文件中的文本，供流水线边解析边嵌入
+    
+    Args:
+        file: 文件路径或上传的文件对象
+        file_type: 文件类型 ('docx' 或 'xlsx')
+    
+    Returns:
+        文本内容的生成器
+    """
+    if file_type == 'docx':
+        return iter_docx_paragraphs(file)
+    elif file_type == 'xlsx':
+        return iter_xlsx_texts(file)
+    else:
+        raise ValueError(f"不支持的文件类型: {file_type}")
+
 def process_docx_file(file) -> List[str]:
     """
     处理DOCX文件，提取文本内容
@@ -19,13 +126,7 @@ def process_docx_file(file) -> List[str]:
         提取的文本段落列表
     """
     try:
-        doc = Document(io.BytesIO(file.read()))
-        texts = []
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():  # 忽略空段落
-                texts.append(paragraph.text.strip())
-        logger.info(f"从DOCX文件中提取了 {len(texts)} 个段落")
-        return texts
+        return list(iter_docx_paragraphs(file))
     except Exception as e:
         logger.error(f"处理DOCX文件时出错: {e}")
         raise
@@ -41,19 +142,7 @@ def process_xlsx_file(file) -> List[str]:
         提取的文本内容列表
     """
     try:
-        df = pd.read_excel(io.BytesIO(file.read()))
-        texts = []
-        
-        # 提取所有单元格的文本内容
-        for column in df.columns:
-            for cell in df[column].dropna():
-                if isinstance(cell, str) and cell.strip():
-                    texts.append(cell.strip())
-                elif not isinstance(cell, str) and not pd.isna(cell):
-                    texts.append(str(cell).strip())
-        
-        logger.info(f"从XLSX文件中提取了 {len(texts)} 条文本")
-        return texts
+        return list(iter_xlsx_texts(file))
     except Exception as e:
         logger.error(f"处理XLSX文件时出错: {e}")
         raise
@@ -0,0 +1,474 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import logging
+from chunker import Chunker
+from document_store import validate_metadata
+from text_utils import estimate_tokens
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # 阶段结束标记
+
+# 批量导入支持的文件扩展名
+SUPPORTED_EXTENSIONS = ('.docx', '.xlsx')
+
+class IngestPipeline:
+    """
+    流式文档导入流水线：解析 → 分批 → 嵌入 → 写入索引
+    
+    解析和嵌入分别在独立线程中运行，阶段之间用有界队列衔接：文件解析与嵌入API请求重叠进行，
+    队列写满时上游阶段阻塞，内存中最多只有 queue_size 个批次的文本和向量。
+    写入索引和进度回调在调用run的线程中执行（Streamlit等框架要求界面更新在主线程进行）。
+    """
+    
+    def __init__(self, knowledge_base, batch_size: int = 64, max_batch_tokens: int = 16000,
+                 queue_size: int = 4, progress_callback: Optional[Callable[[Dict], None]] = None):
+        """
+        初始化导入流水线
+        
+        Args:
+            knowledge_base: KnowledgeBase实例，使用其embedder和vector_store
+            batch_size: 每批的最大文档数
+            max_batch_tokens: 每批的最大估计token数
+            queue_size: 每个阶段队列的最大批次数
+            progress_callback: 每写入一批后调用，参数为进度字典（见get_progress）
+        """
+        if batch_size < 1 or max_batch_tokens < 1 or queue_size < 1:
+            raise ValueError("batch_size、max_batch_tokens和queue_size必须为正数")
+        self.knowledge_base = knowledge_base
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.queue_size = queue_size
+        self.progress_callback = progress_callback
+        self._reset()
+    
+    def _reset(self):
+        """重置运行状态"""
+        self.parsed = 0
+        self.embedded = 0
+        self.indexed = 0
+        self.batches = 0
+        self.parse_done = False
+        self._started_at = time.time()
+        self._stop = threading.Event()
+        self._errors = []
+    
+    def get_progress(self) -> Dict:
+        """
+        获取当前进度
+        
+        Returns:
+            parsed/embedded/indexed为各阶段已完成的文档数，parse_done表示解析是否结束
+            （结束后parsed即为文档总数）
+        """
+        elapsed = time.time() - self._started_at
+        return {
+            'parsed': self.parsed,
+            'embedded': self.embedded,
+            'indexed': self.indexed,
+            'batches': self.batches,
+            'parse_done': self.parse_done,
+            'elapsed': elapsed,
+            'docs_per_second': self.indexed / elapsed if elapsed > 0 else 0.0
+        }
+    
+    def _put(self, q: queue.Queue, item) -> bool:
+        """写入队列，队列满时等待；流水线中止时放弃并返回False"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _get(self, q: queue.Queue):
+        """读取队列，流水线中止时返回结束标记"""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+    
+    def _fail(self, error: BaseException):
+        """记录阶段异常并中止流水线"""
+        self._errors.append(error)
+        self._stop.set()
+    
+    def _parse_stage(self, documents: Iterable, default_metadata: Dict, batches: queue.Queue):
+        """遍历文档来源并按文档数和token预算分批"""
+        try:
+            texts, metadata, tokens = [], [], 0
+            for document in documents:
+                if self._stop.is_set():
+                    return
+                if isinstance(document, str):
+                    text, meta = document, default_metadata
+                else:
+                    text, meta = document
+                    meta = {**default_metadata, **(meta or {})}
+                if not text or not text.strip():
+                    continue
+                validate_metadata(meta)
+                
+                cost = estimate_tokens(text)
+                if texts and (len(texts) >= self.batch_size or tokens + cost > self.max_batch_tokens):
+                    if not self._put(batches, (texts, metadata)):
+                        return
+                    texts, metadata, tokens = [], [], 0
+                texts.append(text)
+                metadata.append(dict(meta))
+                tokens += cost
+                self.parsed += 1
+            
+            if texts and not self._put(batches, (texts, metadata)):
+                return
+            self.parse_done = True
+        except Exception as e:
+            logger.error(f"解析文档时出错: {e}")
+            self._fail(e)
+        finally:
+            self._put(batches, _DONE)
+    
+    def _embed_stage(self, batches: queue.Queue, embedded: queue.Queue):
+        """为每批文本生成嵌入向量"""
+        embedder = self.knowledge_base.embedder
+        try:
+            while True:
+                batch = self._get(batches)
+                if batch is _DONE:
+                    return
+                texts, metadata = batch
+                embeddings = np.asarray(embedder.embed_batch(texts), dtype=np.float32)
+                self.embedded += len(texts)
+                if not self._put(embedded, (texts, metadata, embeddings)):
+                    return
+        except Exception as e:
+            logger.error(f"生成嵌入时出错: {e}")
+            self._fail(e)
+        finally:
+            self._put(embedded, _DONE)
+    
+    def run(self, documents: Iterable[Union[str, Tuple[str, Dict]]],
+            metadata: Optional[Dict] = None) -> List[int]:
+        """
+        运行流水线，直到所有文档写入索引
+        
+        Args:
+            documents: 文本或 (文本, 元数据) 的可迭代对象，可以是边读取边产生的生成器
+            metadata: 所有文档共用的元数据，与每条文档自带的元数据合并
+        
+        Returns:
+            新文档的ID列表
+        """
+        self._reset()
+        batches = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        workers = [
+            threading.Thread(target=self._parse_stage, args=(documents, metadata or {}, batches),
+                             name="ingest-parse", daemon=True),
+            threading.Thread(target=self._embed_stage, args=(batches, embedded),
+                             name="ingest-embed", daemon=True)
+        ]
+        for worker in workers:
+            worker.start()
+        
+        ids = []
+        try:
+            while True:
+                batch = self._get(embedded)
+                if batch is _DONE:
+                    break
+                texts, batch_metadata, embeddings = batch
+                ids.extend(self.knowledge_base.vector_store.add_documents(texts, embeddings, batch_metadata))
+                self.indexed += len(texts)
+                self.batches += 1
+                if self.progress_callback is not None:
+                    self.progress_callback(self.get_progress())
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+        
+        if self._errors:
+            raise self._errors[0]
+        
+        progress = self.get_progress()
+        logger.info(f"流水线导入完成: {self.indexed} 个文档，{self.batches} 批，"
+                    f"耗时 {progress['elapsed']:.2f}s ({progress['docs_per_second']:.1f} 文档/秒)")
+        return ids
+
+def iter_files(paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    展开文件和目录（递归）为待导入的文件列表
+    
+    Args:
+        paths: 文件或目录路径
+    
+    Returns:
+        依次产生 (文件路径, 相对路径)，相对路径作为文档的parent_id
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    # 跳过Office打开文件时产生的 ~$ 临时文件
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.startswith('~$'):
+                        full_path = os.path.join(root, name)
+                        yield full_path, os.path.relpath(full_path, path)
+        else:
+            yield path, os.path.basename(path)
+
+def init_parse_worker(memory_limit_mb: Optional[int]):
+    """解析进程初始化：限制进程的地址空间，超限的文件以MemoryError失败而不是拖垮整台机器"""
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"无法设置解析进程的内存上限: {e}")
+
+def parse_file(path: str, parent_id: str, target_tokens: int, overlap_tokens: int) -> Tuple[List[Tuple[str, Dict]], float]:
+    """
+    在解析进程中提取一个文件的记录（DOCX分块，XLSX按行）
+    
+    Returns:
+        ((文本, 元数据) 列表, 解析耗时秒数)
+    """
+    from file_processor import iter_docx_paragraphs, iter_xlsx_records
+    
+    started = time.time()
+    if path.lower().endswith('.docx'):
+        chunker = Chunker(target_tokens, overlap_tokens)
+        records = list(chunker.chunk(iter_docx_paragraphs(path), parent_id=parent_id))
+    elif path.lower().endswith('.xlsx'):
+        records = [(text, {'parent_id': parent_id, **location})
+                   for text, location in iter_xlsx_records(path)]
+    else:
+        raise ValueError(f"不支持的文件类型: {path}")
+    return records, time.time() - started
+
+def parse_files(files: Iterable[Tuple[str, str]], workers: int, memory_limit_mb: Optional[int] = None,
+                max_pending: Optional[int] = None, target_tokens: int = 400, overlap_tokens: int = 50,
+                ordered: bool = False, local_readers: Optional[Dict[str, Callable]] = None,
+                on_file: Optional[Callable[[Dict], None]] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    在进程池中并行解析文件，依次产生所有记录
+    
+    单个文件解析失败只记入该文件的报告，不影响其他文件；解析进程异常退出（如被系统终止）时
+    在途的文件都记为失败，换一个新的进程池继续。生成器关闭时进程池随之关闭。
+    
+    Args:
+        files: (文件路径, parent_id) 序列
+        workers: 解析进程数
+        memory_limit_mb: 每个解析进程的内存上限（MB，仅Unix），为None时不限制
+        max_pending: 同时在途的文件数，默认为解析进程数的2倍
+        target_tokens: DOCX分块的目标token数
+        overlap_tokens: DOCX分块的重叠token数
+        ordered: 为True时严格按文件顺序产生记录（用于按记录数断点续建），否则按解析完成的顺序
+        local_readers: 扩展名 -> reader(路径, parent_id)，这些文件在当前进程中流式读取，
+            读取异常直接抛出
+        on_file: 每个文件得到结果后、产生其记录前，以该文件的报告调用
+            （path/status/records/parse_seconds/error）
+    
+    Returns:
+        (文本, 元数据) 的生成器
+    """
+    max_pending = max_pending or 2 * workers
+    local_readers = local_readers or {}
+    # 使用spawn启动解析进程：调用方（流水线）已有多个线程，fork可能复制到持有中的锁
+    context = multiprocessing.get_context('spawn')
+    new_executor = lambda: ProcessPoolExecutor(workers, mp_context=context, initializer=init_parse_worker,
+                                               initargs=(memory_limit_mb,))
+    executor = new_executor()
+    generation = 0  # 进程池重建的次数，用于判断失败的任务是否来自当前进程池
+    pending = []  # 按提交顺序排列的 (文件路径, parent_id, future或None, 进程池代数)
+    remaining = iter(files)
+    try:
+        while True:
+            while len(pending) < max_pending:
+                item = next(remaining, None)
+                if item is None:
+                    break
+                path, parent_id = item
+                future = None
+                if os.path.splitext(path)[1].lower() not in local_readers:
+                    future = executor.submit(parse_file, path, parent_id, target_tokens, overlap_tokens)
+                pending.append((path, parent_id, future, generation))
+            if not pending:
+                return
+            
+            if ordered or pending[0][2] is None:
+                entry = pending.pop(0)
+            else:
+                futures = [future for _, _, future, _ in pending if future is not None]
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                entry = next(entry for entry in pending if entry[2] in done)
+                pending.remove(entry)
+            path, parent_id, future, future_generation = entry
+            report = {'path': path, 'status': 'ok', 'records': 0, 'parse_seconds': None, 'error': None}
+            
+            if future is None:
+                if on_file is not None:
+                    on_file(report)
+                started = time.time()
+                reader = local_readers[os.path.splitext(path)[1].lower()]
+                for record in reader(path, parent_id):
+                    report['records'] += 1
+                    yield record
+                report['parse_seconds'] = time.time() - started
+                continue
+            
+            try:
+                file_records, parse_seconds = future.result()
+            except BrokenProcessPool as e:
+                report.update(status='failed', error=f"解析进程异常退出: {e}")
+                if future_generation == generation:
+                    executor.shutdown(wait=False)
+                    executor = new_executor()
+                    generation += 1
+            except Exception as e:
+                report.update(status='failed', error=f"{type(e).__name__}: {e}")
+            else:
+                report.update(records=len(file_records), parse_seconds=parse_seconds)
+            
+            if on_file is not None:
+                on_file(report)
+            if report['status'] != 'ok':
+                logger.error(f"解析文件失败: {path}: {report['error']}")
+                continue
+            logger.info(f"已解析 {path}: {len(file_records)} 条记录，耗时 {parse_seconds:.2f}s")
+            yield from file_records
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def ingest_files(knowledge_base, paths: Iterable[str], metadata: Optional[Dict] = None,
+                 workers: Optional[int] = None, memory_limit_mb: Optional[int] = None,
+                 max_pending: Optional[int] = None, target_tokens: int = 400,
+                 overlap_tokens: int = 50, batch_size: int = 64, max_batch_tokens: int = 16000,
+                 progress_callback: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    批量导入多个文件或目录
+    
+    文件在进程池中并行解析（python-docx/openpyxl解析是CPU密集的纯Python代码，线程无法并行），
+    解析结果按完成顺序送入同一条IngestPipeline进行嵌入和写入索引。同时在解析中或等待写入的
+    文件数不超过max_pending，已解析但未嵌入的记录不会无限堆积在内存中。
+    
+    Args:
+        knowledge_base: KnowledgeBase实例
+        paths: 文件或目录路径
+        metadata: 所有文档共用的元数据
+        workers: 解析进程数，默认为CPU核数
+        memory_limit_mb: 每个解析进程的内存上限（MB，仅Unix），为None时不限制
+        max_pending: 同时在途的文件数，默认为解析进程数的2倍
+        target_tokens: DOCX分块的目标token数
+        overlap_tokens: DOCX分块的重叠token数
+        batch_size: 嵌入批次的最大文档数
+        max_batch_tokens: 嵌入批次的最大估计token数
+        progress_callback: 每写入一批后以进度字典调用
+    
+    Returns:
+        导入报告：ids（新文档ID）、files（每个文件的status/records/parse_seconds/error）、
+        documents、failed_files、elapsed、docs_per_second
+    """
+    files = list(iter_files(paths))
+    workers = workers or os.cpu_count() or 1
+    reports = []
+    started = time.time()
+    
+    pipeline = IngestPipeline(knowledge_base, batch_size, max_batch_tokens, progress_callback=progress_callback)
+    documents = parse_files(files, workers, memory_limit_mb, max_pending, target_tokens, overlap_tokens,
+                            on_file=reports.append)
+    try:
+        ids = pipeline.run(documents, metadata)
+    finally:
+        # 嵌入或写入失败时解析阶段停在生成器中途，立即关闭生成器以关闭进程池，
+        # 不等到异常回溯释放后由垃圾回收处理（run返回前已等待解析线程结束，此时可以安全关闭）
+        documents.close()
+    
+    elapsed = time.time() - started
+    failed = sum(1 for report in reports if report['status'] != 'ok')
+    logger.info(f"批量导入完成: {len(files)} 个文件（失败 {failed} 个），{len(ids)} 个文档，耗时 {elapsed:.2f}s")
+    return {
+        'ids': ids,
+        'files': reports,
+        'documents': len(ids),
+        'failed_files': failed,
+        'elapsed': elapsed,
+        'docs_per_second': len(ids) / elapsed if elapsed > 0 else 0.0
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="批量导入DOCX/XLSX文件并保存知识库（不可续建，大批量构建请用build_index.py）")
+    parser.add_argument('paths', nargs='+', help="文件或目录路径")
+    parser.add_argument('-o', '--output', required=True, help="知识库保存路径前缀（KnowledgeBase.save格式）")
+    parser.add_argument('--append', action='store_true', help="先加载输出路径已有的知识库，再导入新文件")
+    parser.add_argument('--metadata', type=json.loads, default=None,
+                        help='所有文档共用的元数据（JSON对象），如 \'{"source": "制度汇编"}\'')
+    parser.add_argument('--index-factory', default=os.getenv("KB_INDEX_FACTORY", "Flat"),
+                        help="新建知识库时的FAISS索引工厂字符串或存储预设名")
+    parser.add_argument('--workers', type=int, help="解析进程数，默认为CPU核数")
+    parser.add_argument('--memory-limit-mb', type=int, help="每个解析进程的内存上限（MB）")
+    parser.add_argument('--target-tokens', type=int, default=400, help="DOCX分块的目标token数")
+    parser.add_argument('--overlap-tokens', type=int, default=50, help="DOCX分块的重叠token数")
+    parser.add_argument('--batch-size', type=int, default=64, help="嵌入批次的最大文档数")
+    parser.add_argument('--max-batch-tokens', type=int, default=16000, help="嵌入批次的最大估计token数")
+    args = parser.parse_args(argv)
+    if args.metadata is not None and not isinstance(args.metadata, dict):
+        parser.error("--metadata必须是JSON对象")
+    return args
+
+def main(argv: Optional[List[str]] = None, embedder=None) -> int:
+    """
+    命令行入口
+    
+    Args:
+        argv: 命令行参数，为None时读取sys.argv
+        embedder: 嵌入器，为None时按与build_index.py相同的环境变量创建AliYunEmbedder
+    
+    Returns:
+        退出码：全部文件导入成功为0，有文件解析失败为1（其余文件仍会导入并保存）
+    """
+    args = parse_args(argv)
+    from vector_store import KnowledgeBase
+    if embedder is None:
+        from build_index import create_embedder
+        embedder = create_embedder()
+    
+    knowledge_base = KnowledgeBase(embedder=embedder, index_factory=args.index_factory)
+    if args.append:
+        knowledge_base.load(args.output, mmap=False)
+    report = ingest_files(knowledge_base, args.paths, metadata=args.metadata, workers=args.workers,
+                          memory_limit_mb=args.memory_limit_mb, target_tokens=args.target_tokens,
+                          overlap_tokens=args.overlap_tokens, batch_size=args.batch_size,
+                          max_batch_tokens=args.max_batch_tokens)
+    knowledge_base.save(args.output)
+    
+    print(f"✅ 导入完成: {len(report['files'])} 个文件，{report['documents']} 个文档，"
+          f"{report['docs_per_second']:.1f} 文档/秒，已保存到 {args.output}")
+    for file_report in report['files']:
+        if file_report['status'] != 'ok':
+            print(f"   ❌ {file_report['path']}: {file_report['error']}", file=sys.stderr)
+    return 1 if report['failed_files'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import json
+import math
+import os
+import numpy as np
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+import logging
+from text_utils import tokenize
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class _TermPostings:
+    """单个词的倒排表：标签数组和对应的词频数组，追加写入"""
+    
+    def __init__(self, labels: Optional[np.ndarray] = None, freqs: Optional[np.ndarray] = None):
+        self.labels = labels if labels is not None else np.empty(0, dtype=np.int64)
+        self.freqs = freqs if freqs is not None else np.empty(0, dtype=np.int32)
+        self.size = len(self.labels)
+    
+    def add(self, label: int, freq: int):
+        """追加一条记录，容量不足时翻倍扩容"""
+        if self.size == len(self.labels):
+            capacity = max(4, 2 * self.size)
+            labels = np.empty(capacity, dtype=np.int64)
+            freqs = np.empty(capacity, dtype=np.int32)
+            labels[:self.size] = self.labels[:self.size]
+            freqs[:self.size] = self.freqs[:self.size]
+            self.labels, self.freqs = labels, freqs
+        self.labels[self.size] = label
+        self.freqs[self.size] = freq
+        self.size += 1
+    
+    def view(self) -> Tuple[np.ndarray, np.ndarray]:
+        """返回有效部分的 (标签, 词频)"""
+        size = self.size
+        return self.labels[:size], self.freqs[:size]
+
+class BM25Index:
+    """
+    增量BM25倒排索引
+    
+    与VectorStore共用内部标签：文档按标签加入，删除的标签从长度统计中扣除并将其长度置0，
+    搜索时不计入文档频率也不参与评分，倒排表中的记录在压缩时清除。
+    
+    从文件加载的倒排表只记录每个词在映射数组中的区间，查询时才创建视图，
+    多个进程映射同一份文件时不会各自为每个词分配对象；词被修改时才复制到内存中。
+    """
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        初始化BM25索引
+        
+        Args:
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # 词 -> _TermPostings（新增或加载后修改过的词）
+        self._base_terms = {}  # 词 -> 加载的区间数组中的行号（未修改过的词）
+        self._base_ranges = np.empty((0, 2), dtype=np.int64)
+        self._base_labels = np.empty(0, dtype=np.int64)
+        self._base_freqs = np.empty(0, dtype=np.int32)
+        self._doc_lengths = np.zeros(0, dtype=np.int32)  # 标签 -> 文档词数
+        self._doc_count = 0
+        self._total_length = 0
+    
+    def __len__(self) -> int:
+        return self._doc_count
+    
+    def _base_postings(self, term: str) -> Optional[_TermPostings]:
+        """返回加载的文件中某个词的倒排表视图"""
+        row = self._base_terms.get(term)
+        if row is None:
+            return None
+        start, end = self._base_ranges[row]
+        return _TermPostings(self._base_labels[start:end], self._base_freqs[start:end])
+    
+    def _get_postings(self, term: str) -> Optional[_TermPostings]:
+        """返回某个词的倒排表，不存在时返回None"""
+        postings = self._postings.get(term)
+        if postings is None:
+            postings = self._base_postings(term)
+        return postings
+    
+    def _terms(self) -> Iterable[str]:
+        """所有词（快照，遍历期间可以修改）"""
+        return list(self._postings) + list(self._base_terms)
+    
+    def add(self, label: int, text: str):
+        """将文档加入索引"""
+        terms = tokenize(text)
+        if label >= len(self._doc_lengths):
+            grown = np.zeros(max(label + 1, 2 * len(self._doc_lengths), 1024), dtype=np.int32)
+            grown[:len(self._doc_lengths)] = self._doc_lengths
+            self._doc_lengths = grown
+        self._doc_lengths[label] = len(terms)
+        self._doc_count += 1
+        self._total_length += len(terms)
+        
+        for term, freq in Counter(terms).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                # 加载的词首次修改时转入内存（追加时扩容会复制映射的数组），
+                # 先放入内存再从加载的词中移除，并发搜索总能找到该词
+                postings = self._postings[term] = self._base_postings(term) or _TermPostings()
+                self._base_terms.pop(term, None)
+            postings.add(label, freq)
+    
+    def remove(self, label: int):
+        """从长度统计中扣除已删除的文档并将其长度置0（倒排表记录在prune时清除）"""
+        if label < len(self._doc_lengths):
+            self._doc_count -= 1
+            self._total_length -= int(self._doc_lengths[label])
+            self._doc_lengths[label] = 0
+    
+    def prune(self, alive: np.ndarray):
+        """
+        从倒排表中清除已删除的标签
+        
+        Args:
+            alive: 按标签的存活掩码
+        """
+        for term in self._terms():
+            labels, freqs = self._get_postings(term).view()
+            keep = alive[labels]
+            if keep.all():
+                continue
+            if keep.any():
+                self._postings[term] = _TermPostings(labels[keep], freqs[keep])
+            else:
+                self._postings.pop(term, None)
+            self._base_terms.pop(term, None)
+    
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25检索
+        
+        Args:
+            query: 查询文本
+            top_k: 返回的结果数
+            allowed: 按标签的布尔掩码，只返回掩码为True的标签（用于排除已删除文档和元数据过滤）
+        
+        Returns:
+            (标签数组, 分数数组)，按分数从高到低排列
+        """
+        doc_count = self._doc_count
+        if doc_count <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        avg_length = self._total_length / doc_count
+        doc_lengths = self._doc_lengths
+        all_labels = []
+        all_scores = []
+        for term, query_freq in Counter(tokenize(query)).items():
+            postings = self._get_postings(term)
+            if postings is None:
+                continue
+            labels, freqs = postings.view()
+            lengths = doc_lengths[labels]
+            # 文档频率按所有未删除的文档计算（已删除文档长度为0），与doc_count口径一致，
+            # 不受过滤条件影响，过滤前后同一文档的得分相同
+            keep = lengths > 0
+            document_frequency = int(np.count_nonzero(keep))
+            if document_frequency == 0:
+                continue
+            if allowed is not None:
+                # 掩码之后新加入的标签不在掩码范围内，一并排除
+                in_range = labels < len(allowed)
+                in_range[in_range] = allowed[labels[in_range]]
+                keep &= in_range
+            if not keep.all():
+                labels, freqs, lengths = labels[keep], freqs[keep], lengths[keep]
+                if len(labels) == 0:
+                    continue
+            idf = math.log(1 + (doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            freqs = freqs.astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+            all_labels.append(labels)
+            all_scores.append(query_freq * idf * freqs * (self.k1 + 1) / (freqs + norm))
+        
+        if not all_labels:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        # 同一文档在多个词下的得分累加
+        labels, inverse = np.unique(np.concatenate(all_labels), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        if len(scores) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            labels, scores = labels[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return labels[order], scores[order]
+    
+    def get_stats(self) -> Dict:
+        """获取索引统计信息"""
+        return {
+            'documents': self._doc_count,
+            'terms': len(self._postings) + len(self._base_terms),
+            'avg_doc_length': self._total_length / self._doc_count if self._doc_count else 0.0
+        }
+    
+    def save(self, filepath: str, alive: np.ndarray):
+        """
+        保存为 {filepath}.bm25_labels.npy / {filepath}.bm25_freqs.npy（所有倒排表拼接）、
+        {filepath}.bm25_lengths.npy（文档长度）和 {filepath}.bm25.json（词表与区间）
+        
+        Args:
+            filepath: 文件路径前缀
+            alive: 按标签的存活掩码，已删除的标签不写入
+        """
+        terms = []
+        label_arrays = []
+        freq_arrays = []
+        position = 0
+        for term in self._terms():
+            labels, freqs = self._get_postings(term).view()
+            keep = alive[labels]
+            if not keep.any():
+                continue
+            terms.append([term, position, position + int(keep.sum())])
+            label_arrays.append(labels[keep])
+            freq_arrays.append(freqs[keep])
+            position += int(keep.sum())
+        
+        lengths = np.zeros(len(alive), dtype=np.int32)
+        count = min(len(alive), len(self._doc_lengths))
+        lengths[:count] = np.where(alive[:count], self._doc_lengths[:count], 0)
+        arrays = {
+            'bm25_labels': np.concatenate(label_arrays) if label_arrays else np.empty(0, dtype=np.int64),
+            'bm25_freqs': np.concatenate(freq_arrays) if freq_arrays else np.empty(0, dtype=np.int32),
+            'bm25_lengths': lengths
+        }
+        for name, array in arrays.items():
+            np.save(f"{filepath}.{name}.tmp.npy", array)
+            os.replace(f"{filepath}.{name}.tmp.npy", f"{filepath}.{name}.npy")
+        
+        meta = {
+            'k1': self.k1,
+            'b': self.b,
+            'documents': self._doc_count,
+            'total_length': self._total_length,
+            'terms': terms
+        }
+        with open(f"{filepath}.bm25.json.tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{filepath}.bm25.json.tmp", f"{filepath}.bm25.json")
+    
+    @classmethod
+    def load(cls, filepath: str) -> 'BM25Index':
+        """加载BM25索引，倒排表以内存映射方式打开"""
+        with open(f"{filepath}.bm25.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(meta['k1'], meta['b'])
+        index._base_labels = np.load(f"{filepath}.bm25_labels.npy", mmap_mode='r')
+        index._base_freqs = np.load(f"{filepath}.bm25_freqs.npy", mmap_mode='r')
+        terms = meta.pop('terms')
+        index._base_terms = {term: row for row, (term, _, _) in enumerate(terms)}
+        index._base_ranges = np.array([(start, end) for _, start, end in terms], dtype=np.int64).reshape(-1, 2)
+        
+        # 长度数组在新增文档时会被修改，完整读入内存
+        index._doc_lengths = np.load(f"{filepath}.bm25_lengths.npy")
+        index._doc_count = meta['documents']
+        index._total_length = meta['total_length']
+        logger.info(f"BM25索引已加载，包含 {len(index._base_terms)} 个词")
+        return index
+    
+    @classmethod
+    def build(cls, items: Iterable[Tuple[int, str]], k1: float = 1.5, b: float = 0.75) -> 'BM25Index':
+        """由 (标签, 文本) 序列构建索引"""
+        index = cls(k1, b)
+        for label, text in items:
+            index.add(label, text)
+        return index
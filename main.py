@@ -1,61 +1,205 @@
-from flask import Flask, request, jsonify, render_template_string
-from vector_store import KnowledgeBase
-from aliyun_embedder import AliYunEmbedder
-from doubao_ai import DoubaoAI
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, render_template_string, stream_with_context
+from snapshot import DEFAULT_RELOAD_SIGNAL
 import os
 import json
+import signal
+import threading
+import time
+from typing import Dict
+import logging
 
-app = Flask(__name__)
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-# 初始化知识库和AI客户端
-def init_knowledge_base():
-    aliyun_api_key = os.getenv("ALIYUN_API_KEY", "sk-8a1b33b774344ba98cf22fc660b6c9a2")
-    doubao_api_key = os.getenv("DOUBAO_API_KEY", "af304f26-0164-4318-84e7-d70ac67f2e07")
-    
-    embedder = AliYunEmbedder(api_key=aliyun_api_key)
-    kb = KnowledgeBase(embedder=embedder)
-    doubao = DoubaoAI(api_key=doubao_api_key)
-    
-    return kb, doubao
+# 批量搜索单次请求允许的最大查询数
+MAX_BATCH_QUERIES = int(os.getenv("KB_MAX_BATCH_QUERIES", "1000"))
+
+# 豆包推理端点ID
+DOUBAO_MODEL_ID = os.getenv("DOUBAO_MODEL_ID", "ep-20250714212604-xmv9d")
 
-kb, doubao = init_knowledge_base()
+bp = Blueprint('knowledge_base', __name__)
 
-# 加载示例数据
-def load_sample_data():
-    sample_data = [
-        {
-            "text": "机器学习是人工智能的重要分支，专注于算法和统计模型",
-            "category": "机器学习",
-            "source": "AI基础知识"
-        },
-        {
-            "text": "深度学习基于神经网络，能够自动学习数据的层次特征",
-            "category": "深度学习", 
-            "source": "神经网络基础"
-        },
-        {
-            "text": "自然语言处理使计算机能够理解、解释和生成人类语言",
-            "category": "NLP",
-            "source": "语言处理技术"
-        },
-        {
-            "text": "计算机视觉让机器能够理解和分析视觉信息",
-            "category": "CV",
-            "source": "图像处理技术"
-        },
-        {
-            "text": "强化学习通过试错学习最优决策策略",
-            "category": "强化学习",
-            "source": "决策算法"
+class KnowledgeService:
+    """
+    延迟初始化的知识库和AI客户端
+    
+    create_app只创建本对象：嵌入器、向量检索和豆包客户端的依赖都不在导入时加载，
+    也不在启动时调用任何API。知识库由后台预热线程或第一个需要它的请求初始化
+    （其他请求等待同一次初始化），示例数据从预计算的嵌入快照加载；
+    豆包客户端在第一次问答时创建。初始化失败时下一个请求会重试。
+    """
+    
+    def __init__(self):
+        self.state = 'starting'  # starting / ready / failed
+        self.error = None
+        self.seed_source = None  # 示例数据来源: snapshot / skipped / disabled
+        # 示例数据的预计算嵌入快照，在构建/部署时用 python seed_data.py 生成；设为空则不添加示例数据
+        self.seed_snapshot = os.getenv("KB_SEED_SNAPSHOT", "data/seed_embeddings.npz") or None
+        # 共享快照目录：设置后所有worker以内存映射方式只读打开CURRENT指向的同一份快照，
+        # 向worker发送SIGUSR2（或设置轮询间隔）即切换到新发布的快照。
+        # 在此确定，知识库初始化完成前增删改请求也按只读处理
+        self.snapshot_dir = os.getenv("KB_SNAPSHOT_DIR") or None
+        self.snapshot_reader = None
+        self.started_at = time.time()
+        self.ready_at = None
+        self._knowledge_base = None
+        self._doubao = None
+        self._lock = threading.Lock()
+        self._doubao_lock = threading.Lock()
+    
+    @property
+    def knowledge_base(self):
+        """知识库实例，首次访问时初始化"""
+        if self._knowledge_base is None:
+            with self._lock:
+                if self._knowledge_base is None:
+                    self._initialize()
+        return self._knowledge_base
+    
+    @property
+    def doubao(self):
+        """豆包AI客户端，首次访问时创建"""
+        if self._doubao is None:
+            with self._doubao_lock:
+                if self._doubao is None:
+                    from doubao_ai import DoubaoAI
+                    self._doubao = DoubaoAI(api_key=os.getenv("DOUBAO_API_KEY", "af304f26-0164-4318-84e7-d70ac67f2e07"))
+        return self._doubao
+    
+    @property
+    def ready(self) -> bool:
+        return self._knowledge_base is not None
+    
+    def _initialize(self):
+        """
+        创建知识库，加载共享快照或预写日志，空知识库添加示例数据（调用方需持有锁）
+        
+        示例数据只从构建时生成的嵌入快照加载，启动时不调用嵌入API也不写入快照；
+        快照不存在或已过期时初始化失败，而不是由各worker各自生成。
+        """
+        from seed_data import seed_from_snapshot
+        try:
+            knowledge_base = self._create_knowledge_base()
+            # 从预写日志恢复了已有数据或使用共享快照时不再添加示例数据
+            if self.snapshot_reader is not None or len(knowledge_base.vector_store.documents) > 0:
+                self.seed_source = 'skipped'
+            elif self.seed_snapshot is None:
+                self.seed_source = 'disabled'
+            else:
+                seed_from_snapshot(knowledge_base, self.seed_snapshot)
+                self.seed_source = 'snapshot'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            logger.error(f"知识库初始化失败: {e}")
+            raise
+        
+        # 完全初始化后再对外可见
+        self._knowledge_base = knowledge_base
+        self.state = 'ready'
+        self.error = None
+        self.ready_at = time.time()
+        logger.info(f"知识库就绪，启动后 {self.ready_at - self.started_at:.2f}s")
+    
+    def _create_knowledge_base(self):
+        """按环境变量创建嵌入器和知识库"""
+        # 依赖在此处导入，导入本模块和创建应用都不需要加载它们
+        from vector_store import KnowledgeBase
+        from aliyun_embedder import AliYunEmbedder
+        from embedding_cache import QueryEmbeddingCache
+        from snapshot import SnapshotReader
+        
+        aliyun_api_key = os.getenv("ALIYUN_API_KEY", "sk-8a1b33b774344ba98cf22fc660b6c9a2")
+        
+        # 索引类型，例如 "Flat"（精确）、"HNSW32"，或存储预设 "float16"、"sq8"；
+        # IVF/PQ索引（如 "IVF4096,Flat"、"ivf_pq"）需要大批向量训练，只能从已训练的快照加载
+        index_factory = os.getenv("KB_INDEX_FACTORY", "Flat")
+        # 压缩索引的精确重排序副本精度（float16 / float32），留空则不重排序
+        rerank_dtype = os.getenv("KB_RERANK_DTYPE") or None
+        # 粗筛维度：先用前N维召回候选，再按全维向量重排序，0表示不启用
+        coarse_dim = int(os.getenv("KB_COARSE_DIM", "0")) or None
+        # 分片数：大于1时文档分布到多个索引，查询在线程池中并发扫描各分片后归并；
+        # 每个检索线程的OpenMP线程数 × 分片数 不宜超过CPU核数
+        num_shards = int(os.getenv("KB_NUM_SHARDS", "1"))
+        omp_threads_per_shard = int(os.getenv("KB_SHARD_OMP_THREADS", "1"))
+        
+        # 查询向量缓存：进程内LRU + 所有worker共享的SQLite文件
+        query_cache = QueryEmbeddingCache(
+            max_entries=int(os.getenv("KB_QUERY_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("KB_QUERY_CACHE_TTL", "3600")),
+            path=os.getenv("KB_QUERY_CACHE_PATH", "cache/query_embeddings.sqlite") or None
+        )
+        
+        # 按内容哈希缓存文档嵌入，重复导入未变化的内容不会再调用API
+        embedding_cache_path = os.getenv("KB_EMBEDDING_CACHE_PATH", "cache/content_embeddings.sqlite")
+        
+        embedder = AliYunEmbedder(
+            api_key=aliyun_api_key,
+            cache_path=embedding_cache_path or None,
+            max_concurrency=int(os.getenv("KB_EMBED_CONCURRENCY", "4")),
+            requests_per_minute=float(os.getenv("KB_EMBED_RPM", "0")) or None,
+            tokens_per_minute=float(os.getenv("KB_EMBED_TPM", "0")) or None,
+            max_batch_tokens=int(os.getenv("KB_EMBED_BATCH_TOKENS", "32000")),
+            overflow=os.getenv("KB_EMBED_OVERFLOW", "split")
+        )
+        kb = KnowledgeBase(embedder=embedder, index_factory=index_factory, query_cache=query_cache,
+                           rerank_dtype=rerank_dtype, coarse_dim=coarse_dim,
+                           num_shards=num_shards, omp_threads_per_shard=omp_threads_per_shard)
+        
+        # 预写日志目录：设置后每次增删改都追加写入日志，重启时由快照加日志恢复（仅支持单个写入进程）
+        wal_dir = os.getenv("KB_WAL_DIR")
+        if self.snapshot_dir:
+            # 信号处理器由create_app在主线程安装
+            self.snapshot_reader = SnapshotReader(kb, self.snapshot_dir,
+                                                  poll_interval=float(os.getenv("KB_SNAPSHOT_POLL_SECONDS", "0")))
+            self.snapshot_reader.load()
+        elif wal_dir:
+            kb.open_wal(wal_dir, sync=os.getenv("KB_WAL_SYNC", "1") != "0",
+                        merge_bytes=int(os.getenv("KB_WAL_MERGE_MB", "64")) * 1024 * 1024)
+        
+        # 服务只会逐条或少量添加文档，无法训练IVF/PQ索引；这类索引必须来自已训练的快照
+        # （共享快照或预写日志的基础快照），否则启动即失败，而不是之后每次添加都失败
+        minimum = kb.vector_store.min_training_vectors
+        if minimum > 1:
+            raise ValueError(f"索引 {index_factory} 需要至少 {minimum} 个向量训练，服务无法在线训练；"
+                             f"请用build_index.py构建并发布快照后通过KB_SNAPSHOT_DIR加载，"
+                             f"或改用Flat、HNSW32、float16、sq8")
+        return kb
+    
+    def warmup(self):
+        """后台预热：提前初始化知识库，失败时由下一个请求重试"""
+        try:
+            self.knowledge_base
+        except Exception:
+            pass
+    
+    def install_signal_handler(self):
+        """安装共享快照的重载信号处理器（必须在主线程调用，知识库就绪前收到的信号被忽略）"""
+        if DEFAULT_RELOAD_SIGNAL is None:
+            return
+        
+        def request_reload(signum, frame):
+            if self.snapshot_reader is not None:
+                self.snapshot_reader.request_reload()
+        
+        try:
+            signal.signal(DEFAULT_RELOAD_SIGNAL, request_reload)
+        except ValueError:
+            logger.warning("不在主线程中，未安装快照重载信号处理器")
+    
+    def get_status(self) -> Dict:
+        """启动状态（用于就绪检查）"""
+        return {
+            'state': self.state,
+            'error': self.error,
+            'seed': self.seed_source,
+            'startup_seconds': self.ready_at - self.started_at if self.ready_at else None
         }
-    ]
-    return sample_data
 
-# 初始化示例数据
-sample_data = load_sample_data()
-texts = [item["text"] for item in sample_data]
-metadata = [{"category": item["category"], "source": item["source"]} for item in sample_data]
-kb.add_documents(texts, metadata)
+def get_service() -> KnowledgeService:
+    """当前应用的知识库服务"""
+    return current_app.extensions['knowledge_service']
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -220,29 +364,72 @@ HTML_TEMPLATE = """
                 return;
             }
             
-            document.getElementById('qaResults').innerHTML = '<div class="loading">正在生成回答...</div>';
+            const container = document.getElementById('qaResults');
+            container.innerHTML = '<div class="loading">正在检索...</div>';
             
             try {
-                const response = await fetch('/api/qa', {
+                const response = await fetch('/api/qa/stream', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ query, top_k: parseInt(topK) })
                 });
                 
-                const data = await response.json();
-                displayQAResults(data);
+                if (!response.ok) {
+                    const data = await response.json();
+                    throw new Error(data.error || response.statusText);
+                }
+                
+                // 按SSE格式解析事件流：事件之间以空行分隔
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let answer = '';
+                let references = [];
+                
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\\n\\n')) >= 0) {
+                        const message = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        
+                        let event = 'message';
+                        let data = '';
+                        message.split('\\n').forEach(line => {
+                            if (line.startsWith('event: ')) event = line.slice(7);
+                            else if (line.startsWith('data: ')) data += line.slice(6);
+                        });
+                        const payload = data ? JSON.parse(data) : {};
+                        
+                        if (event === 'references') {
+                            references = payload.references;
+                        } else if (event === 'token') {
+                            answer += payload.text;
+                        } else if (event === 'error') {
+                            answer += payload.error;
+                        }
+                        displayQAResults({ answer, references });
+                    }
+                }
             } catch (error) {
-                document.getElementById('qaResults').innerHTML = '<div class="result">问答失败: ' + error.message + '</div>';
+                container.innerHTML = '<div class="result">问答失败: ' + error.message + '</div>';
             }
         }
         
+        function escapeHtml(text) {
+            const div = document.createElement('div');
+            div.textContent = text;
+            return div.innerHTML;
+        }
+        
         function displayQAResults(data) {
             const container = document.getElementById('qaResults');
             let html = '<div class="result">';
             
-            if (data.answer) {
-                html += `<h3>💡 AI回答:</h3><div style="margin-bottom: 20px;">${data.answer}</div>`;
-            }
+            html += `<h3>💡 AI回答:</h3><div style="margin-bottom: 20px; white-space: pre-wrap;">${data.answer ? escapeHtml(data.answer) : '<span class="loading">正在生成回答...</span>'}</div>`;
             
             if (data.references && data.references.length > 0) {
                 html += '<h3>📚 参考内容:</h3>';
@@ -295,41 +482,129 @@ HTML_TEMPLATE = """
 </html>
 """
 
-@app.route('/')
+# 共享快照只读，修改需重新构建并发布快照
+READ_ONLY_ENDPOINTS = {'knowledge_base.add_document', 'knowledge_base.delete_documents',
+                       'knowledge_base.update_document'}
+
+# 存活和就绪检查不经过快照检查，也不触发快照重载
+PROBE_ENDPOINTS = {'knowledge_base.healthz', 'knowledge_base.readyz'}
+
+@bp.before_request
+def check_snapshot():
+    service = get_service()
+    if service.snapshot_dir is None or request.endpoint in PROBE_ENDPOINTS:
+        return None
+    # 不等待知识库初始化：就绪前的增删改请求同样拒绝
+    if request.endpoint in READ_ONLY_ENDPOINTS:
+        return jsonify({'error': '共享快照模式下知识库只读，请重新构建并发布快照'}), 409
+    if service.snapshot_reader is not None:
+        service.snapshot_reader.maybe_reload()
+    return None
+
+@bp.route('/healthz')
+def healthz():
+    """存活检查：进程能处理请求即返回200，不依赖知识库和外部API"""
+    return jsonify({'status': 'ok'})
+
+@bp.route('/readyz')
+def readyz():
+    """就绪检查：知识库初始化完成后返回200，启动中或初始化失败时返回503"""
+    service = get_service()
+    status = service.get_status()
+    return jsonify(status), 200 if service.ready else 503
+
+@bp.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
-@app.route('/api/search', methods=['POST'])
+@bp.route('/api/search', methods=['POST'])
 def search():
     try:
         data = request.json
         query = data.get('query')
         top_k = data.get('top_k', 5)
         threshold = data.get('threshold', 0.6)
+        nprobe = data.get('nprobe')
+        ef_search = data.get('ef_search')
+        rerank = data.get('rerank')
+        candidate_multiplier = data.get('candidate_multiplier')
+        filters = data.get('filters')
+        
+        mode = data.get('mode', 'dense')
+        kb = get_service().knowledge_base
         
-        results = kb.search(query, top_k=top_k, similarity_threshold=threshold)
+        if mode == 'hybrid':
+            # 向量检索与BM25词法检索并发执行后融合，返回各阶段耗时；
+            # threshold只过滤向量检索的候选，未指定时不过滤，词法命中的文档仍可进入融合结果
+            return jsonify(kb.hybrid_search(query, top_k=top_k, fusion=data.get('fusion', 'rrf'),
+                                            dense_weight=data.get('dense_weight', 0.5),
+                                            similarity_threshold=data.get('threshold', 0.0),
+                                            filters=filters, nprobe=nprobe, ef_search=ef_search))
+        if mode == 'lexical':
+            return jsonify({'results': kb.lexical_search(query, top_k=top_k, filters=filters)})
+        if mode != 'dense':
+            return jsonify({'error': f'不支持的检索模式: {mode}'}), 400
+        
+        results = kb.search(query, top_k=top_k, similarity_threshold=threshold,
+                            nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+                            candidate_multiplier=candidate_multiplier, filters=filters)
         return jsonify({'results': results})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/qa', methods=['POST'])
+@bp.route('/api/search_batch', methods=['POST'])
+def search_batch():
+    try:
+        data = request.json
+        queries = data.get('queries')
+        top_k = data.get('top_k', 5)
+        threshold = data.get('threshold', 0.6)
+        nprobe = data.get('nprobe')
+        ef_search = data.get('ef_search')
+        rerank = data.get('rerank')
+        candidate_multiplier = data.get('candidate_multiplier')
+        filters = data.get('filters')
+        
+        if not isinstance(queries, list) or not all(isinstance(q, str) and q for q in queries):
+            return jsonify({'error': 'queries 必须是非空字符串列表'}), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({'error': f'单次请求最多 {MAX_BATCH_QUERIES} 个查询'}), 400
+        
+        kb = get_service().knowledge_base
+        results = kb.search_batch(queries, top_k=top_k, similarity_threshold=threshold,
+                                  nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+                                  candidate_multiplier=candidate_multiplier, filters=filters)
+        return jsonify({'results': results})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def build_context(results):
+    """将检索结果拼接为问答上下文"""
+    return "\n".join([f"{i+1}. {result['text']}" for i, result in enumerate(results)])
+
+def sse_event(event: str, data) -> str:
+    """编码一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@bp.route('/api/qa', methods=['POST'])
 def qa():
     try:
         data = request.json
         query = data.get('query')
         top_k = data.get('top_k', 3)
+        filters = data.get('filters')
         
         # 检索相关文档
-        results = kb.search(query, top_k=top_k, similarity_threshold=0.5)
+        results = get_service().knowledge_base.search(query, top_k=top_k, similarity_threshold=0.5, filters=filters)
         
         if results:
             # 构建上下文
-            context = "\n".join([f"{i+1}. {result['text']}" for i, result in enumerate(results)])
+            context = build_context(results)
             
             # 使用豆包AI生成回答
             try:
-                answer = doubao.knowledge_base_qa(
-                    model="ep-20250714212604-xmv9d",
+                answer = get_service().doubao.knowledge_base_qa(
+                    model=DOUBAO_MODEL_ID,
                     query=query,
                     context=context
                 )
@@ -350,7 +625,55 @@ def qa():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/add_document', methods=['POST'])
+@bp.route('/api/qa/stream', methods=['POST'])
+def qa_stream():
+    """
+    流式问答：先推送检索到的参考内容，再随生成逐段推送回答
+    
+    事件类型依次为 references、token（多次）、done；出错时推送 error。
+    """
+    data = request.json or {}
+    query = data.get('query')
+    top_k = data.get('top_k', 3)
+    filters = data.get('filters')
+    if not query:
+        return jsonify({'error': '缺少查询参数'}), 400
+    service = get_service()
+    
+    def generate():
+        try:
+            results = service.knowledge_base.search(query, top_k=top_k, similarity_threshold=0.5, filters=filters)
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+            return
+        
+        yield sse_event('references', {'references': results})
+        
+        if not results:
+            yield sse_event('token', {'text': "抱歉，未找到相关文档，无法生成回答。"})
+            yield sse_event('done', {})
+            return
+        
+        try:
+            for text in service.doubao.knowledge_base_qa_stream(
+                model=DOUBAO_MODEL_ID,
+                query=query,
+                context=build_context(results)
+            ):
+                yield sse_event('token', {'text': text})
+        except Exception as e:
+            yield sse_event('error', {'error': f"抱歉，AI回答生成失败: {str(e)}"})
+            return
+        
+        yield sse_event('done', {})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/add_document', methods=['POST'])
 def add_document():
     try:
         data = request.json
@@ -359,11 +682,81 @@ def add_document():
         source = data.get('source', '')
         
         metadata = {'category': category, 'source': source}
-        kb.add_documents([text], [metadata])
+        ids = get_service().knowledge_base.add_documents([text], [metadata])
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'id': ids[0]})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/delete_documents', methods=['POST'])
+def delete_documents():
+    try:
+        data = request.json
+        ids = data.get('ids', [])
+        
+        deleted = get_service().knowledge_base.delete_documents(ids)
+        return jsonify({'success': True, 'deleted': deleted})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/update_document', methods=['POST'])
+def update_document():
+    try:
+        data = request.json
+        doc_id = data.get('id')
+        text = data.get('text')
+        metadata = None
+        if 'category' in data or 'source' in data:
+            metadata = [{'category': data.get('category', ''), 'source': data.get('source', '')}]
+        
+        get_service().knowledge_base.update_documents([doc_id], [text], metadata)
+        return jsonify({'success': True, 'id': doc_id})
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/stats', methods=['GET'])
+def stats():
+    service = get_service()
+    kb = service.knowledge_base
+    result = {'vector_store': kb.vector_store.get_stats()}
+    if kb.query_cache is not None:
+        result['query_cache'] = kb.query_cache.get_stats()
+    if service.snapshot_reader is not None:
+        result['snapshot'] = service.snapshot_reader.get_stats()
+    return jsonify(result)
+
+def create_app(warmup: bool = True) -> Flask:
+    """
+    创建Flask应用
+    
+    只注册路由和创建延迟初始化的KnowledgeService，不加载嵌入和向量检索依赖，
+    毫秒级返回；知识库在后台线程中预热，就绪前/readyz返回503，
+    其他接口在首次使用时等待初始化完成。
+    
+    Args:
+        warmup: 是否立即在后台线程中初始化知识库，为False时由第一个请求初始化
+    
+    Returns:
+        Flask应用
+    """
+    app = Flask(__name__)
+    service = KnowledgeService()
+    app.extensions['knowledge_service'] = service
+    app.register_blueprint(bp)
+    if service.snapshot_dir:
+        service.install_signal_handler()
+    if warmup:
+        threading.Thread(target=service.warmup, daemon=True, name="kb-warmup").start()
+    return app
+
+def __getattr__(name: str):
+    """兼容 gunicorn main:app：首次访问模块属性app时才创建应用"""
+    if name == 'app':
+        app = globals()['app'] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,243 @@
+import json
+import os
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _value_key(value: Any) -> Optional[Tuple]:
+    """将元数据值规范化为倒排表的键，数值不区分int和float，不支持的类型返回None"""
+    if isinstance(value, bool):
+        return ('b', value)
+    if isinstance(value, (int, float)):
+        return ('n', float(value))
+    if isinstance(value, str):
+        return ('s', value)
+    return None
+
+def _iter_values(value: Any) -> Iterable[Tuple]:
+    """列表类型的元数据值按元素分别建立索引"""
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    for item in values:
+        key = _value_key(item)
+        if key is not None:
+            yield key
+
+class _Posting:
+    """单个 (字段, 值) 的标签列表，追加写入，删除记录在单独的集合中"""
+    
+    def __init__(self, labels: Optional[np.ndarray] = None):
+        self.labels = labels if labels is not None else np.empty(0, dtype=np.int64)
+        self.size = len(self.labels)
+        self.removed = frozenset()  # 整体替换，搜索线程读取时无需加锁
+    
+    def add(self, label: int):
+        """追加标签，容量不足时翻倍扩容（加载时映射的只读数组在首次追加时被复制）"""
+        if label in self.removed:
+            self.removed = self.removed - {label}
+        if self.size == len(self.labels):
+            grown = np.empty(max(16, 2 * self.size), dtype=np.int64)
+            grown[:self.size] = self.labels[:self.size]
+            self.labels = grown
+        self.labels[self.size] = label
+        self.size += 1
+    
+    def remove(self, label: int):
+        """记录删除的标签，超过一定数量后合并到标签数组"""
+        self.removed = self.removed | {label}
+        if len(self.removed) > 64 and len(self.removed) > self.size // 4:
+            self.prune(None)
+    
+    def prune(self, alive: Optional[np.ndarray]):
+        """清除已删除的标签，alive为按标签的存活掩码（为None时只合并删除集合）"""
+        labels = self.labels[:self.size]
+        keep = np.ones(len(labels), dtype=bool)
+        if self.removed:
+            keep &= ~np.isin(labels, np.fromiter(self.removed, dtype=np.int64))
+        if alive is not None:
+            keep &= alive[labels]
+        self.labels = labels[keep]
+        self.size = len(self.labels)
+        self.removed = frozenset()
+    
+    def mark(self, mask: np.ndarray):
+        """在按标签的布尔掩码中标记本倒排表包含的标签"""
+        labels = self.labels[:self.size]
+        # 只跳过本倒排表删除的标签，不能清除其他取值已标记的位置
+        if self.removed:
+            labels = labels[~np.isin(labels, np.fromiter(self.removed, dtype=np.int64))]
+        mask[labels[labels < len(mask)]] = True
+
+class MetadataIndex:
+    """
+    元数据倒排索引
+    
+    为每个 (字段, 值) 维护一个标签列表，查询时将过滤条件转换为按标签的位图，
+    由VectorStore交给FAISS在扫描过程中过滤。
+    
+    过滤条件格式：
+        {"category": "NLP"}                        等值匹配
+        {"category": ["NLP", "CV"]}                任一值匹配，等价于 {"$in": [...]}
+        {"category": {"$ne": "NLP"}}               支持 $eq、$ne、$in、$nin
+        {"category": "NLP", "source": "教材"}      多个字段为AND
+        {"$or": [{"category": "NLP"}, {"source": "教材"}]}
+        {"$and": [...]}
+    """
+    
+    OPERATORS = ('$eq', '$ne', '$in', '$nin')
+    
+    def __init__(self):
+        """初始化空的元数据索引"""
+        self._postings = {}  # (字段, 值键) -> _Posting
+    
+    def __len__(self) -> int:
+        return len(self._postings)
+    
+    def add(self, label: int, metadata: Optional[Dict]):
+        """为标签建立元数据索引"""
+        for field, value in (metadata or {}).items():
+            for key in _iter_values(value):
+                posting = self._postings.get((field, key))
+                if posting is None:
+                    posting = self._postings[(field, key)] = _Posting()
+                posting.add(label)
+    
+    def remove(self, label: int, metadata: Optional[Dict]):
+        """移除标签在旧元数据下的索引（用于仅更新元数据的场景）"""
+        for field, value in (metadata or {}).items():
+            for key in _iter_values(value):
+                posting = self._postings.get((field, key))
+                if posting is not None:
+                    posting.remove(label)
+    
+    def prune(self, alive: np.ndarray):
+        """
+        清除已删除的标签，清空的倒排表一并移除
+        
+        Args:
+            alive: 按标签的存活掩码
+        """
+        for key in list(self._postings):
+            posting = self._postings[key]
+            posting.prune(alive)
+            if posting.size == 0:
+                del self._postings[key]
+    
+    def match(self, filters: Dict, size: int) -> np.ndarray:
+        """
+        计算满足过滤条件的标签掩码
+        
+        Args:
+            filters: 过滤条件
+            size: 标签总数
+        
+        Returns:
+            长度为size的布尔数组
+        """
+        if not isinstance(filters, dict):
+            raise ValueError(f"过滤条件必须是字典: {filters!r}")
+        
+        mask = np.ones(size, dtype=bool)
+        for field, condition in filters.items():
+            if field == '$and':
+                for sub in self._sub_filters(field, condition):
+                    mask &= self.match(sub, size)
+            elif field == '$or':
+                matched = np.zeros(size, dtype=bool)
+                for sub in self._sub_filters(field, condition):
+                    matched |= self.match(sub, size)
+                mask &= matched
+            elif field.startswith('$'):
+                raise ValueError(f"不支持的过滤操作: {field}")
+            else:
+                mask &= self._field_mask(field, condition, size)
+        return mask
+    
+    @staticmethod
+    def _sub_filters(operator: str, condition: Any) -> List[Dict]:
+        """校验 $and / $or 的子条件列表"""
+        if not isinstance(condition, list) or not condition:
+            raise ValueError(f"{operator} 需要非空的条件列表")
+        return condition
+    
+    def _field_mask(self, field: str, condition: Any, size: int) -> np.ndarray:
+        """计算单个字段条件的标签掩码"""
+        if isinstance(condition, dict):
+            mask = np.ones(size, dtype=bool)
+            for operator, value in condition.items():
+                if operator not in self.OPERATORS:
+                    raise ValueError(f"不支持的过滤操作: {operator}")
+                values = value if operator in ('$in', '$nin') else [value]
+                if not isinstance(values, list):
+                    raise ValueError(f"{operator} 需要值列表")
+                matched = self._values_mask(field, values, size)
+                mask &= matched if operator in ('$eq', '$in') else ~matched
+            return mask
+        
+        values = condition if isinstance(condition, list) else [condition]
+        return self._values_mask(field, values, size)
+    
+    def _values_mask(self, field: str, values: List, size: int) -> np.ndarray:
+        """字段取值为values中任一值的标签掩码"""
+        mask = np.zeros(size, dtype=bool)
+        for value in values:
+            key = _value_key(value)
+            if key is None:
+                raise ValueError(f"不支持的过滤值类型: {value!r}")
+            posting = self._postings.get((field, key))
+            if posting is not None:
+                posting.mark(mask)
+        return mask
+    
+    def save(self, filepath: str, alive: np.ndarray):
+        """
+        保存为 {filepath}.postings.npy（所有标签拼接）和 {filepath}.postings.json（键与区间）
+        
+        Args:
+            filepath: 文件路径前缀
+            alive: 按标签的存活掩码，已删除的标签不写入
+        """
+        keys = []
+        arrays = []
+        position = 0
+        for (field, (kind, value)), posting in self._postings.items():
+            labels = posting.labels[:posting.size]
+            keep = alive[labels]
+            if posting.removed:
+                keep &= ~np.isin(labels, np.fromiter(posting.removed, dtype=np.int64))
+            labels = labels[keep]
+            if len(labels) == 0:
+                continue
+            keys.append([field, kind, value, position, position + len(labels)])
+            arrays.append(labels)
+            position += len(labels)
+        
+        labels = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+        np.save(f"{filepath}.postings.tmp.npy", labels)
+        with open(f"{filepath}.postings.json.tmp", 'w', encoding='utf-8') as f:
+            json.dump(keys, f, ensure_ascii=False)
+        os.replace(f"{filepath}.postings.tmp.npy", f"{filepath}.postings.npy")
+        os.replace(f"{filepath}.postings.json.tmp", f"{filepath}.postings.json")
+    
+    @classmethod
+    def load(cls, filepath: str) -> 'MetadataIndex':
+        """加载倒排索引，标签数组以内存映射方式打开"""
+        index = cls()
+        labels = np.load(f"{filepath}.postings.npy", mmap_mode='r')
+        with open(f"{filepath}.postings.json", 'r', encoding='utf-8') as f:
+            keys = json.load(f)
+        for field, kind, value, start, end in keys:
+            index._postings[(field, (kind, value))] = _Posting(labels[start:end])
+        logger.info(f"元数据索引已加载，包含 {len(index)} 个字段取值")
+        return index
+    
+    @classmethod
+    def build(cls, items: Iterable[Tuple[int, Dict]]) -> 'MetadataIndex':
+        """由 (标签, 元数据) 序列构建索引"""
+        index = cls()
+        for label, metadata in items:
+            index.add(label, metadata)
+        return index
@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Optional
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """令牌桶，按固定速率补充令牌，容量为一分钟的配额"""
+    
+    def __init__(self, per_minute: float):
+        """
+        初始化令牌桶
+        
+        Args:
+            per_minute: 每分钟补充的令牌数
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+    
+    def _refill(self, now: float):
+        """按经过的时间补充令牌"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """返回获取指定数量令牌需要等待的秒数，0表示可以立即获取"""
+        self._refill(now)
+        # 超过容量的请求在桶满时放行，避免永久阻塞
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def consume(self, amount: float):
+        """扣除令牌（可能短暂为负，后续请求会相应等待）"""
+        self.tokens -= amount
+
+class RateLimiter:
+    """
+    线程安全的API速率限制器
+    
+    同时限制每分钟请求数和每分钟token数；收到429响应时通过pause暂停所有线程，
+    而不是只让触发限流的线程退避。
+    """
+    
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        """
+        初始化速率限制器
+        
+        Args:
+            requests_per_minute: 每分钟最大请求数，为None时不限制
+            tokens_per_minute: 每分钟最大token数，为None时不限制
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def acquire(self, tokens: int = 0):
+        """
+        阻塞直到可以发送一个请求
+        
+        Args:
+            tokens: 该请求预计消耗的token数
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if self.requests is not None:
+                    wait = max(wait, self.requests.wait_time(1, now))
+                if self.tokens is not None and tokens:
+                    wait = max(wait, self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    if self.requests is not None:
+                        self.requests.consume(1)
+                    if self.tokens is not None and tokens:
+                        self.tokens.consume(tokens)
+                    return
+            time.sleep(wait)
+    
+    def pause(self, seconds: float):
+        """在接下来的若干秒内暂停所有请求（用于响应429 / Retry-After）"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"触发速率限制，暂停请求 {seconds:.1f} 秒")
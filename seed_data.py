@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+示例数据及其预计算的嵌入快照
+
+快照在构建/部署时生成一次，服务启动时只读取快照、不调用嵌入API，也不写入快照；
+快照不存在或与当前模型、维度、示例文本不一致时启动失败，需重新生成。
+
+用法:
+    python seed_data.py                       # 生成 data/seed_embeddings.npz
+    python seed_data.py -o path/to/seed.npz
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEED_PATH = "data/seed_embeddings.npz"
+
+SAMPLE_DATA = [
+    {
+        "text": "机器学习是人工智能的重要分支，专注于算法和统计模型",
+        "category": "机器学习",
+        "source": "AI基础知识"
+    },
+    {
+        "text": "深度学习基于神经网络，能够自动学习数据的层次特征",
+        "category": "深度学习",
+        "source": "神经网络基础"
+    },
+    {
+        "text": "自然语言处理使计算机能够理解、解释和生成人类语言",
+        "category": "NLP",
+        "source": "语言处理技术"
+    },
+    {
+        "text": "计算机视觉让机器能够理解和分析视觉信息",
+        "category": "CV",
+        "source": "图像处理技术"
+    },
+    {
+        "text": "强化学习通过试错学习最优决策策略",
+        "category": "强化学习",
+        "source": "决策算法"
+    }
+]
+
+def sample_documents() -> Tuple[List[str], List[Dict]]:
+    """返回示例数据的 (文本列表, 元数据列表)"""
+    texts = [item["text"] for item in SAMPLE_DATA]
+    metadata = [{"category": item["category"], "source": item["source"]} for item in SAMPLE_DATA]
+    return texts, metadata
+
+def save_seed_snapshot(path: str, texts: List[str], embeddings: np.ndarray, model: str):
+    """
+    保存嵌入快照（先写同目录下唯一的临时文件再原子替换，并发写入时读者只会看到完整的文件）
+    
+    Args:
+        path: 快照文件路径（.npz）
+        texts: 文本列表
+        embeddings: 对应的嵌入向量矩阵
+        model: 生成嵌入的模型名
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, texts=np.array(texts), embeddings=np.asarray(embeddings, dtype=np.float32),
+                     model=np.array(model))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def load_seed_snapshot(path: str, texts: List[str], model: str, dimensions: int) -> Optional[np.ndarray]:
+    """
+    加载嵌入快照
+    
+    Args:
+        path: 快照文件路径
+        texts: 期望的文本列表，与快照中的文本不一致时视为过期
+        model: 当前嵌入模型名
+        dimensions: 当前嵌入维度
+    
+    Returns:
+        嵌入向量矩阵，快照不存在、损坏或已过期时返回None
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as snapshot:
+            stored_texts = snapshot['texts'].tolist()
+            stored_model = str(snapshot['model'])
+            embeddings = snapshot['embeddings']
+    except Exception as e:
+        logger.warning(f"示例数据嵌入快照无法读取: {path}: {e}")
+        return None
+    if stored_texts != texts or stored_model != model or embeddings.shape[1] != dimensions:
+        logger.info(f"示例数据嵌入快照已过期（模型 {stored_model}，维度 {embeddings.shape[1]}）: {path}")
+        return None
+    return embeddings
+
+def _embedder_model(embedder) -> str:
+    return getattr(embedder, 'model', None) or getattr(embedder, 'model_name', '')
+
+def seed_from_snapshot(knowledge_base, path: str = DEFAULT_SEED_PATH):
+    """
+    从嵌入快照向知识库添加示例数据，不调用嵌入API
+    
+    Args:
+        knowledge_base: KnowledgeBase实例
+        path: 嵌入快照文件路径
+    
+    Raises:
+        RuntimeError: 快照不存在、损坏或已过期
+    """
+    texts, metadata = sample_documents()
+    embedder = knowledge_base.embedder
+    embeddings = load_seed_snapshot(path, texts, _embedder_model(embedder), embedder.get_embedding_dim())
+    if embeddings is None:
+        raise RuntimeError(f"示例数据嵌入快照不存在或与当前嵌入模型不一致: {path}；"
+                           f"请在构建/部署时运行 python seed_data.py 生成，或将KB_SEED_SNAPSHOT设为空以不添加示例数据")
+    knowledge_base.vector_store.add_documents(texts, embeddings, metadata)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="生成示例数据的嵌入快照")
+    parser.add_argument('-o', '--output', default=os.getenv("KB_SEED_SNAPSHOT", DEFAULT_SEED_PATH),
+                        help="快照文件路径")
+    args = parser.parse_args(argv)
+    
+    from aliyun_embedder import AliYunEmbedder
+    embedder = AliYunEmbedder(api_key=os.getenv("ALIYUN_API_KEY"))
+    texts, _ = sample_documents()
+    try:
+        embeddings = embedder.embed_batch(texts)
+    except Exception as e:
+        print(f"嵌入生成失败: {e}", file=sys.stderr)
+        return 1
+    save_seed_snapshot(args.output, texts, embeddings, embedder.model)
+    print(f"✅ 已写入 {len(texts)} 条示例数据的嵌入: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,490 @@
+import heapq
+import json
+import os
+import threading
+import numpy as np
+import faiss
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+from document_store import validate_metadata
+from vector_store import VectorStore
+from wal import WriteAheadLogMixin
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _init_search_thread(omp_threads: int):
+    """线程池初始化：限制每个工作线程内FAISS使用的OpenMP线程数"""
+    faiss.omp_set_num_threads(omp_threads)
+
+class _ShardedDocuments:
+    """按全局文档ID访问各分片文档存储的只读视图"""
+    
+    def __init__(self, store: 'ShardedVectorStore'):
+        self._store = store
+    
+    def __len__(self) -> int:
+        return sum(len(shard.documents) for shard in self._store.shards)
+    
+    def __contains__(self, doc_id: int) -> bool:
+        if doc_id < 0:
+            return False
+        shard, local_id = self._store._locate(doc_id)
+        return local_id in self._store.shards[shard].documents
+    
+    def get(self, doc_id: int) -> Optional[Tuple[str, Dict]]:
+        """按全局ID获取 (文本, 元数据)，不存在时返回None"""
+        if doc_id < 0:
+            return None
+        shard, local_id = self._store._locate(doc_id)
+        return self._store.shards[shard].documents.get(local_id)
+    
+    def ids(self) -> Iterator[int]:
+        """按升序遍历所有有效的全局文档ID"""
+        def shard_ids(shard: int, store: VectorStore) -> Iterator[int]:
+            for local_id in store.documents.ids():
+                yield self._store._global_id(shard, local_id)
+        
+        return heapq.merge(*(shard_ids(shard, store) for shard, store in enumerate(self._store.shards)))
+
+class ShardedVectorStore(WriteAheadLogMixin):
+    """
+    分片向量存储，接口与VectorStore相同
+    
+    文档按ID轮流分配到num_shards个VectorStore分片（全局ID = 分片内ID * 分片数 + 分片序号），
+    每个分片维护独立的FAISS索引、元数据索引和词法索引。查询在线程池中并发扫描所有分片，
+    再将各分片按相似度排好序的top_k结果做多路堆归并。线程池大小与每个工作线程的OpenMP
+    线程数共同决定检索占用的CPU核数，多个请求线程同时检索时也不会超额订阅。
+    """
+    
+    def __init__(self, embedding_dim: int = 1024, num_shards: int = 4, index_factory: str = "Flat",
+                 compaction_threshold: float = 0.2, rerank_dtype: Optional[str] = None,
+                 coarse_dim: Optional[int] = None, candidate_multiplier: Optional[int] = None,
+                 lexical: bool = True, search_threads: Optional[int] = None,
+                 omp_threads_per_shard: int = 1):
+        """
+        初始化分片向量存储
+        
+        Args:
+            embedding_dim: 嵌入向量的维度
+            num_shards: 分片数量
+            index_factory: 每个分片的FAISS索引工厂字符串或存储预设名，见VectorStore
+            compaction_threshold: 分片中已删除向量占比超过该值时在后台压缩该分片
+            rerank_dtype: 重排序副本精度，见VectorStore
+            coarse_dim: 粗筛维度，见VectorStore
+            candidate_multiplier: 重排序候选倍数，见VectorStore
+            lexical: 是否维护BM25词法索引
+            search_threads: 扫描分片的线程池大小，默认等于分片数
+            omp_threads_per_shard: 每个工作线程中FAISS使用的OpenMP线程数，
+                总占用约为 search_threads * omp_threads_per_shard 个核
+        """
+        if num_shards < 1:
+            raise ValueError("分片数量必须为正数")
+        if omp_threads_per_shard < 1:
+            raise ValueError("omp_threads_per_shard必须为正数")
+        self.embedding_dim = embedding_dim
+        self.index_factory = index_factory
+        self.compaction_threshold = compaction_threshold
+        self.rerank_dtype = rerank_dtype
+        self.coarse_dim = coarse_dim
+        self.candidate_multiplier = candidate_multiplier
+        self.lexical = lexical
+        self.search_threads = search_threads
+        self.omp_threads_per_shard = omp_threads_per_shard
+        self.shards = []
+        self.documents = _ShardedDocuments(self)
+        self._executor = None
+        
+        # 修改操作在分片级别各自加锁，这里的锁保证预写日志的记录顺序与实际修改顺序一致
+        self._lock = threading.RLock()
+        self._init_wal()
+        self._create_shards(num_shards)
+    
+    @property
+    def num_shards(self) -> int:
+        return len(self.shards)
+    
+    def _create_shards(self, num_shards: int):
+        """创建空分片和扫描分片的线程池"""
+        self.shards = [VectorStore(self.embedding_dim, self.index_factory, self.compaction_threshold,
+                                   self.rerank_dtype, self.coarse_dim, self.candidate_multiplier,
+                                   lexical=self.lexical)
+                       for _ in range(num_shards)]
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=self.search_threads or num_shards,
+                                            thread_name_prefix="vector-store-shard",
+                                            initializer=_init_search_thread,
+                                            initargs=(self.omp_threads_per_shard,))
+        logger.info(f"初始化分片向量存储: {num_shards} 个分片，"
+                    f"每个工作线程 {self.omp_threads_per_shard} 个OpenMP线程")
+    
+    @property
+    def min_training_vectors(self) -> int:
+        """首批至少需要的向量总数：文档轮流分配到各分片，每个分片各需VectorStore.min_training_vectors个"""
+        return max(shard.min_training_vectors for shard in self.shards) * self.num_shards
+    
+    def _locate(self, doc_id: int) -> Tuple[int, int]:
+        """全局文档ID -> (分片序号, 分片内ID)"""
+        return doc_id % self.num_shards, doc_id // self.num_shards
+    
+    def _global_id(self, shard: int, local_id: int) -> int:
+        """(分片序号, 分片内ID) -> 全局文档ID"""
+        return local_id * self.num_shards + shard
+    
+    def _group_by_shard(self, ids: List[int]) -> Dict[int, Tuple[List[int], List[int]]]:
+        """
+        按分片分组文档ID
+        
+        Returns:
+            分片序号 -> (在输入中的位置列表, 分片内ID列表)
+        """
+        groups = {}
+        for position, doc_id in enumerate(ids):
+            shard, local_id = self._locate(int(doc_id))
+            positions, local_ids = groups.setdefault(shard, ([], []))
+            positions.append(position)
+            local_ids.append(local_id)
+        return groups
+    
+    def _next_doc_id(self) -> int:
+        """下一个全局文档ID（轮流分配保证等于各分片已分配ID数之和）"""
+        return sum(shard._next_id for shard in self.shards)
+    
+    def add_documents(self, texts: List[str], embeddings: np.ndarray,
+                      metadata: Optional[List[Dict]] = None) -> List[int]:
+        """
+        添加文档，按全局ID轮流分配到各分片并在线程池中并行写入
+        
+        Args:
+            texts: 文本列表
+            embeddings: 对应的嵌入向量
+            metadata: 可选的元数据列表
+        
+        Returns:
+            新文档的全局ID列表
+        """
+        if len(texts) != len(embeddings):
+            raise ValueError("文本数量和嵌入向量数量不匹配")
+        
+        if embeddings.shape[1] != self.embedding_dim:
+            raise ValueError(f"嵌入向量维度不匹配，期望 {self.embedding_dim}，实际 {embeddings.shape[1]}")
+        
+        for meta in metadata or []:
+            validate_metadata(meta)
+        
+        with self._lock:
+            start = self._next_doc_id()
+            ids = list(range(start, start + len(texts)))
+            groups = self._group_by_shard(ids)
+            # 先检查需要训练的分片是否分到足够的向量，避免部分分片写入后才发现训练失败
+            for shard, (positions, _) in groups.items():
+                minimum = self.shards[shard].min_training_vectors
+                if len(positions) < minimum:
+                    raise ValueError(f"索引 {self.index_factory} 每个分片至少需要 {minimum} 个向量训练，"
+                                     f"首批 {len(texts)} 个文档中分片 {shard} 只分到 {len(positions)} 个；"
+                                     f"首批至少需要 {self.min_training_vectors} 个文档")
+            
+            def add_to_shard(shard: int) -> List[int]:
+                positions, local_ids = groups[shard]
+                added = self.shards[shard].add_documents(
+                    [texts[i] for i in positions], embeddings[positions],
+                    [metadata[i] for i in positions] if metadata else None)
+                if added != local_ids:
+                    raise RuntimeError(f"分片 {shard} 分配的文档ID与预期不一致")
+                return added
+            
+            starts = {shard: self.shards[shard]._next_id for shard in groups}
+            futures = [self._executor.submit(add_to_shard, shard) for shard in groups]
+            errors = [future.exception() for future in futures]
+            errors = [error for error in errors if error is not None]
+            if errors:
+                # 撤销已写入的分片，保证全局ID分配不变式，且不写WAL
+                for shard, start in starts.items():
+                    if self.shards[shard]._next_id != start:
+                        self.shards[shard]._rollback_add(start)
+                logger.error(f"{len(errors)} 个分片写入失败，已撤销本批 {len(texts)} 个文档")
+                raise errors[0]
+            
+            self._log_wal({'op': 'add', 'ids': ids, 'texts': list(texts),
+                           'metadata': [metadata[i] if metadata else {} for i in range(len(texts))]},
+                          embeddings)
+        
+        self._maybe_merge_wal()
+        return ids
+    
+    def delete_documents(self, ids: List[int]) -> int:
+        """
+        删除文档
+        
+        Args:
+            ids: 要删除的全局文档ID列表，不存在的ID会被忽略
+        
+        Returns:
+            实际删除的文档数量
+        """
+        ids = sorted({int(doc_id) for doc_id in ids if doc_id >= 0})
+        with self._lock:
+            deleted = 0
+            for shard, (_, local_ids) in self._group_by_shard(ids).items():
+                deleted += self.shards[shard].delete_documents(local_ids)
+            if deleted:
+                self._log_wal({'op': 'delete', 'ids': ids})
+        
+        self._maybe_merge_wal()
+        return deleted
+    
+    def update_documents(self, ids: List[int], texts: List[str], embeddings: np.ndarray,
+                         metadata: Optional[List[Dict]] = None) -> int:
+        """
+        更新文档的文本和向量，文档ID保持不变
+        
+        Args:
+            ids: 要更新的全局文档ID列表
+            texts: 新文本列表
+            embeddings: 新文本对应的嵌入向量
+            metadata: 可选的新元数据列表，为None时保留原元数据
+        
+        Returns:
+            实际更新的文档数量
+        """
+        if not (len(ids) == len(texts) == len(embeddings)):
+            raise ValueError("文档ID、文本和嵌入向量数量不匹配")
+        
+        for meta in metadata or []:
+            validate_metadata(meta)
+        
+        with self._lock:
+            ids = [int(doc_id) for doc_id in ids]
+            if len(set(ids)) != len(ids):
+                raise ValueError("文档ID不能重复")
+            # 先检查所有分片，避免部分分片已更新后才发现ID不存在
+            missing = [doc_id for doc_id in ids if doc_id not in self.documents]
+            if missing:
+                raise KeyError(f"文档不存在: {missing}")
+            
+            embeddings = np.asarray(embeddings)
+            for shard, (positions, local_ids) in self._group_by_shard(ids).items():
+                self.shards[shard].update_documents(
+                    local_ids, [texts[i] for i in positions], embeddings[positions],
+                    [metadata[i] for i in positions] if metadata is not None else None)
+            
+            self._log_wal({'op': 'update', 'ids': ids, 'texts': list(texts),
+                           'metadata': list(metadata) if metadata is not None else None}, embeddings)
+        
+        self._maybe_merge_wal()
+        return len(ids)
+    
+    def update_metadata(self, ids: List[int], metadata: List[Dict]) -> int:
+        """
+        仅更新文档元数据，无需重新生成向量
+        
+        Args:
+            ids: 全局文档ID列表
+            metadata: 新元数据列表
+        
+        Returns:
+            实际更新的文档数量
+        """
+        for meta in metadata:
+            validate_metadata(meta)
+        
+        ids = [int(doc_id) for doc_id in ids]
+        updated = 0
+        with self._lock:
+            for shard, (positions, local_ids) in self._group_by_shard(ids).items():
+                updated += self.shards[shard].update_metadata(local_ids, [metadata[i] for i in positions])
+            if updated:
+                self._log_wal({'op': 'update_metadata', 'ids': ids, 'metadata': list(metadata)})
+        self._maybe_merge_wal()
+        return updated
+    
+    def get_document(self, doc_id: int) -> Optional[Dict]:
+        """按全局ID获取文档，不存在时返回None"""
+        document = self.documents.get(doc_id)
+        if document is None:
+            return None
+        return {'id': doc_id, 'text': document[0], 'metadata': document[1]}
+    
+    def compact(self) -> int:
+        """
+        压缩所有分片
+        
+        Returns:
+            清除的向量数量
+        """
+        return sum(self._executor.map(lambda shard: shard.compact(), self.shards))
+    
+    def _merge_results(self, per_shard: List[List[Dict]], top_k: int) -> List[Dict]:
+        """
+        将各分片按分数从高到低排列的结果做多路堆归并，保留前top_k个并重新编号
+        
+        Args:
+            per_shard: 与分片一一对应的结果列表，ID为分片内ID
+            top_k: 保留的结果数
+        
+        Returns:
+            ID为全局ID的合并结果
+        """
+        for shard, results in enumerate(per_shard):
+            for result in results:
+                result['id'] = self._global_id(shard, result['id'])
+        merged = list(islice(heapq.merge(*per_shard, key=lambda result: -result['similarity']), top_k))
+        for rank, result in enumerate(merged, 1):
+            result['rank'] = rank
+        return merged
+    
+    def search(self, query_embedding: np.ndarray, top_k: int = 5,
+               similarity_threshold: float = 0.6, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, rerank: Optional[bool] = None,
+               candidate_multiplier: Optional[int] = None,
+               filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        搜索相似的文档，参数见VectorStore.search
+        
+        Returns:
+            相似文档列表，ID为全局ID
+        """
+        return self.search_batch(query_embedding.reshape(1, -1), top_k, similarity_threshold,
+                                 nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+                                 candidate_multiplier=candidate_multiplier, filters=filters)[0]
+    
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 5,
+                     similarity_threshold: float = 0.6, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, rerank: Optional[bool] = None,
+                     candidate_multiplier: Optional[int] = None,
+                     filters: Optional[Dict] = None) -> List[List[Dict]]:
+        """
+        批量搜索：每个分片各取top_k，再按查询归并
+        
+        参数见VectorStore.search_batch。每个分片返回的都是该分片内的精确top_k，
+        因此归并结果与在单一索引上检索相同（近似索引的召回误差除外）。
+        
+        Returns:
+            与查询一一对应的结果列表，ID为全局ID
+        """
+        query_embeddings = np.atleast_2d(query_embeddings)
+        
+        def search_shard(shard: VectorStore) -> List[List[Dict]]:
+            return shard.search_batch(query_embeddings, top_k, similarity_threshold,
+                                      nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+                                      candidate_multiplier=candidate_multiplier, filters=filters)
+        
+        shard_results = list(self._executor.map(search_shard, self.shards))
+        return [self._merge_results([results[row] for results in shard_results], top_k)
+                for row in range(len(query_embeddings))]
+    
+    def lexical_search(self, query: str, top_k: int = 5,
+                       filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        基于BM25的词法检索，参数见VectorStore.lexical_search
+        
+        IDF和平均文档长度按分片统计，文档随机分布时与全局统计接近，分数仍可直接比较。
+        
+        Returns:
+            文档列表，similarity字段为BM25分数，ID为全局ID
+        """
+        if not self.lexical:
+            raise ValueError("未启用词法索引（lexical=False）")
+        shard_results = list(self._executor.map(
+            lambda shard: shard.lexical_search(query, top_k, filters=filters), self.shards))
+        return self._merge_results(shard_results, top_k)
+    
+    def _empty_copy(self) -> 'ShardedVectorStore':
+        """创建配置相同的空分片存储（合并预写日志时使用）"""
+        return ShardedVectorStore(self.embedding_dim, self.num_shards, self.index_factory,
+                                  self.compaction_threshold, self.rerank_dtype, self.coarse_dim,
+                                  self.candidate_multiplier, self.lexical, self.search_threads,
+                                  self.omp_threads_per_shard)
+    
+    def _release_base(self, filepath: str):
+        """各分片释放对即将删除的快照文件的映射（调用方需持有锁）"""
+        for i, shard in enumerate(self.shards):
+            with shard._lock:
+                shard._release_base(f"{filepath}.shard{i}")
+    
+    def save(self, filepath: str):
+        """
+        保存分片存储
+        
+        每个分片保存为 {filepath}.shard{i}.*（VectorStore.save格式），分片配置写入
+        {filepath}.shards.json。各分片并行保存。
+        """
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        with self._lock:
+            list(self._executor.map(lambda item: item[1].save(f"{filepath}.shard{item[0]}"),
+                                    enumerate(self.shards)))
+            meta = {
+                'num_shards': self.num_shards,
+                'embedding_dim': self.embedding_dim,
+                'index_factory': self.index_factory,
+                'rerank_dtype': self.rerank_dtype,
+                'coarse_dim': self.coarse_dim,
+                'lexical': self.lexical
+            }
+            with open(f"{filepath}.shards.json.tmp", 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(f"{filepath}.shards.json.tmp", f"{filepath}.shards.json")
+        
+        logger.info(f"分片向量存储已保存到: {filepath}")
+    
+    def load(self, filepath: str, mmap: bool = True):
+        """
+        加载分片存储，分片数以保存时为准
+        
+        Args:
+            filepath: 保存时使用的文件路径前缀
+            mmap: 是否以内存映射方式加载各分片的索引
+        """
+        if not os.path.exists(f"{filepath}.shards.json"):
+            raise ValueError(f"找不到分片配置文件: {filepath}.shards.json")
+        with open(f"{filepath}.shards.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        
+        with self._lock:
+            self.embedding_dim = meta['embedding_dim']
+            self.index_factory = meta['index_factory']
+            self.rerank_dtype = meta.get('rerank_dtype')
+            self.coarse_dim = meta.get('coarse_dim')
+            self.lexical = meta.get('lexical', True)
+            if meta['num_shards'] != self.num_shards:
+                logger.info(f"按保存时的配置使用 {meta['num_shards']} 个分片")
+            self._create_shards(meta['num_shards'])
+            for i, shard in enumerate(self.shards):
+                shard.load(f"{filepath}.shard{i}", mmap=mmap)
+        
+        logger.info(f"分片向量存储已加载，包含 {len(self.documents)} 个文档")
+    
+    def get_stats(self) -> Dict:
+        """获取汇总的统计信息，包括各分片的文档数和分片倾斜度（最大分片文档数 / 平均文档数）"""
+        shard_stats = [shard.get_stats() for shard in self.shards]
+        shard_documents = [stats['total_documents'] for stats in shard_stats]
+        mean = sum(shard_documents) / len(shard_documents)
+        return {
+            'total_documents': sum(shard_documents),
+            'embedding_dim': self.embedding_dim,
+            'index_size': sum(stats['index_size'] for stats in shard_stats),
+            'pending_deletes': sum(stats['pending_deletes'] for stats in shard_stats),
+            'index_factory': self.index_factory,
+            'is_trained': all(stats['is_trained'] for stats in shard_stats),
+            'rerank_dtype': self.rerank_dtype,
+            'coarse_dim': self.coarse_dim,
+            # 元数据键和词表在各分片独立统计，取最大值作为近似
+            'metadata_keys': max(stats['metadata_keys'] for stats in shard_stats),
+            'lexical_terms': max(stats['lexical_terms'] for stats in shard_stats),
+            'bytes_per_vector': shard_stats[0]['bytes_per_vector'],
+            'index_memory_bytes': sum(stats['index_memory_bytes'] for stats in shard_stats),
+            'rerank_memory_bytes': sum(stats['rerank_memory_bytes'] for stats in shard_stats),
+            'wal_unmerged_bytes': self._wal_unmerged_bytes if self._wal is not None else 0,
+            'num_shards': self.num_shards,
+            'shard_documents': shard_documents,
+            'shard_skew': max(shard_documents) / mean if mean else 1.0,
+            'search_threads': self.search_threads or self.num_shards,
+            'omp_threads_per_shard': self.omp_threads_per_shard
+        }
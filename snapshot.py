@@ -0,0 +1,202 @@
+import os
+import shutil
+import signal
+import threading
+import time
+from typing import Dict, Optional
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CURRENT_NAME = 'CURRENT'
+
+# 应用用于触发快照重载的信号；Windows没有SIGUSR2，只能使用轮询重载
+DEFAULT_RELOAD_SIGNAL = getattr(signal, 'SIGUSR2', None)
+
+def current_snapshot(root: str) -> Optional[str]:
+    """
+    读取当前生效的快照
+    
+    Args:
+        root: 快照根目录
+    
+    Returns:
+        快照文件路径前缀，尚未发布过快照时返回None
+    """
+    try:
+        with open(os.path.join(root, CURRENT_NAME), 'r', encoding='utf-8') as f:
+            relative = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.normpath(os.path.join(root, relative)) if relative else None
+
+def publish_snapshot(root: str, prefix: str, keep: int = 2) -> str:
+    """
+    将已保存的快照（VectorStore.save或ShardedVectorStore.save格式）设为当前快照
+    
+    CURRENT文件先写入临时文件再原子替换，读取者看到的总是完整的旧指针或新指针。
+    之后清理根目录下较旧的快照目录，只保留最近的keep个；已映射旧快照的进程不受影响，
+    文件在其解除映射后才真正释放。
+    
+    Args:
+        root: 快照根目录
+        prefix: 快照文件路径前缀，应位于root的子目录中，如 root/20260101-120000/kb
+        keep: 保留的快照目录数（含当前快照），0表示不清理
+    
+    Returns:
+        写入CURRENT的相对路径
+    """
+    if not (os.path.exists(f"{prefix}.meta.json") or os.path.exists(f"{prefix}.shards.json")):
+        raise ValueError(f"快照文件不完整: {prefix}")
+    os.makedirs(root, exist_ok=True)
+    relative = os.path.relpath(prefix, root)
+    path = os.path.join(root, CURRENT_NAME)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        f.write(relative)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+    logger.info(f"已发布快照: {relative}")
+    
+    if keep > 0:
+        prune_snapshots(root, keep)
+    return relative
+
+def prune_snapshots(root: str, keep: int = 2):
+    """删除根目录下除当前快照外较旧的快照目录，保留最近修改的keep个（含当前快照）"""
+    current = current_snapshot(root)
+    current_dir = os.path.dirname(current) if current else None
+    directories = [os.path.join(root, name) for name in os.listdir(root)
+                   if os.path.isdir(os.path.join(root, name))]
+    others = sorted((path for path in directories if os.path.normpath(path) != current_dir),
+                    key=os.path.getmtime, reverse=True)
+    for path in others[max(0, keep - 1):]:
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"已删除旧快照: {path}")
+
+def new_snapshot_prefix(root: str, name: str = 'kb') -> str:
+    """在根目录下创建以时间命名的快照目录，返回其中的文件路径前缀"""
+    directory = os.path.join(root, time.strftime('%Y%m%d-%H%M%S'))
+    suffix = 1
+    while os.path.exists(directory):
+        directory = os.path.join(root, f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}")
+        suffix += 1
+    os.makedirs(directory)
+    return os.path.join(directory, name)
+
+def save_snapshot(store, root: str, keep: int = 2) -> str:
+    """
+    将向量存储保存为新快照并发布
+    
+    Args:
+        store: VectorStore或ShardedVectorStore
+        root: 快照根目录
+        keep: 保留的快照目录数
+    
+    Returns:
+        新快照的文件路径前缀
+    """
+    prefix = new_snapshot_prefix(root)
+    store.save(prefix)
+    publish_snapshot(root, prefix, keep)
+    return prefix
+
+def open_snapshot(prefix: str, omp_threads_per_shard: int = 1):
+    """以内存映射方式打开快照，按文件格式创建VectorStore或ShardedVectorStore"""
+    if os.path.exists(f"{prefix}.shards.json"):
+        from sharded_store import ShardedVectorStore
+        store = ShardedVectorStore(omp_threads_per_shard=omp_threads_per_shard)
+    else:
+        from vector_store import VectorStore
+        store = VectorStore()
+    store.load(prefix, mmap=True)
+    return store
+
+class SnapshotReader:
+    """
+    多进程共享的只读快照
+    
+    每个工作进程以内存映射方式打开CURRENT指向的同一份快照文件，索引编码、文档数据和
+    倒排表都由操作系统页缓存共享，内存占用不随进程数增长。调用request_reload（通常由
+    应用的重载信号处理器调用）或启用轮询时发现CURRENT变化后，在下一次请求时打开新快照
+    并一次性替换knowledge_base.vector_store，进行中的搜索继续使用旧快照直到结束。
+    """
+    
+    def __init__(self, knowledge_base, root: str, poll_interval: float = 0.0):
+        """
+        初始化快照读取器
+        
+        Args:
+            knowledge_base: 要替换vector_store的KnowledgeBase
+            root: 快照根目录
+            poll_interval: 检查CURRENT是否变化的最小间隔（秒），0表示只在请求重载时重载
+        """
+        self.knowledge_base = knowledge_base
+        self.root = root
+        self.poll_interval = poll_interval
+        self.current = None  # 已加载的快照路径前缀
+        self.loaded_at = None
+        self._reload_requested = False
+        self._last_poll = time.monotonic()
+        self._reload_lock = threading.Lock()
+    
+    def request_reload(self):
+        """
+        请求在下一次maybe_reload时重新加载
+        
+        只设置标志，可以在信号处理器中调用；实际加载发生在下一次maybe_reload中，
+        避免在信号处理器里执行文件读取和加锁。
+        """
+        self._reload_requested = True
+    
+    def load(self) -> bool:
+        """
+        加载CURRENT指向的快照，与已加载的快照相同时不做任何事
+        
+        Returns:
+            是否替换了快照
+        """
+        with self._reload_lock:
+            prefix = current_snapshot(self.root)
+            if prefix is None:
+                raise ValueError(f"快照目录中没有已发布的快照: {self.root}")
+            if prefix == self.current:
+                return False
+            
+            started = time.time()
+            store = open_snapshot(prefix, getattr(self.knowledge_base.vector_store, 'omp_threads_per_shard', 1))
+            self.knowledge_base.vector_store = store
+            self.current = prefix
+            self.loaded_at = time.time()
+        logger.info(f"已加载快照 {prefix}，包含 {len(store.documents)} 个文档，耗时 {time.time() - started:.3f}s")
+        return True
+    
+    def maybe_reload(self) -> bool:
+        """
+        已请求重载或轮询发现CURRENT变化时重新加载（每个请求开始时调用）
+        
+        Returns:
+            是否替换了快照
+        """
+        if self.poll_interval and time.monotonic() - self._last_poll >= self.poll_interval:
+            self._last_poll = time.monotonic()
+            if current_snapshot(self.root) != self.current:
+                self._reload_requested = True
+        if not self._reload_requested or self._reload_lock.locked():
+            return False
+        self._reload_requested = False
+        try:
+            return self.load()
+        except Exception as e:
+            logger.error(f"重载快照失败，继续使用 {self.current}: {e}")
+            return False
+    
+    def get_stats(self) -> Dict:
+        """当前快照信息"""
+        return {
+            'root': self.root,
+            'current': self.current,
+            'loaded_at': self.loaded_at
+        }
@@ -0,0 +1,163 @@
+from types import SimpleNamespace
+
+import numpy as np
+import openai
+import pytest
+
+import aliyun_embedder
+from aliyun_embedder import AliYunEmbedder
+from embedding_cache import make_cache_key
+from text_utils import estimate_tokens, split_by_tokens
+
+SHORT = "短文本"
+LONG = "很长的文本" * 5
+
+
+def embedder(max_input_tokens, overflow):
+    return AliYunEmbedder(api_key="test", max_input_tokens=max_input_tokens, overflow=overflow)
+
+
+def test_cache_key_unchanged_for_short_text():
+    """未超长的文本与处理方式无关，缓存键与旧格式一致"""
+    keys = {embedder(10, 'split')._cache_key(SHORT, 1024), embedder(20, 'truncate')._cache_key(SHORT, 1024)}
+    assert keys == {make_cache_key(SHORT, "text-embedding-v4", 1024)}
+
+
+def test_cache_key_includes_overflow_settings_for_long_text():
+    """超长文本的缓存键随overflow和max_input_tokens变化"""
+    keys = {embedder(10, 'split')._cache_key(LONG, 1024),
+            embedder(10, 'truncate')._cache_key(LONG, 1024),
+            embedder(20, 'split')._cache_key(LONG, 1024)}
+    assert len(keys) == 3
+
+
+def api_error(error_class, status_code, headers=None):
+    response = SimpleNamespace(status_code=status_code, headers=headers or {}, request=None)
+    return error_class("error", response=response, body=None)
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.acquired = []
+        self.paused = []
+    
+    def acquire(self, tokens=0):
+        self.acquired.append(tokens)
+    
+    def pause(self, seconds):
+        self.paused.append(seconds)
+
+
+def text_vector(text):
+    """由文本内容确定的二维向量，便于检查结果的位置"""
+    return [float(len(text)), float(sum(map(ord, text)) % 97)]
+
+
+class StubEmbeddings:
+    """按顺序抛出预设的异常，包含reject文本的批次返回400，其余返回text_vector"""
+    
+    def __init__(self, errors=(), reject=None):
+        self.errors = list(errors)
+        self.reject = reject
+        self.calls = []
+    
+    def create(self, model, input, dimensions, encoding_format):
+        self.calls.append(list(input))
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.reject is not None and self.reject in input:
+            raise api_error(openai.BadRequestError, 400)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=text_vector(text)) for text in input])
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(aliyun_embedder.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def stubbed(errors=(), reject=None, **kwargs):
+    embedder = AliYunEmbedder(api_key="test", **kwargs)
+    embedder.client = SimpleNamespace(embeddings=StubEmbeddings(errors, reject))
+    embedder.rate_limiter = RecordingLimiter()
+    return embedder
+
+
+def test_negative_max_retries_rejected():
+    with pytest.raises(ValueError):
+        AliYunEmbedder(api_key="test", max_retries=-1)
+
+
+def test_rate_limit_pauses_all_requests_for_retry_after(sleeps, monkeypatch):
+    monkeypatch.setattr(aliyun_embedder.random, "uniform", lambda low, high: 1.0)
+    embedder = stubbed([api_error(openai.RateLimitError, 429, {"retry-after": "7"})])
+    embedder._create_embeddings(["a"], 2)
+    assert embedder.rate_limiter.paused == [7.0]
+    assert sleeps == [7.0]
+    assert embedder.get_stats()['api_calls'] == 2 and embedder.get_stats()['successful_requests'] == 1
+
+
+def test_backoff_is_exponential_with_jitter(sleeps, monkeypatch):
+    bounds = []
+    
+    def uniform(low, high):
+        bounds.append((low, high))
+        return high
+    
+    monkeypatch.setattr(aliyun_embedder.random, "uniform", uniform)
+    errors = [api_error(openai.InternalServerError, 500) for _ in range(3)]
+    embedder = stubbed(errors, max_retries=3)
+    embedder._create_embeddings(["a"], 2)
+    assert bounds == [(0.5, 1.5)] * 3
+    assert sleeps == [1.5, 3.0, 6.0]
+    # 服务端错误只退避当前请求，不暂停其他线程
+    assert embedder.rate_limiter.paused == []
+
+
+def test_gives_up_after_max_retries(sleeps):
+    errors = [api_error(openai.RateLimitError, 429) for _ in range(3)]
+    embedder = stubbed(errors, max_retries=2)
+    with pytest.raises(openai.RateLimitError):
+        embedder._create_embeddings(["a"], 2)
+    assert len(embedder.client.embeddings.calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_form_batches_respects_item_and_token_limits():
+    embedder = AliYunEmbedder(api_key="test", max_batch_tokens=10)
+    items = [(str(i), "x", tokens) for i, tokens in enumerate([4, 4, 4, 9, 1, 1, 1, 1, 12])]
+    batches = embedder._form_batches(items, max_items=3)
+    assert [[int(key) for key, _, _ in batch] for batch in batches] == [[0, 1], [2], [3, 4], [5, 6, 7], [8]]
+    # 超过预算的单条输入独占一个批次，不会被丢弃
+    assert all(sum(tokens for _, _, tokens in batch) <= 10 or len(batch) == 1 for batch in batches)
+
+
+def test_oversize_text_is_split_and_averaged_in_place():
+    long_text = "机器学习是人工智能的分支" * 3
+    texts = ["短文本", long_text, "另一段"]
+    embedder = stubbed(max_input_tokens=10, max_batch_items=2)
+    result = embedder.embed_batch(texts, dimensions=2)
+    
+    pieces = split_by_tokens(long_text, 10)
+    assert len(pieces) > 1
+    weights = [estimate_tokens(piece) for piece in pieces]
+    expected = np.average([text_vector(piece) for piece in pieces], axis=0, weights=weights)
+    np.testing.assert_allclose(result[1], expected / np.linalg.norm(expected), rtol=1e-6)
+    np.testing.assert_allclose(result[0], text_vector("短文本"))
+    np.testing.assert_allclose(result[2], text_vector("另一段"))
+    assert all(len(call) <= 2 for call in embedder.client.embeddings.calls)
+
+
+def test_bad_request_bisects_to_the_offending_input():
+    texts = [f"文本{i}" for i in range(8)]
+    embedder = stubbed(reject="文本5")
+    with pytest.raises(openai.BadRequestError):
+        embedder._request_embeddings(texts, 2)
+    calls = embedder.client.embeddings.calls
+    # 只有包含问题输入的一半继续拆分，直到单独请求该输入
+    assert calls == [texts, texts[:4], texts[4:], texts[4:6], ["文本4"], ["文本5"]]
+    
+    embedder = stubbed(reject="不存在")
+    vectors = embedder._request_embeddings(texts, 2)
+    assert [vector.tolist() for vector in vectors] == [text_vector(text) for text in texts]
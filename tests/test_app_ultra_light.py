@@ -0,0 +1,44 @@
+import pytest
+
+import app_ultra_light
+from app_ultra_light import KNOWLEDGE_DATA, KeywordMatcher, build_keyword_table, load_matcher, search_knowledge
+
+QUERIES = [
+    "什么是机器学习", "ML和DL有什么区别", "html页面怎么写", "发email给我", "AI人工智能的发展",
+    "Python编程入门", "deep learning与neural network", "自然语言处理和语言模型", "今天天气怎么样", "",
+    "machine learning算法的模型训练", "mlp", "NLP", "ai" * 3,
+]
+
+
+def substring_scan(query):
+    """原实现的命中规则：关键词是小写查询的子串即命中"""
+    query_lower = query.lower()
+    return {title: {keyword for keyword in data["keywords"] if keyword in query_lower}
+            for title, data in KNOWLEDGE_DATA.items()
+            if any(keyword in query_lower for keyword in data["keywords"])}
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_matches_old_substring_scan(query):
+    """命中的主题与原实现相同，评分为命中关键词的长度之和"""
+    expected = substring_scan(query)
+    assert app_ultra_light.KEYWORD_MATCHER.match(query.lower()) == expected
+    
+    results = search_knowledge(query)
+    assert {result["title"]: result["score"] for result in results} == {
+        title: sum(map(len, keywords)) for title, keywords in expected.items()}
+    assert [result["score"] for result in results] == sorted((result["score"] for result in results), reverse=True)
+
+
+def test_cached_matcher_round_trip(tmp_path):
+    compiled = load_matcher(KNOWLEDGE_DATA, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    cached = load_matcher(KNOWLEDGE_DATA, cache_dir=str(tmp_path))
+    for query in QUERIES:
+        assert cached.match(query.lower()) == compiled.match(query.lower())
+
+
+def test_overlapping_keywords_all_reported():
+    matcher = KeywordMatcher([("he", "a"), ("she", "b"), ("hers", "c"), ("his", "a")])
+    assert matcher.match("ushers") == {"a": {"he"}, "b": {"she"}, "c": {"hers"}}
+    assert build_keyword_table({"t": {"keywords": ["x", "x", ""]}}) == [("x", "t")]
@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pytest
+from openpyxl import Workbook
+
+from build_index import build, iter_jsonl, parse_args
+from vector_store import VectorStore
+
+
+class CountingEmbedder:
+    """确定性的嵌入器，第fail_on次embed_batch调用抛出异常"""
+    
+    model = "test"
+    
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = 0
+        self.texts = []
+    
+    def get_embedding_dim(self):
+        return 8
+    
+    def get_stats(self):
+        return {'api_calls': self.calls, 'input_tokens': len(self.texts)}
+    
+    def embed_batch(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError("嵌入API不可用")
+        self.texts.extend(texts)
+        return np.vstack([np.random.default_rng(len(text) * 31 + sum(map(ord, text))).standard_normal(8)
+                          for text in texts]).astype(np.float32)
+
+
+def write_corpus(directory):
+    with open(directory / "a.jsonl", 'w', encoding='utf-8') as f:
+        for i in range(7):
+            f.write(json.dumps({"text": f"问答{i}", "category": "faq"}, ensure_ascii=False) + "\n")
+    workbook = Workbook()
+    workbook.active.append(["问题", "答案"])
+    for row in range(6):
+        workbook.active.append([f"表格问题{row}", f"表格答案{row}"])
+    workbook.save(directory / "b.xlsx")
+    (directory / "c.xlsx").write_bytes(b"not a workbook")
+    with open(directory / "d.jsonl", 'w', encoding='utf-8') as f:
+        for i in range(5):
+            f.write(json.dumps(f"纯文本{i}", ensure_ascii=False) + "\n")
+
+
+def stored_texts(output):
+    store = VectorStore(8)
+    store.load(output)
+    return [store.get_document(doc_id)['text'] for doc_id in range(len(store.documents))]
+
+
+def test_resume_after_failure_matches_clean_build(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    write_corpus(corpus)
+    paths = [str(corpus / name) for name in ("a.jsonl", "b.xlsx", "c.xlsx", "d.jsonl")]
+    
+    clean = build(parse_args(paths + ["-o", str(tmp_path / "clean"), "--segment-size", "4", "--workers", "1"]),
+                  embedder=CountingEmbedder())
+    assert clean['documents'] == 18
+    assert [entry['path'].endswith("c.xlsx") for entry in clean['failed_files']] == [True]
+    
+    # 第3个分段嵌入失败，已提交的2个分段保留
+    args = parse_args(paths + ["-o", str(tmp_path / "resumed"), "--segment-size", "4", "--workers", "1"])
+    with pytest.raises(RuntimeError, match="嵌入API不可用"):
+        build(args, embedder=CountingEmbedder(fail_on=3))
+    manifest = json.loads((tmp_path / "resumed.build" / "manifest.json").read_text(encoding='utf-8'))
+    assert manifest['documents'] == 8 and len(manifest['segments']) == 2
+    
+    embedder = CountingEmbedder()
+    report = build(args, embedder=embedder)
+    assert report['resumed_segments'] == 2
+    assert report['embedded_this_run'] == 10
+    assert len(embedder.texts) == 10 and "问答0" not in embedder.texts
+    assert stored_texts(str(tmp_path / "resumed")) == stored_texts(str(tmp_path / "clean"))
+
+
+def test_failed_file_stays_skipped_on_resume(tmp_path):
+    """先失败的文件在续建时被跳过，即使它之后可以解析，已提交记录的顺序也不会错位"""
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    write_corpus(corpus)
+    paths = [str(corpus / name) for name in ("c.xlsx", "a.jsonl", "d.jsonl")]
+    args = parse_args(paths + ["-o", str(tmp_path / "kb"), "--segment-size", "4", "--workers", "1"])
+    with pytest.raises(RuntimeError):
+        build(args, embedder=CountingEmbedder(fail_on=2))
+    
+    report = build(args, embedder=CountingEmbedder())
+    assert [entry['path'].endswith("c.xlsx") for entry in report['failed_files']] == [True]
+    assert stored_texts(str(tmp_path / "kb")) == [f"问答{i}" for i in range(7)] + [f"纯文本{i}" for i in range(5)]
+
+
+@pytest.mark.parametrize("line", ['{"text": "x", "metadata": {"when": NaN}}', '{"text": "x", "metadata": [1]}',
+                                  '[1, 2]', '{"text": '])
+def test_iter_jsonl_reports_bad_line(tmp_path, line):
+    path = tmp_path / "bad.jsonl"
+    path.write_text('{"text": "ok"}\n' + line + "\n", encoding='utf-8')
+    records = iter_jsonl(str(path), "bad.jsonl")
+    assert next(records)[0] == "ok"
+    with pytest.raises(ValueError, match="第 2 行"):
+        next(records)
@@ -0,0 +1,47 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+from document_store import DocumentStore, validate_metadata
+from vector_store import VectorStore
+
+
+def test_save_writes_single_file_and_round_trips(tmp_path):
+    prefix = str(tmp_path / "kb")
+    store = DocumentStore()
+    store.put(0, "第一篇", {"category": "NLP", "tags": ["a", "b"]})
+    store.put(2, "第三篇", {})
+    store.save(prefix)
+    
+    assert sorted(os.listdir(tmp_path)) == ["kb.docstore"]
+    loaded = DocumentStore()
+    loaded.load(prefix)
+    assert len(loaded) == 2
+    assert loaded.get(0) == ("第一篇", {"category": "NLP", "tags": ["a", "b"]})
+    assert loaded.get(1) is None
+    assert loaded.get(2) == ("第三篇", {})
+    
+    # 加载后修改再保存，覆盖同一个文件
+    loaded.put(3, "第四篇", {"n": 1})
+    loaded.delete(0)
+    loaded.save(prefix)
+    assert list(loaded.ids()) == [2, 3]
+
+
+@pytest.mark.parametrize("metadata", [
+    {"date": datetime.date(2024, 1, 1)}, {"value": np.int64(3)}, {"pair": (1, 2)}, {1: "x"},
+    {"score": float("nan")}, ["not", "a", "dict"]])
+def test_validate_metadata_rejects_non_json(metadata):
+    with pytest.raises(ValueError):
+        validate_metadata(metadata)
+
+
+def test_add_rejects_non_json_metadata_without_partial_writes():
+    store = VectorStore(8, lexical=False)
+    vectors = np.random.default_rng(0).standard_normal((2, 8)).astype(np.float32)
+    with pytest.raises(ValueError):
+        store.add_documents(["a", "b"], vectors, [{"ok": 1}, {"when": datetime.datetime(2024, 1, 1)}])
+    assert len(store.documents) == 0
+    assert store.add_documents(["a", "b"], vectors, [{"ok": 1}, {"when": "2024-01-01"}]) == [0, 1]
@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+import pytest
+
+import embedding_cache
+from embedding_cache import QueryEmbeddingCache, normalize_query
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(embedding_cache.time, "time", clock)
+    return clock
+
+
+@pytest.mark.parametrize("variant", [
+    "什么是 机器学习", "  什么是 机器学习  ", "什么是\t\n机器学习", "什么是　机器学习", "什么是\u00a0机器学习"])
+def test_equivalent_queries_share_a_key(variant):
+    assert normalize_query(variant) == "什么是 机器学习"
+    assert QueryEmbeddingCache.key_for(variant, "m", 8) == QueryEmbeddingCache.key_for("什么是 机器学习", "m", 8)
+
+
+def test_key_depends_on_model_and_dimensions():
+    keys = {QueryEmbeddingCache.key_for("q", model, dim) for model in ("a", "b") for dim in (8, 16)}
+    assert len(keys) == 4
+
+
+def test_memory_ttl_expiry(clock):
+    cache = QueryEmbeddingCache(ttl=10)
+    cache.put("q", "m", 4, np.ones(4))
+    clock.now += 10
+    assert cache.get("q", "m", 4) is not None
+    clock.now += 1
+    assert cache.get("q", "m", 4) is None
+    assert cache.get_stats()['memory_entries'] == 0
+
+
+def test_disk_ttl_expiry_and_promotion(clock, tmp_path):
+    path = str(tmp_path / "queries.db")
+    QueryEmbeddingCache(path=path, disk_ttl=100).put("q", "m", 4, np.ones(4))
+    
+    cache = QueryEmbeddingCache(path=path, disk_ttl=100)
+    clock.now += 50
+    np.testing.assert_array_equal(cache.get("q", "m", 4), np.ones(4))
+    assert cache.get("q", "m", 4) is not None
+    assert cache.get_stats()['disk_hits'] == 1 and cache.get_stats()['memory_hits'] == 1
+    
+    other = QueryEmbeddingCache(path=path, disk_ttl=100)
+    clock.now += 51
+    assert other.get("q", "m", 4) is None
+
+
+def test_counters_are_consistent_under_concurrency():
+    cache = QueryEmbeddingCache()
+    cache.put("hit", "m", 4, np.ones(4))
+    
+    def lookup():
+        for _ in range(2000):
+            cache.get("hit", "m", 4)
+            cache.get("miss", "m", 4)
+    
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.get_stats()
+    assert stats['memory_hits'] == stats['misses'] == 16000
+    assert stats['hit_rate'] == 0.5
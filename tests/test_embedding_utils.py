@@ -0,0 +1,36 @@
+import numpy as np
+
+from embedding_utils import find_similar_vectors, top_k_similar
+
+
+def brute_force(queries, vectors, top_k):
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = queries @ vectors.T
+    order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+    return order, np.take_along_axis(scores, order, axis=1)
+
+
+def test_chunked_top_k_matches_brute_force():
+    """分块（向量集合和查询都跨多个块）的结果与整体排序一致"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 16)).astype(np.float32)
+    queries = rng.standard_normal((7, 16)).astype(np.float32)
+    indices, scores = top_k_similar(queries, vectors, top_k=10, chunk_size=64, query_chunk_size=3)
+    expected_indices, expected_scores = brute_force(queries, vectors, 10)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+def test_top_k_larger_than_corpus_and_memmap(tmp_path):
+    vectors = np.random.default_rng(1).standard_normal((5, 8)).astype(np.float32)
+    np.save(tmp_path / "vectors.npy", vectors)
+    mapped = np.load(tmp_path / "vectors.npy", mmap_mode='r')
+    indices, scores = find_similar_vectors(vectors[2], mapped, top_k=10)
+    assert len(indices) == 5 and indices[0] == 2
+    assert abs(scores[0] - 1.0) < 1e-5
+
+
+def test_empty_corpus():
+    indices, scores = top_k_similar(np.ones(8, dtype=np.float32), np.empty((0, 8), dtype=np.float32))
+    assert indices.shape == (1, 0) and scores.shape == (1, 0)
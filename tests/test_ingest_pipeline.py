@@ -0,0 +1,69 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+from openpyxl import Workbook
+
+from ingest_pipeline import ingest_files, main
+from vector_store import KnowledgeBase
+
+
+class _Embedder:
+    def get_embedding_dim(self):
+        return 4
+    
+    def embed_batch(self, texts):
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+class _FailingStore:
+    def add_documents(self, texts, embeddings, metadata):
+        raise RuntimeError("写入失败")
+
+
+class _KnowledgeBase:
+    embedder = _Embedder()
+    vector_store = _FailingStore()
+
+
+def write_faq(directory, count, rows=5):
+    for i in range(count):
+        workbook = Workbook()
+        workbook.active.append(["问题", "答案"])
+        for row in range(rows):
+            workbook.active.append([f"问题{i}-{row}", f"答案{i}-{row}"])
+        workbook.save(directory / f"faq{i}.xlsx")
+
+
+def test_parse_pool_shut_down_when_indexing_fails(tmp_path):
+    """下游写入失败时，解析进程池随异常一起关闭，不残留到垃圾回收"""
+    write_faq(tmp_path, 4)
+    
+    with pytest.raises(RuntimeError, match="写入失败") as excinfo:
+        ingest_files(_KnowledgeBase(), [str(tmp_path)], workers=1, max_pending=1, batch_size=2)
+    # 异常回溯仍被引用时进程池也已关闭
+    assert excinfo.traceback
+    assert multiprocessing.active_children() == []
+
+
+def test_cli_imports_and_saves(tmp_path, capsys):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    write_faq(corpus, 2)
+    (corpus / "broken.xlsx").write_bytes(b"not a workbook")
+    output = str(tmp_path / "kb")
+    
+    # 损坏的文件单独失败，其余文件照常导入并保存
+    assert main([str(corpus), "-o", output, "--workers", "1", "--metadata", '{"source": "faq"}'],
+                embedder=_Embedder()) == 1
+    assert "broken.xlsx" in capsys.readouterr().err
+    kb = KnowledgeBase(embedder=_Embedder())
+    kb.load(output)
+    assert len(kb.vector_store.documents) == 10
+    assert kb.vector_store.get_document(0)['metadata']['source'] == "faq"
+    
+    (corpus / "broken.xlsx").unlink()
+    assert main([str(corpus / "faq0.xlsx"), "-o", output, "--workers", "1", "--append"],
+                embedder=_Embedder()) == 0
+    kb.load(output)
+    assert len(kb.vector_store.documents) == 15
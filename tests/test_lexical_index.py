@@ -0,0 +1,34 @@
+import numpy as np
+
+from lexical_index import BM25Index
+
+DOCS = ["苹果 手机 电池", "苹果 电脑", "香蕉 水果", "苹果 水果 香蕉", "手机 电池 充电"]
+
+
+def build(skip=()):
+    index = BM25Index()
+    for label, text in enumerate(DOCS):
+        if label not in skip:
+            index.add(label, text)
+    return index
+
+
+def as_dict(labels, scores):
+    return {int(label): round(float(score), 5) for label, score in zip(labels, scores)}
+
+
+def test_filter_does_not_change_scores():
+    """过滤只减少候选，不改变文档频率和得分"""
+    index = build()
+    full = as_dict(*index.search("苹果 电池", 10))
+    allowed = np.array([True, False, True, True, False])
+    filtered = as_dict(*index.search("苹果 电池", 10, allowed))
+    assert filtered
+    assert filtered == {label: full[label] for label in filtered}
+
+
+def test_removed_documents_excluded_before_prune():
+    """删除但尚未清除的文档不计入文档频率，得分与未加入该文档的索引一致"""
+    index = build()
+    index.remove(1)
+    assert as_dict(*index.search("苹果 电池", 10)) == as_dict(*build(skip={1}).search("苹果 电池", 10))
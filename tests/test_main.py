@@ -0,0 +1,270 @@
+import json
+import os
+import signal
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import main
+from snapshot import DEFAULT_RELOAD_SIGNAL, save_snapshot
+from vector_store import VectorStore
+
+
+@pytest.fixture(autouse=True)
+def isolated_env(monkeypatch):
+    """不读写仓库目录下的缓存文件，不受外部环境变量影响"""
+    monkeypatch.setenv("KB_QUERY_CACHE_PATH", "")
+    monkeypatch.setenv("KB_EMBEDDING_CACHE_PATH", "")
+    for name in ("KB_SNAPSHOT_DIR", "KB_WAL_DIR", "KB_INDEX_FACTORY", "KB_NUM_SHARDS", "KB_SEED_SNAPSHOT"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def publish(root, count, index_factory="Flat"):
+    store = VectorStore(1024, index_factory=index_factory, lexical=False)
+    store.add_documents([f"文档{i}" for i in range(count)],
+                        np.random.default_rng(count).standard_normal((count, 1024)).astype(np.float32),
+                        [{} for _ in range(count)])
+    save_snapshot(store, str(root))
+
+
+def wait_ready(client, timeout=10):
+    deadline = time.time() + timeout
+    while client.get('/readyz').status_code != 200:
+        assert time.time() < deadline, "知识库未就绪"
+        time.sleep(0.01)
+
+
+def test_mutation_rejected_in_snapshot_mode_before_ready(monkeypatch, tmp_path):
+    """共享快照模式下，知识库就绪前的增删改请求也返回409，且不会触发初始化"""
+    monkeypatch.setenv("KB_SNAPSHOT_DIR", str(tmp_path))
+    release = threading.Event()
+    initialize_calls = []
+    
+    def blocked_initialize(self):
+        # 模拟尚未完成的后台预热
+        initialize_calls.append(threading.current_thread().name)
+        release.wait(5)
+        raise RuntimeError("预热被测试中止")
+    
+    monkeypatch.setattr(main.KnowledgeService, "_initialize", blocked_initialize)
+    app = main.create_app()
+    client = app.test_client()
+    try:
+        assert client.get('/readyz').status_code == 503
+        
+        response = client.post('/api/add_document', json={'text': '快照模式下不应写入', 'metadata': {}})
+        assert response.status_code == 409
+        for endpoint, payload in (('/api/update_document', {'id': 0, 'text': 'x'}),
+                                  ('/api/delete_documents', {'ids': [0]})):
+            assert client.post(endpoint, json=payload).status_code == 409
+        
+        service = app.extensions['knowledge_service']
+        assert not service.ready
+        assert client.get('/readyz').status_code == 503
+        # 只有后台预热线程尝试过初始化，请求线程没有
+        assert all(name == 'kb-warmup' for name in initialize_calls)
+    finally:
+        release.set()
+
+
+@pytest.mark.skipif(DEFAULT_RELOAD_SIGNAL is None, reason="平台不支持重载信号")
+def test_reload_signal_switches_snapshot(monkeypatch, tmp_path):
+    """create_app安装的信号处理器使下一个请求切换到新发布的快照"""
+    monkeypatch.setenv("KB_SNAPSHOT_DIR", str(tmp_path))
+    publish(tmp_path, 3)
+    previous = signal.getsignal(DEFAULT_RELOAD_SIGNAL)
+    try:
+        client = main.create_app().test_client()
+        wait_ready(client)
+        assert client.get('/api/stats').get_json()['vector_store']['total_documents'] == 3
+        
+        publish(tmp_path, 5)
+        # 未收到信号时继续使用已加载的快照
+        assert client.get('/api/stats').get_json()['vector_store']['total_documents'] == 3
+        os.kill(os.getpid(), DEFAULT_RELOAD_SIGNAL)
+        assert client.get('/api/stats').get_json()['vector_store']['total_documents'] == 5
+    finally:
+        signal.signal(DEFAULT_RELOAD_SIGNAL, previous)
+
+
+def test_untrainable_index_fails_startup(monkeypatch):
+    """不从快照加载时，IVF索引在启动时即失败，而不是之后每次添加文档都失败"""
+    monkeypatch.setenv("KB_INDEX_FACTORY", "IVF64,Flat")
+    app = main.create_app(warmup=False)
+    client = app.test_client()
+    app.extensions['knowledge_service'].warmup()
+    
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json()['state'] == 'failed'
+    assert 'build_index.py' in response.get_json()['error']
+
+
+def test_ivf_index_served_from_snapshot(monkeypatch, tmp_path):
+    """已训练的IVF快照可以正常加载"""
+    monkeypatch.setenv("KB_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setenv("KB_INDEX_FACTORY", "IVF16,Flat")
+    publish(tmp_path, 64, index_factory="IVF16,Flat")
+    client = main.create_app().test_client()
+    wait_ready(client)
+    stats = client.get('/api/stats').get_json()['vector_store']
+    assert stats['total_documents'] == 64 and stats['is_trained']
+
+
+def test_probes_skip_snapshot_gate(monkeypatch, tmp_path):
+    """存活和就绪检查不经过快照模式的检查和重载"""
+    monkeypatch.setenv("KB_SNAPSHOT_DIR", str(tmp_path))
+    publish(tmp_path, 3)
+    client = main.create_app().test_client()
+    wait_ready(client)
+    reloads = []
+    reader = client.application.extensions['knowledge_service'].snapshot_reader
+    monkeypatch.setattr(reader, 'maybe_reload', lambda: reloads.append(True))
+    
+    assert client.get('/healthz').status_code == 200
+    assert client.get('/readyz').status_code == 200
+    assert reloads == []
+    client.get('/api/stats')
+    assert reloads == [True]
+
+
+def test_missing_seed_snapshot_fails_startup(monkeypatch, tmp_path):
+    """空知识库启动时示例数据快照不存在则初始化失败，不调用嵌入API也不写入快照"""
+    monkeypatch.setenv("KB_SEED_SNAPSHOT", str(tmp_path / "seed.npz"))
+    app = main.create_app(warmup=False)
+    client = app.test_client()
+    app.extensions['knowledge_service'].warmup()
+    
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json()['state'] == 'failed'
+    assert 'seed_data.py' in response.get_json()['error']
+    assert os.listdir(tmp_path) == []
+
+
+def test_seed_snapshot_loaded_at_startup(monkeypatch, tmp_path):
+    from aliyun_embedder import AliYunEmbedder
+    from seed_data import sample_documents, save_seed_snapshot
+    
+    path = str(tmp_path / "seed.npz")
+    texts, _ = sample_documents()
+    embedder = AliYunEmbedder(api_key="test")
+    save_seed_snapshot(path, texts, np.random.default_rng(0).standard_normal(
+        (len(texts), embedder.get_embedding_dim())).astype(np.float32), embedder.model)
+    monkeypatch.setenv("KB_SEED_SNAPSHOT", path)
+    client = main.create_app().test_client()
+    wait_ready(client)
+    assert client.get('/readyz').get_json()['seed'] == 'snapshot'
+    assert client.get('/api/stats').get_json()['vector_store']['total_documents'] == len(texts)
+
+
+def test_empty_seed_snapshot_disables_sample_data(monkeypatch):
+    monkeypatch.setenv("KB_SEED_SNAPSHOT", "")
+    client = main.create_app().test_client()
+    wait_ready(client)
+    assert client.get('/readyz').get_json()['seed'] == 'disabled'
+    assert client.get('/api/stats').get_json()['vector_store']['total_documents'] == 0
+
+
+class StubKnowledgeBase:
+    def __init__(self, results):
+        self.results = results
+    
+    def search(self, query, top_k=5, similarity_threshold=0.6, filters=None):
+        return self.results
+
+
+class StubDoubao:
+    """逐段产出预设文本，可在指定位置抛出异常，并记录生成器是否被关闭"""
+    
+    def __init__(self, pieces, fail_after=None):
+        self.pieces = pieces
+        self.fail_after = fail_after
+        self.produced = 0
+        self.closed = False
+    
+    def knowledge_base_qa_stream(self, model, query, context):
+        try:
+            for index, piece in enumerate(self.pieces):
+                if index == self.fail_after:
+                    raise RuntimeError("模型服务不可用")
+                self.produced += 1
+                yield piece
+        finally:
+            self.closed = True
+
+
+REFERENCES = [{'id': 0, 'text': '机器学习是人工智能的分支', 'similarity': 0.9, 'metadata': {}}]
+
+
+def stream_client(results, doubao):
+    app = main.create_app(warmup=False)
+    service = app.extensions['knowledge_service']
+    service._knowledge_base = StubKnowledgeBase(results)
+    service._doubao = doubao
+    return app.test_client()
+
+
+def parse_events(body):
+    events = []
+    for block in body.split("\n\n"):
+        if block:
+            event_line, data_line = block.split("\n")
+            assert event_line.startswith("event: ") and data_line.startswith("data: ")
+            events.append((event_line[len("event: "):], json.loads(data_line[len("data: "):])))
+    return events
+
+
+def test_qa_stream_framing():
+    client = stream_client(REFERENCES, StubDoubao(["机器", "学习"]))
+    response = client.post('/api/qa/stream', json={'query': '什么是机器学习'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    body = response.get_data(as_text=True)
+    assert body.endswith("\n\n")
+    assert parse_events(body) == [('references', {'references': REFERENCES}),
+                                  ('token', {'text': '机器'}), ('token', {'text': '学习'}),
+                                  ('done', {})]
+
+
+def test_qa_stream_error_event():
+    doubao = StubDoubao(["机器", "学习"], fail_after=1)
+    response = stream_client(REFERENCES, doubao).post('/api/qa/stream', json={'query': 'q'})
+    events = parse_events(response.get_data(as_text=True))
+    assert [event for event, _ in events] == ['references', 'token', 'error']
+    assert "模型服务不可用" in events[-1][1]['error']
+    
+    assert stream_client(REFERENCES, doubao).post('/api/qa/stream', json={}).status_code == 400
+
+
+def test_qa_stream_closes_generator_on_disconnect():
+    doubao = StubDoubao([str(i) for i in range(1000)])
+    response = stream_client(REFERENCES, doubao).post('/api/qa/stream', json={'query': 'q'}, buffered=False)
+    chunks = response.iter_encoded()
+    assert next(chunks).startswith(b"event: references")
+    assert next(chunks).startswith(b"event: token")
+    # 客户端断开时WSGI服务器关闭响应，模型流随之关闭，不再继续生成
+    response.close()
+    assert doubao.closed
+    assert doubao.produced < 10
+
+
+class RecordingKnowledgeBase:
+    def __init__(self):
+        self.calls = []
+    
+    def hybrid_search(self, query, **kwargs):
+        self.calls.append(kwargs)
+        return {'results': [], 'timings': {}}
+
+
+@pytest.mark.parametrize("payload, threshold", [({}, 0.0), ({'threshold': 0.3}, 0.3)])
+def test_hybrid_search_passes_threshold(payload, threshold):
+    app = main.create_app(warmup=False)
+    kb = app.extensions['knowledge_service']._knowledge_base = RecordingKnowledgeBase()
+    response = app.test_client().post('/api/search', json={'query': 'q', 'mode': 'hybrid', **payload})
+    assert response.status_code == 200
+    assert kb.calls[0]['similarity_threshold'] == threshold
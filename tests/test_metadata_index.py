@@ -0,0 +1,168 @@
+import numpy as np
+import pytest
+
+from metadata_index import MetadataIndex
+from vector_store import VectorStore
+
+CATEGORIES = ["NLP", "CV", "RL"]
+
+
+def corpus(count=200, seed=0):
+    """随机元数据，部分文档缺少字段，tags为列表，level混用int和float"""
+    rng = np.random.default_rng(seed)
+    documents = []
+    for _ in range(count):
+        metadata = {}
+        if rng.random() < 0.8:
+            metadata["category"] = CATEGORIES[rng.integers(len(CATEGORIES))]
+        if rng.random() < 0.6:
+            metadata["tags"] = [f"t{i}" for i in rng.choice(5, size=rng.integers(1, 3), replace=False)]
+        if rng.random() < 0.7:
+            level = int(rng.integers(3))
+            metadata["level"] = float(level) if rng.random() < 0.5 else level
+        if rng.random() < 0.5:
+            metadata["public"] = bool(rng.random() < 0.5)
+        documents.append(metadata)
+    return documents
+
+
+def value_keys(value):
+    values = value if isinstance(value, list) else [value]
+    keys = set()
+    for item in values:
+        if isinstance(item, bool):
+            keys.add(('b', item))
+        elif isinstance(item, (int, float)):
+            keys.add(('n', float(item)))
+        else:
+            keys.add(('s', item))
+    return keys
+
+
+def brute_force(metadata, filters):
+    """逐条文档直接判断是否满足过滤条件"""
+    for field, condition in filters.items():
+        if field == '$and':
+            if not all(brute_force(metadata, sub) for sub in condition):
+                return False
+        elif field == '$or':
+            if not any(brute_force(metadata, sub) for sub in condition):
+                return False
+        else:
+            have = value_keys(metadata[field]) if field in metadata else set()
+            operators = condition if isinstance(condition, dict) else {'$in': condition if isinstance(condition, list) else [condition]}
+            for operator, value in operators.items():
+                hit = bool(have & value_keys(value))
+                if hit != (operator in ('$eq', '$in')):
+                    return False
+    return True
+
+
+FILTERS = [
+    {"category": "NLP"},
+    {"category": ["NLP", "CV"]},
+    {"category": {"$eq": "CV"}},
+    {"category": {"$ne": "NLP"}},
+    {"category": {"$in": ["RL"]}},
+    {"category": {"$nin": ["NLP", "CV"]}},
+    {"tags": "t1"},
+    {"tags": {"$nin": ["t1", "t2"]}},
+    {"level": 1},
+    {"level": {"$ne": 2.0}},
+    {"public": True},
+    {"public": {"$ne": False}},
+    {"level": 0, "public": False},
+    {"$or": [{"category": "NLP"}, {"tags": "t3"}]},
+    {"$and": [{"category": {"$ne": "CV"}}, {"level": {"$in": [0, 1]}}]},
+    {"$or": [{"$and": [{"category": "RL"}, {"public": True}]}, {"tags": {"$nin": ["t0"]}}]},
+    {"category": "NLP", "$or": [{"level": 2}, {"missing": {"$ne": "x"}}]},
+    {"missing": "x"},
+    {"missing": {"$nin": ["x"]}},
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_match_equals_brute_force(filters):
+    documents = corpus()
+    index = MetadataIndex.build(enumerate(documents))
+    expected = [brute_force(metadata, filters) for metadata in documents]
+    np.testing.assert_array_equal(index.match(filters, len(documents)), expected)
+
+
+def test_ne_and_nin_include_documents_missing_the_field():
+    index = MetadataIndex.build(enumerate([{"category": "NLP"}, {}, {"category": "CV"}]))
+    assert index.match({"category": {"$ne": "NLP"}}, 3).tolist() == [False, True, True]
+    assert index.match({"category": {"$nin": ["NLP", "CV"]}}, 3).tolist() == [False, True, False]
+
+
+@pytest.mark.parametrize("filters", [{"$or": []}, {"$xor": [{}]}, {"a": {"$gt": 1}},
+                                     {"a": {"$in": "x"}}, {"a": {"b": 1}}, ["a"]])
+def test_invalid_filters_rejected(filters):
+    with pytest.raises(ValueError):
+        MetadataIndex().match(filters, 1)
+
+
+def filtered_ids(store, filters, dim):
+    results = store.search(np.ones(dim, dtype=np.float32), top_k=1000,
+                           similarity_threshold=-1.0, filters=filters)
+    return sorted(result['id'] for result in results)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_filtered_search_excludes_deleted_and_updated(filters):
+    dim = 8
+    documents = corpus(101)
+    store = VectorStore(dim, compaction_threshold=1.0, lexical=False)
+    ids = store.add_documents([str(i) for i in range(len(documents))],
+                              np.random.default_rng(1).standard_normal((len(documents), dim)).astype(np.float32),
+                              documents)
+    store.delete_documents(ids[::7])
+    changed = {doc_id: corpus(1, seed=doc_id)[0] for doc_id in ids[1::5]}
+    store.update_metadata(list(changed), list(changed.values()))
+    
+    live = {doc_id: changed.get(doc_id, documents[doc_id]) for doc_id in ids if doc_id % 7}
+    expected = sorted(doc_id for doc_id, metadata in live.items() if brute_force(metadata, filters))
+    assert filtered_ids(store, filters, dim) == expected
+    # 压缩后结果不变
+    store.compact()
+    assert filtered_ids(store, filters, dim) == expected
+
+
+def test_filter_selector_bitmap_matches_mask():
+    documents = corpus(21)  # 标签数不是8的倍数
+    store = VectorStore(4, compaction_threshold=1.0, lexical=False)
+    store.add_documents([str(i) for i in range(len(documents))],
+                        np.random.default_rng(2).standard_normal((len(documents), 4)).astype(np.float32),
+                        documents)
+    store.delete_documents([0, 20])
+    filters = {"category": {"$ne": "CV"}}
+    selector, bitmap = store._get_filter_selector(filters)
+    assert len(bitmap) == 3
+    members = [bool(selector.is_member(label)) for label in range(len(documents))]
+    expected = [brute_force(metadata, filters) and label not in (0, 20) for label, metadata in enumerate(documents)]
+    assert members == expected
+    
+    assert store._get_filter_selector({"category": "不存在"}) is None
+
+
+def test_save_and_mmap_load(tmp_path):
+    documents = corpus()
+    index = MetadataIndex.build(enumerate(documents))
+    index.remove(3, documents[3])
+    alive = np.ones(len(documents), dtype=bool)
+    alive[::10] = False
+    prefix = str(tmp_path / "kb")
+    index.save(prefix, alive)
+    
+    loaded = MetadataIndex.load(prefix)
+    assert all(isinstance(posting.labels, np.memmap) for posting in loaded._postings.values())
+    # 保存时已删除的标签和移除的旧元数据不写入，相当于没有元数据
+    saved = [metadata if alive[label] and label != 3 else {} for label, metadata in enumerate(documents)]
+    for filters in FILTERS:
+        np.testing.assert_array_equal(loaded.match(filters, len(documents)),
+                                      [brute_force(metadata, filters) for metadata in saved])
+    
+    # 加载后的只读数组在追加时被复制，文件内容不变
+    loaded.add(len(documents), {"category": "NLP"})
+    assert loaded.match({"category": "NLP"}, len(documents) + 1)[-1]
+    assert not MetadataIndex.load(prefix).match({"category": "NLP"}, len(documents) + 1)[-1]
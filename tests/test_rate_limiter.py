@@ -0,0 +1,71 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket
+
+
+class FakeTime:
+    """可控的单调时钟，sleep直接推进时间"""
+    
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+    
+    def monotonic(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(rate_limiter.time, "sleep", fake.sleep)
+    return fake
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(60)
+    bucket.updated_at = 0.0
+    assert bucket.wait_time(60, 0.0) == 0.0
+    bucket.consume(60)
+    assert bucket.wait_time(1, 0.0) == pytest.approx(1.0)
+    assert bucket.wait_time(1, 0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(1, 1.0) == 0.0
+    # 补充不超过容量
+    assert bucket.wait_time(1, 1000.0) == 0.0 and bucket.tokens == 60
+
+
+def test_token_bucket_admits_oversized_request_when_full():
+    bucket = TokenBucket(10)
+    bucket.updated_at = 0.0
+    assert bucket.wait_time(50, 0.0) == 0.0
+    bucket.consume(50)
+    assert bucket.wait_time(1, 0.0) == pytest.approx((1 + 40) * 6.0)
+
+
+def test_requests_per_minute_spaces_requests(fake_time):
+    limiter = RateLimiter(requests_per_minute=2)
+    limiter.acquire()
+    limiter.acquire()
+    assert fake_time.sleeps == []
+    limiter.acquire()
+    assert sum(fake_time.sleeps) == pytest.approx(30.0)
+
+
+def test_tokens_per_minute_limits_by_estimated_tokens(fake_time):
+    limiter = RateLimiter(tokens_per_minute=600)
+    limiter.acquire(tokens=600)
+    limiter.acquire(tokens=100)
+    assert sum(fake_time.sleeps) == pytest.approx(10.0)
+
+
+def test_pause_blocks_all_requests_until_deadline(fake_time):
+    limiter = RateLimiter()
+    limiter.pause(7.0)
+    limiter.pause(2.0)  # 较短的暂停不会提前结束已有的暂停
+    limiter.acquire()
+    assert sum(fake_time.sleeps) == pytest.approx(7.0)
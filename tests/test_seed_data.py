@@ -0,0 +1,93 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from seed_data import load_seed_snapshot, sample_documents, save_seed_snapshot, seed_from_snapshot
+
+DIM = 8
+
+
+class FakeEmbedder:
+    model = "fake-embedding"
+    
+    def get_embedding_dim(self):
+        return DIM
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.added = []
+    
+    def add_documents(self, texts, embeddings, metadata):
+        self.added.append((texts, embeddings, metadata))
+
+
+def knowledge_base():
+    return SimpleNamespace(embedder=FakeEmbedder(), vector_store=FakeVectorStore())
+
+
+def embeddings(seed=0):
+    texts, _ = sample_documents()
+    return np.random.default_rng(seed).standard_normal((len(texts), DIM)).astype(np.float32)
+
+
+def test_snapshot_round_trip_and_staleness(tmp_path):
+    path = str(tmp_path / "data" / "seed.npz")
+    texts, _ = sample_documents()
+    save_seed_snapshot(path, texts, embeddings(), "fake-embedding")
+    
+    np.testing.assert_array_equal(load_seed_snapshot(path, texts, "fake-embedding", DIM), embeddings())
+    assert load_seed_snapshot(path, texts, "other-model", DIM) is None
+    assert load_seed_snapshot(path, texts, "fake-embedding", DIM * 2) is None
+    assert load_seed_snapshot(path, texts[:-1], "fake-embedding", DIM) is None
+    assert os.listdir(tmp_path / "data") == ["seed.npz"]
+
+
+def test_concurrent_writers_leave_one_complete_snapshot(tmp_path):
+    """多个进程同时写入时各用独立的临时文件，最终文件总是某一次完整的写入"""
+    path = str(tmp_path / "seed.npz")
+    texts, _ = sample_documents()
+    versions = [embeddings(seed) for seed in range(8)]
+    threads = [threading.Thread(target=save_seed_snapshot, args=(path, texts, version, "fake-embedding"))
+               for version in versions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    loaded = load_seed_snapshot(path, texts, "fake-embedding", DIM)
+    assert any(np.array_equal(loaded, version) for version in versions)
+    assert os.listdir(tmp_path) == ["seed.npz"]
+
+
+def test_failed_write_keeps_previous_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / "seed.npz")
+    texts, _ = sample_documents()
+    save_seed_snapshot(path, texts, embeddings(1), "fake-embedding")
+    
+    def fail(*args, **kwargs):
+        raise OSError("磁盘已满")
+    
+    monkeypatch.setattr(np, "savez", fail)
+    with pytest.raises(OSError):
+        save_seed_snapshot(path, texts, embeddings(2), "fake-embedding")
+    np.testing.assert_array_equal(load_seed_snapshot(path, texts, "fake-embedding", DIM), embeddings(1))
+    assert os.listdir(tmp_path) == ["seed.npz"]
+
+
+def test_seed_from_snapshot(tmp_path):
+    path = str(tmp_path / "seed.npz")
+    kb = knowledge_base()
+    with pytest.raises(RuntimeError, match="seed_data.py"):
+        seed_from_snapshot(kb, path)
+    assert kb.vector_store.added == []
+    
+    texts, metadata = sample_documents()
+    save_seed_snapshot(path, texts, embeddings(), "fake-embedding")
+    seed_from_snapshot(kb, path)
+    [(added_texts, added_embeddings, added_metadata)] = kb.vector_store.added
+    assert added_texts == texts and added_metadata == metadata
+    np.testing.assert_array_equal(added_embeddings, embeddings())
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from sharded_store import ShardedVectorStore
+from vector_store import VectorStore
+
+DIM = 16
+
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+
+
+def add_corpus(store, count=20, seed=0):
+    embeddings = vectors(count, seed)
+    ids = store.add_documents([f"文档{i}" for i in range(count)], embeddings,
+                              [{"group": i % 4} for i in range(count)])
+    return ids, embeddings
+
+
+def test_global_ids_round_robin_across_shards():
+    store = ShardedVectorStore(DIM, num_shards=3, compaction_threshold=1.0, lexical=False)
+    ids, _ = add_corpus(store, 10)
+    assert ids == list(range(10))
+    assert [len(shard.documents) for shard in store.shards] == [4, 3, 3]
+    for doc_id in ids:
+        shard, local_id = store._locate(doc_id)
+        assert store._global_id(shard, local_id) == doc_id
+        assert store.shards[shard].documents.get(local_id)[0] == f"文档{doc_id}"
+        assert store.get_document(doc_id)['text'] == f"文档{doc_id}"
+    
+    more = store.add_documents(["新文档"], vectors(1, 1))
+    assert more == [10]
+    assert store.delete_documents([4, 10]) == 2
+    assert store.update_documents([5], ["改写"], vectors(1, 2)) == 1
+    assert sorted(store.documents.ids()) == [0, 1, 2, 3, 5, 6, 7, 8, 9]
+    assert store.get_document(5)['text'] == "改写"
+    assert store.get_document(4) is None
+
+
+@pytest.mark.parametrize("filters", [None, {"group": 1}, {"group": {"$in": [0, 3]}}])
+def test_merged_results_match_single_store(filters):
+    sharded = ShardedVectorStore(DIM, num_shards=4, compaction_threshold=1.0, lexical=False)
+    single = VectorStore(DIM, compaction_threshold=1.0, lexical=False)
+    _, embeddings = add_corpus(sharded, 40)
+    add_corpus(single, 40)
+    
+    for query in vectors(5, 7):
+        expected = single.search(query, top_k=7, similarity_threshold=-1.0, filters=filters)
+        actual = sharded.search(query, top_k=7, similarity_threshold=-1.0, filters=filters)
+        assert [result['id'] for result in actual] == [result['id'] for result in expected]
+        assert [result['rank'] for result in actual] == list(range(1, len(expected) + 1))
+        np.testing.assert_allclose([result['similarity'] for result in actual],
+                                   [result['similarity'] for result in expected], rtol=1e-5)
+    
+    batch = sharded.search_batch(embeddings[:3], top_k=40, similarity_threshold=-1.0, filters=filters)
+    for query, results in zip(embeddings[:3], batch):
+        expected = single.search(query, top_k=40, similarity_threshold=-1.0, filters=filters)
+        assert [result['id'] for result in results] == [result['id'] for result in expected]
+
+
+def test_failed_shard_rolls_back_whole_batch(tmp_path, monkeypatch):
+    store = ShardedVectorStore(DIM, num_shards=3, compaction_threshold=1.0, lexical=False)
+    store.open_wal(str(tmp_path), sync=False, merge_bytes=0)
+    add_corpus(store, 6)
+    
+    def fail(*args, **kwargs):
+        raise RuntimeError("磁盘已满")
+    
+    monkeypatch.setattr(store.shards[1], "add_documents", fail)
+    with pytest.raises(RuntimeError, match="磁盘已满"):
+        add_corpus(store, 5, seed=1)
+    monkeypatch.undo()
+    
+    assert sorted(store.documents.ids()) == list(range(6))
+    assert [shard._next_id for shard in store.shards] == [2, 2, 2]
+    query = vectors(5, 1)[0]
+    assert all(result['id'] < 6 for result in store.search(query, top_k=10, similarity_threshold=-1.0))
+    
+    ids = store.add_documents(["重试"], vectors(1, 3))
+    assert ids == [6]
+    assert store.get_document(6)['text'] == "重试"
+    store.close_wal()
+    
+    reopened = ShardedVectorStore(DIM, num_shards=3, compaction_threshold=1.0, lexical=False)
+    reopened.open_wal(str(tmp_path), sync=False, merge_bytes=0)
+    assert sorted(reopened.documents.ids()) == list(range(7))
+    assert reopened.get_document(6)['text'] == "重试"
+    reopened.close_wal()
+
+
+def test_undertrained_shard_rejected_before_any_write():
+    store = ShardedVectorStore(DIM, num_shards=2, index_factory="IVF4,Flat",
+                               compaction_threshold=1.0, lexical=False)
+    assert store.min_training_vectors == 8
+    with pytest.raises(ValueError, match="8"):
+        add_corpus(store, 7)
+    assert len(store.documents) == 0
+    assert [shard._next_id for shard in store.shards] == [0, 0]
+    assert not any(shard.index.is_trained for shard in store.shards)
+    
+    assert add_corpus(store, 8)[0] == list(range(8))
@@ -0,0 +1,185 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from vector_store import KnowledgeBase, VectorStore
+
+
+def vectors(count, dim=32):
+    return np.random.default_rng(count).standard_normal((count, dim)).astype(np.float32)
+
+
+@pytest.mark.parametrize("index_factory, minimum", [
+    ("Flat", 0), ("HNSW32", 0), ("sq8", 0), ("IVF64,Flat", 64), ("IVF16,PQ4", 256)])
+def test_min_training_vectors(index_factory, minimum):
+    assert VectorStore(32, index_factory=index_factory, lexical=False).min_training_vectors == minimum
+
+
+def test_ivf_rejects_too_small_first_batch():
+    """首批向量不足以训练IVF索引时给出所需数量"""
+    store = VectorStore(32, index_factory="IVF64,Flat", lexical=False)
+    with pytest.raises(ValueError, match="64"):
+        store.add_documents([f"文档{i}" for i in range(5)], vectors(5), [{} for _ in range(5)])
+    store.add_documents([f"文档{i}" for i in range(64)], vectors(64), [{} for _ in range(64)])
+    assert len(store.documents) == 64
+
+
+def populated_store(count=20, index_factory="Flat"):
+    store = VectorStore(32, index_factory=index_factory, compaction_threshold=1.0)
+    embeddings = vectors(count)
+    ids = store.add_documents([f"文档{i}" for i in range(count)], embeddings,
+                              [{"n": i} for i in range(count)])
+    return store, ids, embeddings
+
+
+def top_id(store, embedding):
+    results = store.search(embedding, top_k=1, similarity_threshold=-1.0)
+    return results[0]['id'] if results else None
+
+
+@pytest.mark.parametrize("index_factory", ["Flat", "HNSW32"])
+def test_delete_then_compact(index_factory):
+    store, ids, embeddings = populated_store(index_factory=index_factory)
+    assert store.delete_documents(ids[:5] + [999]) == 5
+    assert store.get_document(ids[0]) is None
+    assert top_id(store, embeddings[0]) != ids[0]
+    
+    assert store.compact() == 5
+    assert store.index.ntotal == 15
+    assert store.compact() == 0
+    for i in range(5, 20):
+        assert top_id(store, embeddings[i]) == ids[i]
+
+
+def test_update_replaces_vector_and_keeps_id():
+    store, ids, embeddings = populated_store()
+    replacement = vectors(1, dim=32) + 5.0
+    assert store.update_documents([ids[3]], ["新文本"], replacement) == 1
+    assert store.get_document(ids[3]) == {'id': ids[3], 'text': "新文本", 'metadata': {"n": 3}}
+    assert top_id(store, replacement[0]) == ids[3]
+    assert top_id(store, embeddings[3]) != ids[3]
+    with pytest.raises(KeyError):
+        store.update_documents([999], ["x"], replacement)
+
+
+def test_failed_update_keeps_old_version(monkeypatch):
+    """新向量写入失败时旧向量不能被标记删除"""
+    store, ids, embeddings = populated_store()
+    
+    def fail(*args):
+        raise RuntimeError("add failed")
+    
+    monkeypatch.setattr(store.index, "add_with_ids", fail)
+    with pytest.raises(RuntimeError):
+        store.update_documents([ids[3]], ["新文本"], vectors(1))
+    monkeypatch.undo()
+    assert not store._tombstones
+    assert top_id(store, embeddings[3]) == ids[3]
+
+
+def test_compaction_keeps_deletes_made_during_rebuild(monkeypatch):
+    store, ids, embeddings = populated_store()
+    store.delete_documents(ids[:5])
+    purge = store._purge
+    
+    def purge_and_delete(index, dead):
+        # 模拟锁外重建期间另一个线程删除文档
+        result = purge(index, dead)
+        store.delete_documents([ids[10]])
+        return result
+    
+    monkeypatch.setattr(store, "_purge", purge_and_delete)
+    assert store.compact() == 5
+    assert store._tombstones == {10}
+    assert store.get_document(ids[10]) is None
+    assert top_id(store, embeddings[10]) != ids[10]
+
+
+def test_compaction_retries_when_vectors_added_during_rebuild(monkeypatch):
+    store, ids, embeddings = populated_store()
+    store.delete_documents(ids[:5])
+    purge = store._purge
+    added = []
+    
+    def purge_and_add(index, dead):
+        result = purge(index, dead)
+        if not added:
+            added.extend(store.add_documents(["新文档"], vectors(1) + 5.0))
+        return result
+    
+    monkeypatch.setattr(store, "_purge", purge_and_add)
+    assert store.compact() == 5
+    assert store.index.ntotal == 16
+    assert top_id(store, vectors(1)[0] + 5.0) == added[0]
+
+
+def test_rerank_restores_exact_order():
+    """低维粗筛排在前面的文档，按全维精确分数重排序后落到后面"""
+    dim = 8
+    query = np.zeros(dim, dtype=np.float32)
+    query[[0, 2]] = 1.0
+    coarse_favourite = np.zeros(dim, dtype=np.float32)
+    coarse_favourite[0] = 1.0
+    exact_favourite = np.zeros(dim, dtype=np.float32)
+    exact_favourite[[0, 1, 2]] = [0.8, 0.6, 1.0]
+    # 其余文档与查询正交
+    others = vectors(6, dim=dim)
+    others[:, [0, 2]] = 0.0
+    embeddings = np.vstack([coarse_favourite, exact_favourite, others])
+    
+    store = VectorStore(dim, coarse_dim=2, rerank_dtype='float32', lexical=False)
+    ids = store.add_documents([f"文档{i}" for i in range(len(embeddings))], embeddings)
+    
+    coarse = store.search(query, top_k=2, similarity_threshold=-1.0, rerank=False)
+    reranked = store.search(query, top_k=2, similarity_threshold=-1.0, rerank=True)
+    assert [result['id'] for result in coarse] == [ids[0], ids[1]]
+    assert [result['id'] for result in reranked] == [ids[1], ids[0]]
+    
+    unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    exact = unit @ (query / np.linalg.norm(query))
+    for result in reranked:
+        assert result['similarity'] == pytest.approx(exact[ids.index(result['id'])], abs=1e-5)
+
+
+class HashEmbedder:
+    """按文本哈希生成确定性向量的嵌入器"""
+    
+    def get_embedding_dim(self):
+        return 16
+    
+    def embed_text(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:4], 'little')
+        return np.random.default_rng(seed).standard_normal(16).astype(np.float32)
+    
+    def embed_batch(self, texts):
+        return np.vstack([self.embed_text(text) for text in texts])
+
+
+def test_hybrid_executor_created_lazily_and_closed():
+    kb = KnowledgeBase(embedder=HashEmbedder())
+    kb.add_documents(["机器学习 入门", "操作系统 调度", "数据库 索引"], [{}, {}, {}])
+    assert kb._executor is None
+    kb.search("机器学习")
+    assert kb._executor is None
+    
+    results = kb.hybrid_search("机器学习", top_k=2)['results']
+    assert results[0]['text'] == "机器学习 入门"
+    executor = kb._executor
+    assert executor is not None
+    
+    kb.close()
+    assert kb._executor is None and executor._shutdown
+    kb.close()
+    # 关闭后再次混合检索会重新创建线程池
+    assert kb.hybrid_search("机器学习", top_k=2)['results'][0]['text'] == "机器学习 入门"
+    kb.close()
+
+
+def test_hybrid_threshold_filters_only_dense_candidates():
+    kb = KnowledgeBase(embedder=HashEmbedder())
+    kb.add_documents(["机器学习 入门", "数据库 索引"], [{}, {}])
+    results = kb.hybrid_search("机器学习", top_k=5, similarity_threshold=1.1)['results']
+    kb.close()
+    assert [result['text'] for result in results] == ["机器学习 入门"]
+    assert results[0]['dense_similarity'] is None and results[0]['bm25_score'] > 0
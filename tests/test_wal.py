@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import pytest
+
+import wal
+from vector_store import VectorStore
+from wal import list_segments, read_manifest, segment_path
+
+DIM = 8
+
+
+def vectors(count, seed):
+    return np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+
+
+def open_store(directory):
+    store = VectorStore(DIM, compaction_threshold=1.0, lexical=False)
+    store.open_wal(str(directory), sync=False, merge_bytes=0)
+    return store
+
+
+def contents(store):
+    documents = {doc_id: store.documents.get(doc_id) for doc_id in store.documents.ids()}
+    query = vectors(1, 99)[0]
+    ranking = [result['id'] for result in store.search(query, top_k=50, similarity_threshold=-1.0)]
+    return documents, ranking
+
+
+def mutate(store, seed):
+    """依次执行添加、删除、更新和仅更新元数据"""
+    ids = store.add_documents([f"文档{seed}-{i}" for i in range(6)], vectors(6, seed),
+                              [{"batch": seed, "i": i} for i in range(6)])
+    store.delete_documents(ids[:2])
+    store.update_documents([ids[2]], [f"更新{seed}"], vectors(1, seed + 1000))
+    store.update_metadata([ids[3]], [{"batch": seed, "tag": "changed"}])
+    return ids
+
+
+def last_segment(directory):
+    return segment_path(str(directory), list_segments(str(directory))[-1])
+
+
+def test_replay_after_unclean_shutdown(tmp_path):
+    store = open_store(tmp_path)
+    mutate(store, 1)
+    expected = contents(store)
+    # 不调用close_wal，模拟进程被杀死
+    del store
+    
+    recovered = open_store(tmp_path)
+    assert contents(recovered) == expected
+    assert len(recovered.documents) == 4
+
+
+@pytest.mark.parametrize("damage", ["torn", "crc"])
+def test_damaged_tail_frame_is_truncated(tmp_path, damage):
+    store = open_store(tmp_path)
+    mutate(store, 1)
+    expected = contents(store)
+    store.add_documents(["崩溃时写入一半"], vectors(1, 7), [{}])
+    path = last_segment(tmp_path)
+    intact = os.path.getsize(path)
+    del store
+    
+    # 最后一条记录之前的内容就是mutate写入的部分
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'r+b') as f:
+        if damage == "torn":
+            f.truncate(intact - 5)
+        else:
+            f.seek(intact - 1)
+            f.write(bytes([data[-1] ^ 0xFF]))
+    
+    recovered = open_store(tmp_path)
+    assert contents(recovered) == expected
+    assert os.path.getsize(path) < intact - 5
+    # 截断后的分段之后继续写入，再次恢复时不会读到损坏的内容
+    recovered.add_documents(["恢复后写入"], vectors(1, 8), [{}])
+    after = contents(recovered)
+    del recovered
+    assert contents(open_store(tmp_path)) == after
+
+
+def test_replay_across_segment_rotation(tmp_path):
+    store = open_store(tmp_path)
+    mutate(store, 1)
+    with store._lock:
+        store._wal.rotate()
+    mutate(store, 2)
+    del store
+    
+    # 重新打开从新分段开始写入，之前的两个分段都需要重放
+    reopened = open_store(tmp_path)
+    mutate(reopened, 3)
+    expected = contents(reopened)
+    del reopened
+    assert len(list_segments(str(tmp_path))) == 3
+    
+    recovered = open_store(tmp_path)
+    assert contents(recovered) == expected
+    assert len(recovered.documents) == 12
+
+
+@pytest.mark.parametrize("crash_point", ["before_manifest", "before_release"])
+def test_crash_during_merge_loses_nothing_and_applies_nothing_twice(tmp_path, monkeypatch, crash_point):
+    store = open_store(tmp_path)
+    mutate(store, 1)
+    assert store.merge_wal() is not None
+    mutate(store, 2)
+    
+    class Crash(Exception):
+        pass
+    
+    def crash(*args):
+        raise Crash()
+    
+    if crash_point == "before_manifest":
+        monkeypatch.setattr(wal, "write_manifest", crash)
+    else:
+        # 清单已指向新快照，但旧快照和已合并的分段尚未删除
+        monkeypatch.setattr(store, "_release_base", crash)
+    with pytest.raises(Crash):
+        store.merge_wal()
+    monkeypatch.undo()
+    # 合并期间切换到的新分段继续接收写入
+    mutate(store, 3)
+    expected = contents(store)
+    del store
+    
+    manifest = read_manifest(str(tmp_path))
+    if crash_point == "before_release":
+        assert any(sequence <= manifest['sequence'] for sequence in list_segments(str(tmp_path)))
+    recovered = open_store(tmp_path)
+    assert contents(recovered) == expected
+    assert len(recovered.documents) == 12
+    
+    # 恢复后的合并照常完成并清理残留文件
+    assert recovered.merge_wal() is not None
+    assert all(sequence > read_manifest(str(tmp_path))['sequence'] for sequence in list_segments(str(tmp_path)))
+    assert contents(recovered) == expected
@@ -0,0 +1,93 @@
+import re
+import unicodedata
+from typing import List
+
+# CJK统一表意文字、假名、韩文音节等，一个字符通常对应约一个token
+_CJK_CHARS = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_CJK_PATTERN = re.compile(f'[{_CJK_CHARS}]')
+
+# 检索分词：字母数字标识符（可含 - _ . 连接，如 SKU-1024、v2.1）或连续的CJK字符
+_TERM_PATTERN = re.compile(f'[a-z0-9]+(?:[-_.][a-z0-9]+)*|[{_CJK_CHARS}]+')
+_TERM_SEPARATOR = re.compile(r'[-_.]')
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的token数量（不依赖具体的分词器）
+    
+    CJK字符按每字符1个token计算，其余字符按每4个字符1个token计算。
+    
+    Args:
+        text: 输入文本
+    
+    Returns:
+        估计的token数量，非空文本至少为1
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return max(1, cjk + (other + 3) // 4)
+
+def _char_cost(char: str) -> float:
+    """单个字符的估计token开销"""
+    return 1.0 if _CJK_PATTERN.match(char) else 0.25
+
+def split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """
+    按估计的token数将文本切分为若干段，每段不超过max_tokens
+    
+    Args:
+        text: 输入文本
+        max_tokens: 每段的最大token数
+    
+    Returns:
+        文本片段列表，未超限的文本原样返回单个元素
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    
+    pieces = []
+    start = 0
+    cost = 0.0
+    for i, char in enumerate(text):
+        char_cost = _char_cost(char)
+        if cost + char_cost > max_tokens and i > start:
+            pieces.append(text[start:i])
+            start = i
+            cost = 0.0
+        cost += char_cost
+    pieces.append(text[start:])
+    return pieces
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按估计的token数截断文本"""
+    return split_by_tokens(text, max_tokens)[0]
+
+def tokenize(text: str) -> List[str]:
+    """
+    面向检索的分词（不依赖中文分词词典）
+    
+    文本先做NFKC规范化并转为小写。连续的CJK字符切分为相邻二字组（单字保留原样）；
+    字母数字标识符整体作为一个词，含连接符的标识符（如 sku-1024）额外加入各组成部分，
+    使产品编号既能整体精确匹配，也能按部分匹配。
+    
+    Args:
+        text: 输入文本
+    
+    Returns:
+        词列表（保留重复，用于统计词频）
+    """
+    terms = []
+    for match in _TERM_PATTERN.finditer(unicodedata.normalize('NFKC', text).lower()):
+        term = match.group()
+        if _CJK_PATTERN.match(term):
+            if len(term) == 1:
+                terms.append(term)
+            else:
+                terms.extend(term[i:i + 2] for i in range(len(term) - 1))
+        else:
+            terms.append(term)
+            parts = _TERM_SEPARATOR.split(term)
+            if len(parts) > 1:
+                terms.extend(parts)
+    return terms
@@ -1,38 +1,241 @@
 import numpy as np
 import faiss
 import pickle
+import json
 import os
-from typing import List, Dict, Tuple, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Dict, Tuple, Optional, Union
 import logging
+from document_store import DocumentStore, validate_metadata
+from metadata_index import MetadataIndex
+from lexical_index import BM25Index
+from ingest_pipeline import IngestPipeline
+from wal import WriteAheadLogMixin
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class VectorStore:
+# 向量存储编码预设：名称 -> FAISS索引工厂字符串，{pq_m} 替换为 维度/16（每个子量化器编码16维）。
+# IVF索引首批至少需要与聚类数相同的向量才能训练（ivf_sq8 / ivf_pq 为1024个），
+# float16 / sq8 对首批数量没有要求
+STORAGE_PRESETS = {
+    'float32': 'Flat',  # 原始向量，4字节/维
+    'float16': 'SQfp16',  # 半精度，2字节/维
+    'sq8': 'SQ8',  # 8位标量量化，1字节/维
+    'ivf_sq8': 'IVF1024,SQ8',
+    'ivf_pq': 'IVF1024,PQ{pq_m}',  # 乘积量化，1024维时64字节/向量，建议配合重排序使用
+}
+
+# 重排序副本支持的精度
+RERANK_DTYPES = {'float16': np.float16, 'float32': np.float32}
+
+def _ensure_capacity(array: np.ndarray, size: int) -> np.ndarray:
+    """按需扩容ID映射数组（容量翻倍，新位置填充-1）"""
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, 2 * len(array), 1024), -1, dtype=np.int64)
+    grown[:len(array)] = array
+    return grown
+
+def _truncate_embeddings(embeddings: np.ndarray, dim: int) -> np.ndarray:
+    """截取向量的前dim维并重新标准化（用于粗筛索引）"""
+    # 必须复制：单行切片本身是连续的视图，原地标准化会改写原向量
+    truncated = np.array(embeddings[:, :dim], dtype=np.float32, order='C')
+    faiss.normalize_L2(truncated)
+    return truncated
+
+def _ensure_rows(array: np.ndarray, size: int) -> np.ndarray:
+    """按需扩容按标签存储的向量矩阵（容量翻倍，新行填充0）"""
+    if size <= len(array):
+        return array
+    grown = np.zeros((max(size, 2 * len(array), 1024), array.shape[1]), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+class VectorStore(WriteAheadLogMixin):
     """向量存储和检索类，使用FAISS进行高效相似度搜索"""
     
-    def __init__(self, embedding_dim: int = 1024):
+    def __init__(self, embedding_dim: int = 1024, index_factory: str = "Flat",
+                 compaction_threshold: float = 0.2, rerank_dtype: Optional[str] = None,
+                 coarse_dim: Optional[int] = None, candidate_multiplier: Optional[int] = None,
+                 lexical: bool = True):
         """
         初始化向量存储
         
         Args:
             embedding_dim: 嵌入向量的维度 (支持1024, 1536, 2048等)
+            index_factory: FAISS索引工厂字符串，如 "Flat"（精确检索）、
+                "IVF4096,Flat"、"HNSW32"，或STORAGE_PRESETS中的预设名（如 "sq8"、"ivf_pq"），
+                需要训练的索引会在首次批量添加时训练
+            compaction_threshold: 已删除向量占比超过该值时在后台压缩索引
+            rerank_dtype: 额外保存一份 "float16" 或 "float32" 向量副本，用于对压缩索引
+                返回的候选做精确重排序；为None时不保存
+            coarse_dim: 粗筛维度（如256）。设置后索引只保存向量前coarse_dim维（重新标准化），
+                搜索时先在低维索引中召回候选，再用全维副本重排序；未指定rerank_dtype时使用float16副本
+            candidate_multiplier: 重排序时默认从索引取 top_k * candidate_multiplier 个候选，
+                默认粗筛模式为10，其他情况为4
+            lexical: 是否同时维护BM25词法索引（用于lexical_search和混合检索）
         """
+        if coarse_dim is not None:
+            if not 0 < coarse_dim < embedding_dim:
+                raise ValueError(f"粗筛维度必须小于向量维度 {embedding_dim}: {coarse_dim}")
+            rerank_dtype = rerank_dtype or 'float16'
+        if rerank_dtype is not None and rerank_dtype not in RERANK_DTYPES:
+            raise ValueError(f"不支持的重排序精度: {rerank_dtype}")
         self.embedding_dim = embedding_dim
+        self.index_factory = index_factory
+        self.compaction_threshold = compaction_threshold
+        self.rerank_dtype = rerank_dtype
+        self.coarse_dim = coarse_dim
+        self.candidate_multiplier = candidate_multiplier or (10 if coarse_dim else 4)
         self.index = None
-        self.texts = []  # 存储原始文本
-        self.metadata = []  # 存储元数据
+        self.documents = DocumentStore()  # 文档ID -> (原始文本, 元数据)
+        self.metadata_index = MetadataIndex()  # 元数据 (字段, 值) -> 标签列表
+        self.lexical_index = BM25Index() if lexical else None  # 词 -> 标签和词频
+        
+        # 文档ID对外保持稳定；索引内部使用单调递增的标签，
+        # 更新文档时旧标签被标记删除（墓碑），新向量使用新标签
+        self._label_to_doc = np.empty(0, dtype=np.int64)
+        self._doc_to_label = np.empty(0, dtype=np.int64)
+        self._next_label = 0
+        self._next_id = 0
+        self._tombstones = set()  # 已删除但尚未从索引中清除的标签
+        self._alive_selector = None
+        self._rerank_vectors = None  # 按标签存储的重排序向量副本
+        
+        self._lock = threading.RLock()
+        self._compaction_thread = None
+        self._mapped_index_path = None  # 内存映射加载时的索引文件路径
+        self._init_wal()
         self._initialize_index()
     
+    @property
+    def index_dim(self) -> int:
+        """FAISS索引中向量的维度（粗筛模式下为coarse_dim）"""
+        return self.coarse_dim or self.embedding_dim
+    
+    def _factory_string(self) -> str:
+        """将预设名解析为FAISS索引工厂字符串"""
+        factory = STORAGE_PRESETS.get(self.index_factory, self.index_factory)
+        return factory.format(pq_m=max(1, self.index_dim // 16))
+    
+    def _new_index(self) -> faiss.Index:
+        """
+        按工厂字符串创建空索引
+        
+        IVF索引原生支持自定义标签和按标签删除，直接使用；
+        其他索引外层包装IndexIDMap2以支持自定义标签。
+        """
+        # 使用内积相似度（向量标准化后即为余弦相似度）
+        index = faiss.index_factory(self.index_dim, self._factory_string(),
+                                    faiss.METRIC_INNER_PRODUCT)
+        if faiss.try_extract_index_ivf(index) is not None:
+            return index
+        return faiss.IndexIDMap2(index)
+    
+    @staticmethod
+    def _base_index(index: faiss.Index) -> faiss.Index:
+        """去掉IndexIDMap2包装，返回实际的检索索引"""
+        if isinstance(index, faiss.IndexIDMap2):
+            return faiss.downcast_index(index.index)
+        return faiss.downcast_index(index)
+    
     def _initialize_index(self):
-        """初始化FAISS索引"""
-        # 使用内积相似度（余弦相似度的近似）
-        self.index = faiss.IndexFlatIP(self.embedding_dim)
-        logger.info(f"初始化FAISS索引，维度: {self.embedding_dim}")
+        """初始化FAISS索引和重排序副本"""
+        self.index = self._new_index()
+        if self.rerank_dtype is not None:
+            self._rerank_vectors = np.zeros((0, self.embedding_dim), dtype=RERANK_DTYPES[self.rerank_dtype])
+        logger.info(f"初始化FAISS索引，类型: {self.index_factory}，维度: {self.index_dim}")
+    
+    @property
+    def min_training_vectors(self) -> int:
+        """训练索引所需的最少向量数：IVF为聚类数，PQ为码本大小（2^nbits），已训练或不需要训练时为0"""
+        if self.index.is_trained:
+            return 0
+        base = self._base_index(self.index)
+        minimum = 0
+        ivf = faiss.try_extract_index_ivf(base)
+        if ivf is not None:
+            minimum = ivf.nlist
+        pq = getattr(base, 'pq', None)
+        if pq is not None:
+            minimum = max(minimum, 1 << pq.nbits)
+        return minimum
+    
+    def _train_index(self, embeddings: np.ndarray):
+        """使用首批向量训练索引（IVF、PQ等索引需要训练）"""
+        minimum = self.min_training_vectors
+        if len(embeddings) < minimum:
+            raise ValueError(f"索引 {self.index_factory} 至少需要 {minimum} 个向量训练，首批只有 {len(embeddings)} 个；"
+                             f"请一次批量导入足够的文档（如使用build_index.py），或改用Flat、HNSW32、sq8等索引")
+        logger.info(f"正在使用 {len(embeddings)} 个向量训练索引: {self.index_factory}")
+        try:
+            self.index.train(embeddings)
+        except RuntimeError as e:
+            raise ValueError(f"索引训练失败，首批文档数量可能不足以训练 {self.index_factory}: {e}")
+    
+    def _search_params(self, index: faiss.Index, nprobe: Optional[int] = None,
+                       ef_search: Optional[int] = None,
+                       selector: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+        """
+        构造单次查询的FAISS搜索参数
+        
+        Args:
+            index: 要搜索的索引
+            nprobe: IVF索引探测的聚类数，越大召回越高、速度越慢
+            ef_search: HNSW索引的搜索队列长度，越大召回越高、速度越慢
+            selector: 限定可返回标签的选择器（用于过滤已删除的文档）
+        
+        Returns:
+            搜索参数对象，不需要时返回None
+        """
+        base = self._base_index(index)
+        ivf = faiss.try_extract_index_ivf(base)
+        if ivf is not None:
+            params = faiss.SearchParametersIVF(nprobe=int(nprobe) if nprobe is not None else ivf.nprobe)
+        elif isinstance(base, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(
+                efSearch=int(ef_search) if ef_search is not None else base.hnsw.efSearch)
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+    
+        if selector is not None:
+            params.sel = selector
+        return params
+    
+    def _get_alive_selector(self) -> Optional[Tuple]:
+        """返回排除墓碑标签的选择器（缓存，文档删除后失效）"""
+        selector = self._alive_selector
+        if selector is None and self._tombstones:
+            dead = faiss.IDSelectorBatch(np.fromiter(self._tombstones, dtype=np.int64))
+            # 保留内层选择器的引用，避免被提前回收
+            selector = (faiss.IDSelectorNot(dead), dead)
+            self._alive_selector = selector
+        return selector
+    
+    def _get_filter_selector(self, filters: Dict) -> Optional[Tuple]:
+        """
+        将元数据过滤条件转换为FAISS位图选择器，已删除的标签同时被排除
+        
+        Returns:
+            (选择器, 位图) 元组，没有满足条件的文档时返回None
+        """
+        size = self._next_label
+        mask = self.metadata_index.match(filters, size)
+        mask &= self._label_to_doc[:size] >= 0
+        if not mask.any():
+            return None
+        bitmap = np.packbits(mask, bitorder='little')
+        # 保留位图的引用，避免在搜索结束前被回收
+        return faiss.IDSelectorBitmap(size, faiss.swig_ptr(bitmap)), bitmap
     
     def add_documents(self, texts: List[str], embeddings: np.ndarray, 
-                     metadata: Optional[List[Dict]] = None):
+                     metadata: Optional[List[Dict]] = None) -> List[int]:
         """
         添加文档到向量存储
         
@@ -40,6 +243,9 @@ class VectorStore:
             texts: 文本列表
             embeddings: 对应的嵌入向量
             metadata: 可选的元数据列表
+        
+        Returns:
+            新文档的ID列表，可用于后续的删除和更新
         """
         if len(texts) != len(embeddings):
             raise ValueError("文本数量和嵌入向量数量不匹配")
@@ -47,24 +253,292 @@ class VectorStore:
         if embeddings.shape[1] != self.embedding_dim:
             raise ValueError(f"嵌入向量维度不匹配，期望 {self.embedding_dim}，实际 {embeddings.shape[1]}")
         
+        for meta in metadata or []:
+            validate_metadata(meta)
+        
+        with self._lock:
+            ids = np.arange(self._next_id, self._next_id + len(texts), dtype=np.int64)
+            self._doc_to_label = _ensure_capacity(self._doc_to_label, self._next_id + len(texts))
+            self._add_vectors(ids, embeddings)
+            self._next_id += len(texts)
+            
+            # 存储文本和元数据
+            for i, doc_id in enumerate(ids.tolist()):
+                meta = metadata[i] if metadata else {}
+                self.documents.put(doc_id, texts[i], meta)
+                self._index_document(int(self._doc_to_label[doc_id]), texts[i], meta)
+            
+            self._log_wal({'op': 'add', 'ids': ids.tolist(), 'texts': list(texts),
+                           'metadata': [metadata[i] if metadata else {} for i in range(len(texts))]},
+                          embeddings)
+        
+        logger.info(f"添加了 {len(texts)} 个文档到向量存储")
+        self._maybe_merge_wal()
+        return ids.tolist()
+    
+    def _add_vectors(self, ids: np.ndarray, embeddings: np.ndarray):
+        """为文档ID分配新标签并将向量加入索引（调用方需持有锁）"""
+        self._ensure_writable()
+        
         # 转换为float32并标准化向量（FAISS需要float32类型）
-        embeddings = embeddings.astype(np.float32)
+        embeddings = np.array(embeddings, dtype=np.float32)
         faiss.normalize_L2(embeddings)
         
-        # 添加到索引
-        self.index.add(embeddings)
+        # 粗筛模式下索引只保存截断后的低维向量，全维向量保存在重排序副本中
+        index_vectors = embeddings
+        if self.coarse_dim is not None:
+            index_vectors = _truncate_embeddings(embeddings, self.coarse_dim)
         
-        # 存储文本和元数据
-        self.texts.extend(texts)
-        if metadata:
-            self.metadata.extend(metadata)
-        else:
-            self.metadata.extend([{}] * len(texts))
+        # 需要训练的索引在首次批量添加时训练
+        if not self.index.is_trained:
+            self._train_index(index_vectors)
         
-        logger.info(f"添加了 {len(texts)} 个文档到向量存储")
+        labels = np.arange(self._next_label, self._next_label + len(ids), dtype=np.int64)
+        if self._rerank_vectors is not None:
+            self._rerank_vectors = _ensure_rows(self._rerank_vectors, self._next_label + len(ids))
+            self._rerank_vectors[labels] = embeddings
+        
+        # 先加入索引，成功后再更新标签映射，失败时文档仍指向原标签
+        self.index.add_with_ids(index_vectors, labels)
+        self._label_to_doc = _ensure_capacity(self._label_to_doc, self._next_label + len(ids))
+        self._label_to_doc[labels] = ids
+        self._doc_to_label[ids] = labels
+        self._next_label += len(ids)
+    
+    def _index_document(self, label: int, text: str, metadata: Dict):
+        """将文档加入元数据索引和词法索引（调用方需持有锁）"""
+        self.metadata_index.add(label, metadata)
+        if self.lexical_index is not None:
+            self.lexical_index.add(label, text)
+    
+    def _resolve_labels(self, ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """将文档ID映射为当前标签，忽略不存在或已删除的ID"""
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        ids = ids[(ids >= 0) & (ids < self._next_id)]
+        labels = self._doc_to_label[ids]
+        valid = labels >= 0
+        return ids[valid], labels[valid]
+    
+    def _tombstone(self, labels: np.ndarray):
+        """将标签标记为删除，向量留在索引中直到压缩（调用方需持有锁）"""
+        self._label_to_doc[labels] = -1
+        self._tombstones.update(labels.tolist())
+        self._alive_selector = None
+        if self.lexical_index is not None:
+            for label in labels.tolist():
+                self.lexical_index.remove(label)
+    
+    def delete_documents(self, ids: List[int]) -> int:
+        """
+        删除文档，向量先以墓碑方式标记，删除比例超过阈值后在后台压缩
+        
+        Args:
+            ids: 要删除的文档ID列表，不存在的ID会被忽略
+        
+        Returns:
+            实际删除的文档数量
+        """
+        with self._lock:
+            ids, labels = self._resolve_labels(ids)
+            self._tombstone(labels)
+            self._doc_to_label[ids] = -1
+            for doc_id in ids.tolist():
+                self.documents.delete(doc_id)
+            if len(ids):
+                self._log_wal({'op': 'delete', 'ids': ids.tolist()})
+        
+        logger.info(f"删除了 {len(ids)} 个文档")
+        self._maybe_compact()
+        self._maybe_merge_wal()
+        return len(ids)
+    
+    def _rollback_add(self, start: int):
+        """
+        撤销从start开始分配的文档并回退ID计数器，不写WAL（调用方需持有锁）
+        
+        供分片存储在部分分片写入失败时撤销已成功的分片，回退后下一个ID重新从start分配。
+        """
+        ids = np.arange(start, self._next_id, dtype=np.int64)
+        labels = self._doc_to_label[ids]
+        self._tombstone(labels[labels >= 0])
+        self._doc_to_label[ids] = -1
+        for doc_id in ids.tolist():
+            self.documents.delete(doc_id)
+        self._next_id = start
+    
+    def update_documents(self, ids: List[int], texts: List[str], embeddings: np.ndarray,
+                         metadata: Optional[List[Dict]] = None) -> int:
+        """
+        更新文档的文本和向量，文档ID保持不变
+        
+        Args:
+            ids: 要更新的文档ID列表
+            texts: 新文本列表
+            embeddings: 新文本对应的嵌入向量
+            metadata: 可选的新元数据列表，为None时保留原元数据
+        
+        Returns:
+            实际更新的文档数量
+        """
+        if not (len(ids) == len(texts) == len(embeddings)):
+            raise ValueError("文档ID、文本和嵌入向量数量不匹配")
+        
+        for meta in metadata or []:
+            validate_metadata(meta)
+        
+        with self._lock:
+            ids = np.asarray(ids, dtype=np.int64)
+            if len(np.unique(ids)) != len(ids):
+                raise ValueError("文档ID不能重复")
+            valid = (ids >= 0) & (ids < self._next_id)
+            valid[valid] = self._doc_to_label[ids[valid]] >= 0
+            if not valid.all():
+                raise KeyError(f"文档不存在: {ids[~valid].tolist()}")
+            
+            # 新向量加入成功后才标记旧向量，失败时旧版本保持可检索
+            old_labels = self._doc_to_label[ids].copy()
+            self._add_vectors(ids, embeddings)
+            self._tombstone(old_labels)
+            for i, doc_id in enumerate(ids.tolist()):
+                meta = metadata[i] if metadata is not None else self.documents.get(doc_id)[1]
+                self.documents.put(doc_id, texts[i], meta)
+                self._index_document(int(self._doc_to_label[doc_id]), texts[i], meta)
+            
+            self._log_wal({'op': 'update', 'ids': ids.tolist(), 'texts': list(texts),
+                           'metadata': list(metadata) if metadata is not None else None}, embeddings)
+        
+        logger.info(f"更新了 {len(ids)} 个文档")
+        self._maybe_compact()
+        self._maybe_merge_wal()
+        return len(ids)
+    
+    def update_metadata(self, ids: List[int], metadata: List[Dict]) -> int:
+        """
+        仅更新文档元数据，无需重新生成向量
+        
+        Args:
+            ids: 文档ID列表
+            metadata: 新元数据列表
+        
+        Returns:
+            实际更新的文档数量
+        """
+        for meta in metadata:
+            validate_metadata(meta)
+        
+        updated = 0
+        with self._lock:
+            for doc_id, meta in zip(ids, metadata):
+                document = self.documents.get(doc_id)
+                if document is not None:
+                    label = int(self._doc_to_label[doc_id])
+                    self.metadata_index.remove(label, document[1])
+                    self.metadata_index.add(label, meta)
+                    self.documents.put(doc_id, document[0], meta)
+                    updated += 1
+            if updated:
+                self._log_wal({'op': 'update_metadata', 'ids': [int(doc_id) for doc_id in ids],
+                               'metadata': list(metadata)})
+        self._maybe_merge_wal()
+        return updated
+    
+    def get_document(self, doc_id: int) -> Optional[Dict]:
+        """按ID获取文档，不存在时返回None"""
+        document = self.documents.get(doc_id)
+        if document is None:
+            return None
+        return {'id': doc_id, 'text': document[0], 'metadata': document[1]}
+    
+    def _maybe_compact(self):
+        """已删除向量占比超过阈值时启动后台压缩"""
+        ntotal = self.index.ntotal
+        if not ntotal or len(self._tombstones) / ntotal < self.compaction_threshold:
+            return
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(target=self.compact, daemon=True,
+                                                       name="vector-store-compaction")
+            self._compaction_thread.start()
+    
+    def compact(self, max_attempts: int = 3) -> int:
+        """
+        从索引中清除墓碑向量并回收内存
+        
+        在锁内复制索引，锁外完成清除或重建，再在锁内替换，压缩期间的搜索和写入
+        继续使用旧索引。替换前如有新向量写入旧索引则放弃本次结果重试，最后一次
+        尝试持有锁完成；压缩期间新增的删除保留为墓碑。
+        
+        Args:
+            max_attempts: 最大尝试次数
+        
+        Returns:
+            清除的向量数量
+        """
+        for attempt in range(max_attempts):
+            with self._lock:
+                if not self._tombstones:
+                    return 0
+                self._ensure_writable()
+                dead = np.fromiter(self._tombstones, dtype=np.int64)
+                source = self.index
+                next_label = self._next_label
+                index = faiss.clone_index(source)
+                if attempt == max_attempts - 1:
+                    # 最后一次尝试持有锁完成，保证压缩能够结束
+                    index, removed = self._purge(index, dead)
+                    self._swap_index(index, dead)
+                    break
+            
+            index, removed = self._purge(index, dead)
+            
+            with self._lock:
+                if self.index is source and self._next_label == next_label:
+                    self._swap_index(index, dead)
+                    break
+            logger.info("压缩期间有新向量写入，重新压缩")
+        
+        logger.info(f"索引压缩完成，清除了 {removed} 个已删除向量")
+        return removed
+    
+    def _purge(self, index: faiss.Index, dead: np.ndarray) -> Tuple[faiss.Index, int]:
+        """在索引副本上清除指定标签，返回清除后的索引和清除的数量"""
+        try:
+            removed = index.remove_ids(faiss.IDSelectorBatch(dead))
+        except RuntimeError:
+            # HNSW等索引不支持删除，使用存活向量重建（删除失败时副本未被修改）
+            index = self._rebuild_index(index, dead)
+            removed = len(dead)
+        return index, removed
+    
+    def _swap_index(self, index: faiss.Index, dead: np.ndarray):
+        """替换为压缩后的索引，压缩期间新增的墓碑保留（调用方需持有锁）"""
+        self.index = index
+        self._tombstones.difference_update(dead.tolist())
+        self._alive_selector = None
+        alive = self._label_to_doc[:self._next_label] >= 0
+        self.metadata_index.prune(alive)
+        if self.lexical_index is not None:
+            self.lexical_index.prune(alive)
+    
+    def _rebuild_index(self, source: faiss.Index, dead: np.ndarray) -> faiss.Index:
+        """用source中存活的向量重建索引"""
+        # 仅IndexIDMap2包装的索引会走到这里（IVF索引原生支持删除）
+        labels = faiss.vector_to_array(source.id_map)
+        vectors = source.index.reconstruct_n(0, source.ntotal)
+        keep = ~np.isin(labels, dead)
+        
+        index = self._new_index()
+        if not index.is_trained and keep.any():
+            index.train(vectors[keep])
+        index.add_with_ids(vectors[keep], labels[keep])
+        return index
     
     def search(self, query_embedding: np.ndarray, top_k: int = 5, 
-               similarity_threshold: float = 0.6) -> List[Dict]:
+               similarity_threshold: float = 0.6, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, rerank: Optional[bool] = None,
+               candidate_multiplier: Optional[int] = None,
+               filters: Optional[Dict] = None) -> List[Dict]:
         """
         搜索相似的文档
         
@@ -72,92 +546,449 @@ class VectorStore:
             query_embedding: 查询向量的嵌入
             top_k: 返回最相似的前k个结果
             similarity_threshold: 相似度阈值，只返回高于此阈值的结果
-            
+            nprobe: IVF索引的探测聚类数（仅对IVF索引生效）
+            ef_search: HNSW索引的efSearch参数（仅对HNSW索引生效）
+            rerank: 是否用重排序副本精确重算候选的相似度，为None时有副本即重排序
+            candidate_multiplier: 重排序时从索引取 top_k * candidate_multiplier 个候选，
+                为None时使用构造时的设置
+            filters: 元数据过滤条件，如 {"category": "NLP"}，支持 $and / $or 组合，
+                格式见MetadataIndex；过滤在FAISS扫描过程中完成
+        
         Returns:
             相似文档列表，包含文本、相似度和元数据
         """
-        if self.index.ntotal == 0:
-            return []
+        return self.search_batch(query_embedding.reshape(1, -1), top_k, similarity_threshold,
+                                 nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+                                 candidate_multiplier=candidate_multiplier, filters=filters)[0]
+    
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 5,
+                     similarity_threshold: float = 0.6, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, rerank: Optional[bool] = None,
+                     candidate_multiplier: Optional[int] = None,
+                     filters: Optional[Dict] = None) -> List[List[Dict]]:
+        """
+        批量搜索相似的文档，所有查询通过一次矩阵检索完成
+        
+        Args:
+            query_embeddings: 查询向量矩阵 (n_queries, embedding_dim)
+            top_k: 每个查询返回最相似的前k个结果
+            similarity_threshold: 相似度阈值，只返回高于此阈值的结果
+            nprobe: IVF索引的探测聚类数（仅对IVF索引生效）
+            ef_search: HNSW索引的efSearch参数（仅对HNSW索引生效）
+            rerank: 是否用重排序副本精确重算候选的相似度，为None时有副本即重排序
+            candidate_multiplier: 重排序时从索引取 top_k * candidate_multiplier 个候选，
+                为None时使用构造时的设置
+            filters: 元数据过滤条件，如 {"category": "NLP"}，支持 $and / $or 组合，
+                格式见MetadataIndex；过滤在FAISS扫描过程中完成
         
-        # 标准化查询向量
-        query_embedding = query_embedding.astype(np.float32)
-        faiss.normalize_L2(query_embedding.reshape(1, -1))
+        Returns:
+            与查询一一对应的结果列表
+        """
+        query_embeddings = np.atleast_2d(query_embeddings)
+        # 取当前索引的引用，压缩替换索引时不影响本次搜索
+        index = self.index
+        if index.ntotal == 0:
+            return [[] for _ in range(len(query_embeddings))]
         
-        # 搜索最相似的向量
-        distances, indices = self.index.search(query_embedding.reshape(1, -1), top_k)
+        # 标准化查询向量（复制一份，避免修改调用方的数组）
+        query_embeddings = np.array(query_embeddings, dtype=np.float32)
+        faiss.normalize_L2(query_embeddings)
         
-        results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < 0:  # FAISS返回-1表示没有足够的结果
-                continue
-            
-            # 将内积距离转换为余弦相似度
-            similarity = float(distance)
+        # 一次性搜索所有查询，已删除的标签和不满足过滤条件的标签在扫描时被排除
+        if filters:
+            selector = self._get_filter_selector(filters)
+            if selector is None:
+                return [[] for _ in range(len(query_embeddings))]
+        else:
+            selector = self._get_alive_selector()
+        params = self._search_params(index, nprobe, ef_search,
+                                     selector[0] if selector else None)
+        rerank_vectors = self._rerank_vectors
+        if rerank is None:
+            rerank = rerank_vectors is not None
+        elif rerank and rerank_vectors is None:
+            raise ValueError("未配置重排序副本（rerank_dtype），无法重排序")
+        
+        # 粗筛模式下第一阶段使用截断的低维查询向量
+        index_queries = query_embeddings
+        if self.coarse_dim is not None:
+            index_queries = _truncate_embeddings(query_embeddings, self.coarse_dim)
+        
+        if rerank:
+            # 第一阶段由索引召回候选，第二阶段用全维副本精确计算相似度
+            candidates = top_k * max(1, int(candidate_multiplier or self.candidate_multiplier))
+            _, labels = index.search(index_queries, candidates, params=params)
+            distances, labels = self._rerank(rerank_vectors, query_embeddings, labels, top_k)
+        else:
+            distances, labels = index.search(index_queries, top_k, params=params)
+        
+        # 向量化过滤：FAISS返回-1表示没有足够的结果
+        label_to_doc = self._label_to_doc
+        doc_ids = np.where(labels >= 0, label_to_doc[np.clip(labels, 0, None)], -1)
+        mask = (doc_ids >= 0) & (distances >= similarity_threshold)
             
-            if similarity >= similarity_threshold:
-                result = {
-                    'text': self.texts[idx],
-                    'similarity': similarity,
-                    'metadata': self.metadata[idx],
-                    'rank': i + 1
-                }
-                results.append(result)
+        batch_results = []
+        for row in range(len(query_embeddings)):
+            results = []
+            for i in np.flatnonzero(mask[row]):
+                doc_id = int(doc_ids[row, i])
+                # 只解码命中的文档
+                document = self.documents.get(doc_id)
+                if document is None:  # 搜索期间被删除
+                    continue
+                results.append({
+                    'id': doc_id,
+                    'text': document[0],
+                    'similarity': float(distances[row, i]),
+                    'metadata': document[1],
+                    'rank': int(i) + 1
+                })
+            batch_results.append(results)
+        
+        return batch_results
+    
+    @staticmethod
+    def _rerank(vectors: np.ndarray, query_embeddings: np.ndarray, labels: np.ndarray,
+                top_k: int, chunk_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        用重排序副本精确计算候选的相似度并重新排序
+        
+        Args:
+            vectors: 按标签存储的向量副本
+            query_embeddings: 标准化后的查询向量矩阵
+            labels: 索引返回的候选标签矩阵，-1表示空位
+            top_k: 每个查询保留的结果数
+            chunk_size: 每批处理的查询数，限制候选向量占用的临时内存
         
+        Returns:
+            (相似度矩阵, 标签矩阵)，形状均为 (n_queries, top_k)
+        """
+        top_k = min(top_k, labels.shape[1])
+        all_scores = []
+        all_labels = []
+        for start in range(0, len(labels), chunk_size):
+            chunk_labels = labels[start:start + chunk_size]
+            candidates = vectors[np.clip(chunk_labels, 0, None)].astype(np.float32)
+            scores = np.einsum('qkd,qd->qk', candidates, query_embeddings[start:start + chunk_size])
+            scores[chunk_labels < 0] = -np.inf
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+            all_scores.append(np.take_along_axis(scores, order, axis=1))
+            all_labels.append(np.take_along_axis(chunk_labels, order, axis=1))
+        return np.vstack(all_scores), np.vstack(all_labels)
+    
+    def _allowed_labels(self, filters: Optional[Dict] = None) -> np.ndarray:
+        """按标签的布尔掩码：未删除且满足过滤条件的标签为True"""
+        size = self._next_label
+        allowed = self._label_to_doc[:size] >= 0
+        if filters:
+            allowed &= self.metadata_index.match(filters, size)
+        return allowed
+    
+    def lexical_search(self, query: str, top_k: int = 5,
+                       filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        基于BM25的词法检索，适合产品编号、标识符等需要精确匹配的查询
+        
+        Args:
+            query: 查询文本
+            top_k: 返回的结果数
+            filters: 元数据过滤条件，格式同search
+        
+        Returns:
+            文档列表，similarity字段为BM25分数
+        """
+        if self.lexical_index is None:
+            raise ValueError("未启用词法索引（lexical=False）")
+        
+        labels, scores = self.lexical_index.search(query, top_k, self._allowed_labels(filters))
+        label_to_doc = self._label_to_doc
+        results = []
+        for label, score in zip(labels.tolist(), scores.tolist()):
+            doc_id = int(label_to_doc[label])
+            document = self.documents.get(doc_id) if doc_id >= 0 else None
+            if document is None:  # 搜索期间被删除
+                continue
+            results.append({
+                'id': doc_id,
+                'text': document[0],
+                'similarity': score,
+                'metadata': document[1],
+                'rank': len(results) + 1
+            })
         return results
     
+    def _empty_copy(self) -> 'VectorStore':
+        """创建配置相同的空向量存储（合并预写日志时使用）"""
+        return VectorStore(self.embedding_dim, self.index_factory, self.compaction_threshold,
+                           self.rerank_dtype, self.coarse_dim, self.candidate_multiplier,
+                           lexical=self.lexical_index is not None)
+    
+    def _release_base(self, filepath: str):
+        """当前索引仍映射着即将删除的快照时先完整读入，之后的修改不再依赖旧文件（调用方需持有锁）"""
+        if self._mapped_index_path == f"{filepath}.index":
+            self._ensure_writable()
+    
+    def _mmap_flags(self) -> int:
+        """内存映射加载索引的标志：IVF映射倒排表，其他索引映射向量编码"""
+        if faiss.try_extract_index_ivf(self._new_index()) is not None:
+            return faiss.IO_FLAG_MMAP
+        return faiss.IO_FLAG_MMAP_IFC
+    
+    def _ensure_writable(self):
+        """内存映射加载的索引只读，修改前先完整读入内存（调用方需持有锁）"""
+        if self._mapped_index_path is not None:
+            logger.info("索引为内存映射只读模式，修改前完整加载索引")
+            self.index = faiss.read_index(self._mapped_index_path)
+            self._mapped_index_path = None
+    
     def save(self, filepath: str):
-        """保存向量存储到文件"""
+        """
+        保存向量存储到文件
+        
+        生成的文件：{filepath}.index（FAISS索引）、{filepath}.docstore（文档偏移量与数据块）、
+        {filepath}.labels.npy 与
+        {filepath}.doc_labels.npy（ID映射）、{filepath}.rerank.npy（重排序副本，可选）、
+        {filepath}.postings.npy 与 {filepath}.postings.json（元数据倒排索引）、
+        {filepath}.bm25*.npy 与 {filepath}.bm25.json（BM25词法索引，可选）、
+        {filepath}.meta.json（配置信息）。
+        各文件先写入临时文件再原子替换，正在映射旧文件的读取者不受影响。
+        """
         # 创建目录
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
         
-        # 保存FAISS索引
-        faiss.write_index(self.index, f"{filepath}.index")
+        with self._lock:
+            # 保存FAISS索引
+            faiss.write_index(self.index, f"{filepath}.index.tmp")
+            os.replace(f"{filepath}.index.tmp", f"{filepath}.index")
+            
+            # 保存文本和元数据（偏移量+数据块格式）
+            self.documents.save(filepath)
+            alive = self._label_to_doc[:self._next_label] >= 0
+            self.metadata_index.save(filepath, alive)
+            if self.lexical_index is not None:
+                self.lexical_index.save(filepath, alive)
+            
+            # 保存ID映射
+            arrays = [('labels', self._label_to_doc[:self._next_label]),
+                      ('doc_labels', self._doc_to_label[:self._next_id])]
+            # 保存重排序副本
+            if self._rerank_vectors is not None:
+                arrays.append(('rerank', self._rerank_vectors[:self._next_label]))
+            for name, array in arrays:
+                np.save(f"{filepath}.{name}.tmp.npy", array)
+                os.replace(f"{filepath}.{name}.tmp.npy", f"{filepath}.{name}.npy")
+            
+            meta = {
+                'format_version': 2,
+                'embedding_dim': self.embedding_dim,
+                'index_factory': self.index_factory,
+                'rerank_dtype': self.rerank_dtype,
+                'coarse_dim': self.coarse_dim,
+                'lexical': self.lexical_index is not None,
+                'tombstones': sorted(self._tombstones)
+            }
+            with open(f"{filepath}.meta.json.tmp", 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(f"{filepath}.meta.json.tmp", f"{filepath}.meta.json")
         
-        # 保存文本和元数据
-        data = {
-            'texts': self.texts,
-            'metadata': self.metadata,
-            'embedding_dim': self.embedding_dim
-        }
+        logger.info(f"向量存储已保存到: {filepath}")
+    
+    def load(self, filepath: str, mmap: bool = True):
+        """
+        从文件加载向量存储
         
-        with open(f"{filepath}.data", 'wb') as f:
-            pickle.dump(data, f)
+        Args:
+            filepath: 保存时使用的文件路径前缀
+            mmap: 是否以内存映射方式加载索引。映射加载几乎不耗时，常驻内存随实际访问的
+                数据增长；首次修改时会自动完整加载索引。文档数据总是按需从映射文件解码。
+        """
+        if not os.path.exists(f"{filepath}.meta.json"):
+            self._load_pickle(filepath)
+            return
         
-        logger.info(f"向量存储已保存到: {filepath}")
+        with open(f"{filepath}.meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        
+        with self._lock:
+            self.embedding_dim = meta['embedding_dim']
+            self.index_factory = meta['index_factory']
+            
+            # 加载FAISS索引
+            if mmap:
+                self.index = faiss.read_index(f"{filepath}.index", self._mmap_flags())
+                self._mapped_index_path = f"{filepath}.index"
+            else:
+                self.index = faiss.read_index(f"{filepath}.index")
+                self._mapped_index_path = None
+            
+            # ID映射使用写时复制映射，修改只发生在内存中
+            self._label_to_doc = np.load(f"{filepath}.labels.npy", mmap_mode='c')
+            self._doc_to_label = np.load(f"{filepath}.doc_labels.npy", mmap_mode='c')
+            self._next_label = len(self._label_to_doc)
+            self._next_id = len(self._doc_to_label)
+            self._tombstones = set(meta['tombstones'])
+            self._alive_selector = None
+            
+            # 重排序副本同样以写时复制方式映射
+            self.rerank_dtype = meta.get('rerank_dtype')
+            self.coarse_dim = meta.get('coarse_dim')
+            self._rerank_vectors = None
+            if self.rerank_dtype is not None:
+                self._rerank_vectors = np.load(f"{filepath}.rerank.npy", mmap_mode='c')
+            
+            self.documents = DocumentStore()
+            self.documents.load(filepath)
+            
+            if os.path.exists(f"{filepath}.postings.json"):
+                self.metadata_index = MetadataIndex.load(filepath)
+            else:
+                self._rebuild_metadata_index()
+            
+            # 旧版本保存的文件没有词法索引，默认由文档重建
+            if not meta.get('lexical', True):
+                self.lexical_index = None
+            elif os.path.exists(f"{filepath}.bm25.json"):
+                self.lexical_index = BM25Index.load(filepath)
+            else:
+                self._rebuild_lexical_index()
+        
+        logger.info(f"向量存储已加载，包含 {len(self.documents)} 个文档")
     
-    def load(self, filepath: str):
-        """从文件加载向量存储"""
+    def _load_pickle(self, filepath: str):
+        """加载旧版本保存的文件（{filepath}.data 为pickle格式）"""
         # 加载FAISS索引
-        self.index = faiss.read_index(f"{filepath}.index")
+        index = faiss.read_index(f"{filepath}.index")
         
         # 加载文本和元数据
         with open(f"{filepath}.data", 'rb') as f:
             data = pickle.load(f)
         
-        self.texts = data['texts']
-        self.metadata = data['metadata']
-        self.embedding_dim = data['embedding_dim']
+        with self._lock:
+            self.embedding_dim = data['embedding_dim']
+            self.index_factory = data.get('index_factory', 'Flat')
+            self._mapped_index_path = None
+            self.rerank_dtype = None
+            self.coarse_dim = None
+            self._rerank_vectors = None
+            
+            if isinstance(data['texts'], list):
+                self._load_legacy(index, data)
+            else:
+                self.index = index
+                self.documents = DocumentStore.from_dicts(data['texts'], data['metadata'])
+                self._label_to_doc = np.array(data['label_to_doc'], dtype=np.int64)
+                self._doc_to_label = np.array(data['doc_to_label'], dtype=np.int64)
+                self._next_label = len(self._label_to_doc)
+                self._next_id = len(self._doc_to_label)
+                self._tombstones = set(data['tombstones'])
+            self._alive_selector = None
+            self._rebuild_metadata_index()
+            self._rebuild_lexical_index()
+        
+        logger.info(f"向量存储已加载，包含 {len(self.documents)} 个文档")
+    
+    def _load_legacy(self, index: faiss.Index, data: Dict):
+        """加载旧格式（按位置存储、无ID映射）的文件，文档ID即原位置"""
+        count = index.ntotal
+        ids = np.arange(count, dtype=np.int64)
+        vectors = index.reconstruct_n(0, count) if count else np.empty((0, self.embedding_dim), dtype=np.float32)
+        
+        self.index = self._new_index()
+        self._label_to_doc = np.empty(0, dtype=np.int64)
+        self._doc_to_label = _ensure_capacity(np.empty(0, dtype=np.int64), count)
+        self._next_label = 0
+        self._next_id = count
+        self._tombstones = set()
+        if count:
+            self._add_vectors(ids, vectors)
+        self.documents = DocumentStore.from_dicts(dict(enumerate(data['texts'])),
+                                                  dict(enumerate(data['metadata'])))
+        logger.info("已将旧格式的向量存储转换为带文档ID的格式")
+    
+    def _rebuild_metadata_index(self):
+        """由文档存储重建元数据倒排索引（加载没有倒排索引文件的旧数据时使用）"""
+        self.metadata_index = MetadataIndex.build(
+            (int(self._doc_to_label[doc_id]), self.documents.get(doc_id)[1])
+            for doc_id in self.documents.ids()
+        )
+    
+    def _rebuild_lexical_index(self):
+        """由文档存储重建BM25词法索引"""
+        self.lexical_index = BM25Index.build(
+            (int(self._doc_to_label[doc_id]), self.documents.get(doc_id)[0])
+            for doc_id in self.documents.ids()
+        )
+    
+    def _memory_usage(self, index: faiss.Index) -> Tuple[int, int]:
+        """
+        估算索引内存占用
+        
+        Returns:
+            (每个向量的字节数, 与向量数无关的固定字节数)，
+            每个向量包含编码、8字节标签和HNSW第0层的邻接表
+        """
+        base = self._base_index(index)
+        fixed = 0
+        ivf = faiss.try_extract_index_ivf(base)
+        if ivf is not None:
+            per_vector = ivf.code_size + 8
+            fixed += ivf.nlist * ivf.d * 4  # 粗量化器的聚类中心
+        elif isinstance(base, faiss.IndexHNSW):
+            per_vector = faiss.downcast_index(base.storage).code_size + 8
+            per_vector += base.hnsw.nb_neighbors(0) * 4
+        else:
+            per_vector = base.code_size + 8
         
-        logger.info(f"向量存储已加载，包含 {len(self.texts)} 个文档")
+        pq = getattr(ivf if ivf is not None else base, 'pq', None)
+        if pq is not None:
+            fixed += pq.M * pq.ksub * pq.dsub * 4  # 乘积量化码本
+        return per_vector, fixed
     
     def get_stats(self) -> Dict:
-        """获取向量存储的统计信息"""
+        """获取向量存储的统计信息，内存占用为估算值"""
+        index = self.index
+        per_vector, fixed = self._memory_usage(index)
+        rerank_vectors = self._rerank_vectors
+        rerank_bytes = 0 if rerank_vectors is None else rerank_vectors.itemsize * self.embedding_dim
         return {
-            'total_documents': len(self.texts),
+            'total_documents': len(self.documents),
             'embedding_dim': self.embedding_dim,
-            'index_size': self.index.ntotal
+            'index_size': index.ntotal,
+            'pending_deletes': len(self._tombstones),
+            'index_factory': self.index_factory,
+            'is_trained': index.is_trained,
+            'rerank_dtype': self.rerank_dtype,
+            'coarse_dim': self.coarse_dim,
+            'metadata_keys': len(self.metadata_index),
+            'lexical_terms': self.lexical_index.get_stats()['terms'] if self.lexical_index is not None else 0,
+            'bytes_per_vector': per_vector + rerank_bytes,
+            'index_memory_bytes': per_vector * index.ntotal + fixed,
+            'rerank_memory_bytes': rerank_bytes * self._next_label,
+            'wal_unmerged_bytes': self._wal_unmerged_bytes if self._wal is not None else 0
         }
 
 class KnowledgeBase:
     """知识库管理类，整合嵌入生成和向量存储"""
     
-    def __init__(self, embedder=None, model_name: str = 'all-MiniLM-L6-v2'):
+    def __init__(self, embedder=None, model_name: str = 'all-MiniLM-L6-v2',
+                 index_factory: str = "Flat", query_cache=None,
+                 rerank_dtype: Optional[str] = None, coarse_dim: Optional[int] = None,
+                 lexical: bool = True, num_shards: int = 1, omp_threads_per_shard: int = 1):
         """
         初始化知识库
         
         Args:
             embedder: 嵌入器实例，如果为None则使用默认的TextEmbedder
             model_name: 嵌入模型名称（仅当embedder为None时使用）
+            index_factory: FAISS索引工厂字符串或存储预设名，默认 "Flat" 为精确检索基线
+            query_cache: 可选的QueryEmbeddingCache实例，缓存查询文本的嵌入向量
+            rerank_dtype: 重排序副本精度（"float16" 或 "float32"），为None时不重排序
+            coarse_dim: 粗筛维度，设置后先用截断的低维向量召回候选，再按全维向量重排序
+            lexical: 是否维护BM25词法索引（用于混合检索）
+            num_shards: 分片数量，大于1时使用ShardedVectorStore并发检索各分片
+            omp_threads_per_shard: 分片模式下每个检索线程使用的OpenMP线程数
         """
         if embedder is None:
             from .embedding_utils import TextEmbedder
@@ -165,23 +996,164 @@ class KnowledgeBase:
         else:
             self.embedder = embedder
             
-        self.vector_store = VectorStore(self.embedder.get_embedding_dim())
+        self.query_cache = query_cache
+        if num_shards > 1:
+            from sharded_store import ShardedVectorStore
+            self.vector_store = ShardedVectorStore(self.embedder.get_embedding_dim(), num_shards,
+                                                   index_factory, rerank_dtype=rerank_dtype,
+                                                   coarse_dim=coarse_dim, lexical=lexical,
+                                                   omp_threads_per_shard=omp_threads_per_shard)
+        else:
+            self.vector_store = VectorStore(self.embedder.get_embedding_dim(), index_factory,
+                                            rerank_dtype=rerank_dtype, coarse_dim=coarse_dim,
+                                            lexical=lexical)
+        # 混合检索时词法检索在线程池中与查询嵌入、向量检索并发执行，首次混合检索时创建
+        self._executor = None
+        self._executor_lock = threading.Lock()
         logger.info("知识库初始化完成")
     
-    def add_documents(self, texts: List[str], metadata: Optional[List[Dict]] = None):
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """混合检索使用的线程池，首次调用时创建"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="kb-lexical")
+        return self._executor
+    
+    def close(self):
+        """关闭混合检索的线程池，之后再次混合检索时会重新创建"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+    
+    def add_documents(self, texts: List[str], metadata: Optional[List[Dict]] = None) -> List[int]:
         """
         添加文档到知识库
         
         Args:
             texts: 文本列表
             metadata: 可选的元数据列表
+        
+        Returns:
+            新文档的ID列表
         """
+        # 先检查元数据，避免生成嵌入后才因元数据无法保存而失败
+        for meta in metadata or []:
+            validate_metadata(meta)
         logger.info(f"正在为 {len(texts)} 个文档生成嵌入...")
         embeddings = self.embedder.embed_batch(texts)
-        self.vector_store.add_documents(texts, embeddings, metadata)
+        return self.vector_store.add_documents(texts, embeddings, metadata)
+    
+    def add_documents_stream(self, documents: Iterable[Union[str, Tuple[str, Dict]]],
+                             metadata: Optional[Dict] = None, batch_size: int = 64,
+                             max_batch_tokens: int = 16000, queue_size: int = 4,
+                             progress_callback: Optional[Callable[[Dict], None]] = None) -> List[int]:
+        """
+        以流水线方式添加文档：边解析边嵌入，每批嵌入完成后立即写入索引
+        
+        Args:
+            documents: 文本或 (文本, 元数据) 的可迭代对象，如file_processor.iter_uploaded_file的结果
+            metadata: 所有文档共用的元数据
+            batch_size: 每批的最大文档数
+            max_batch_tokens: 每批的最大估计token数
+            queue_size: 阶段之间队列的最大批次数
+            progress_callback: 每写入一批后以进度字典调用
+        
+        Returns:
+            新文档的ID列表
+        """
+        pipeline = IngestPipeline(self, batch_size, max_batch_tokens, queue_size, progress_callback)
+        return pipeline.run(documents, metadata)
+    
+    def delete_documents(self, ids: List[int]) -> int:
+        """
+        按ID删除文档
+        
+        Args:
+            ids: 文档ID列表
+        
+        Returns:
+            实际删除的文档数量
+        """
+        return self.vector_store.delete_documents(ids)
+    
+    def update_documents(self, ids: List[int], texts: List[str],
+                         metadata: Optional[List[Dict]] = None) -> int:
+        """
+        按ID更新文档，只有文本发生变化的文档会重新生成嵌入
+        
+        Args:
+            ids: 文档ID列表
+            texts: 新文本列表
+            metadata: 可选的新元数据列表，为None时保留原元数据
+        
+        Returns:
+            实际更新的文档数量
+        """
+        if len(ids) != len(texts):
+            raise ValueError("文档ID数量和文本数量不匹配")
+        for meta in metadata or []:
+            validate_metadata(meta)
+        
+        changed = []
+        unchanged = []
+        for i, doc_id in enumerate(ids):
+            document = self.vector_store.get_document(doc_id)
+            if document is None:
+                raise KeyError(f"文档不存在: {doc_id}")
+            (unchanged if document['text'] == texts[i] else changed).append(i)
+        
+        if changed:
+            logger.info(f"正在为 {len(changed)} 个已修改的文档重新生成嵌入...")
+            embeddings = self.embedder.embed_batch([texts[i] for i in changed])
+            self.vector_store.update_documents(
+                [ids[i] for i in changed],
+                [texts[i] for i in changed],
+                embeddings,
+                [metadata[i] for i in changed] if metadata is not None else None
+            )
+        if unchanged and metadata is not None:
+            self.vector_store.update_metadata([ids[i] for i in unchanged],
+                                              [metadata[i] for i in unchanged])
+        return len(changed) + (len(unchanged) if metadata is not None else 0)
+    
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        生成查询向量，配置了查询缓存时只为未命中的查询调用嵌入器
+        
+        Args:
+            queries: 查询文本列表
+        
+        Returns:
+            查询向量矩阵 (n_queries, embedding_dim)
+        """
+        if self.query_cache is None:
+            if len(queries) == 1:
+                return np.atleast_2d(self.embedder.embed_text(queries[0]))
+            return np.asarray(self.embedder.embed_batch(queries))
+        
+        model = getattr(self.embedder, 'model', None) or getattr(self.embedder, 'model_name', '')
+        dimensions = self.embedder.get_embedding_dim()
+        vectors = [self.query_cache.get(query, model, dimensions) for query in queries]
+        
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            if len(missing) == 1:
+                embedded = [self.embedder.embed_text(queries[missing[0]])]
+            else:
+                embedded = self.embedder.embed_batch([queries[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+                self.query_cache.put(queries[i], model, dimensions, vector)
+        
+        return np.vstack([np.asarray(vector, dtype=np.float32) for vector in vectors])
     
     def search(self, query: str, top_k: int = 5, 
-               similarity_threshold: float = 0.6) -> List[Dict]:
+               similarity_threshold: float = 0.6, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, rerank: Optional[bool] = None,
+               candidate_multiplier: Optional[int] = None,
+               filters: Optional[Dict] = None) -> List[Dict]:
         """
         在知识库中搜索
         
@@ -189,20 +1161,183 @@ class KnowledgeBase:
             query: 查询文本
             top_k: 返回最相似的前k个结果
             similarity_threshold: 相似度阈值
-            
+            nprobe: IVF索引的探测聚类数
+            ef_search: HNSW索引的efSearch参数
+            rerank: 是否进行第二阶段的全维精确重排序，为None时配置了重排序副本即重排序；
+                粗筛模式下为False时直接返回低维相似度
+            candidate_multiplier: 第一阶段召回的候选数为 top_k * candidate_multiplier，
+                为None时使用向量存储的默认设置
+            filters: 元数据过滤条件，如 {"category": "NLP"}
+        
         Returns:
             相似文档列表
         """
-        query_embedding = self.embedder.embed_text(query)
-        return self.vector_store.search(query_embedding, top_k, similarity_threshold)
+        query_embedding = self._embed_queries([query])[0]
+        return self.vector_store.search(query_embedding, top_k, similarity_threshold,
+                                        nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+                                        candidate_multiplier=candidate_multiplier, filters=filters)
+    
+    def search_batch(self, queries: List[str], top_k: int = 5,
+                     similarity_threshold: float = 0.6, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, rerank: Optional[bool] = None,
+                     candidate_multiplier: Optional[int] = None,
+                     filters: Optional[Dict] = None) -> List[List[Dict]]:
+        """
+        批量搜索，所有查询通过一次embed_batch调用生成嵌入
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回最相似的前k个结果
+            similarity_threshold: 相似度阈值
+            nprobe: IVF索引的探测聚类数
+            ef_search: HNSW索引的efSearch参数
+            rerank: 是否进行第二阶段的全维精确重排序，为None时配置了重排序副本即重排序；
+                粗筛模式下为False时直接返回低维相似度
+            candidate_multiplier: 第一阶段召回的候选数为 top_k * candidate_multiplier，
+                为None时使用向量存储的默认设置
+            filters: 元数据过滤条件，如 {"category": "NLP"}
+        
+        Returns:
+            与查询一一对应的结果列表
+        """
+        if not queries:
+            return []
+        query_embeddings = self._embed_queries(queries)
+        return self.vector_store.search_batch(query_embeddings, top_k, similarity_threshold,
+                                              nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+                                              candidate_multiplier=candidate_multiplier,
+                                              filters=filters)
+    
+    def lexical_search(self, query: str, top_k: int = 5,
+                       filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        BM25词法检索，不需要生成查询嵌入
+        
+        Args:
+            query: 查询文本
+            top_k: 返回最相关的前k个结果
+            filters: 元数据过滤条件
+        
+        Returns:
+            文档列表，similarity字段为BM25分数
+        """
+        return self.vector_store.lexical_search(query, top_k, filters=filters)
+    
+    def hybrid_search(self, query: str, top_k: int = 5, fusion: str = 'rrf',
+                      dense_weight: float = 0.5, rrf_k: int = 60,
+                      candidates: Optional[int] = None, similarity_threshold: float = 0.0,
+                      filters: Optional[Dict] = None, nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None) -> Dict:
+        """
+        混合检索：向量检索与BM25词法检索并发执行，再融合两路结果
+        
+        Args:
+            query: 查询文本
+            top_k: 返回最相关的前k个结果
+            fusion: 融合方式，'rrf'（倒数排名融合）或 'weighted'（分数归一化后加权）
+            dense_weight: weighted融合时向量检索的权重，词法检索权重为 1 - dense_weight
+            rrf_k: RRF融合的平滑常数
+            candidates: 每路检索的候选数，默认为 max(top_k * 4, 20)
+            similarity_threshold: 向量检索候选的相似度阈值
+            filters: 元数据过滤条件，对两路检索同时生效
+            nprobe: IVF索引的探测聚类数
+            ef_search: HNSW索引的efSearch参数
+        
+        Returns:
+            {'results': 融合后的文档列表, 'timings': 各阶段耗时（毫秒）}，
+            每个结果包含 score（融合分数）、dense_similarity、bm25_score 及两路排名
+        """
+        if fusion not in ('rrf', 'weighted'):
+            raise ValueError(f"不支持的融合方式: {fusion}")
+        
+        start = time.perf_counter()
+        candidates = candidates or max(top_k * 4, 20)
+        timings = {}
+        
+        def run_lexical():
+            stage_start = time.perf_counter()
+            results = self.vector_store.lexical_search(query, candidates, filters=filters)
+            timings['lexical_ms'] = (time.perf_counter() - stage_start) * 1000
+            return results
+        
+        # 词法检索不依赖查询嵌入，与嵌入API调用并发执行
+        lexical_future = self._get_executor().submit(run_lexical)
+        
+        stage_start = time.perf_counter()
+        query_embedding = self._embed_queries([query])[0]
+        timings['embedding_ms'] = (time.perf_counter() - stage_start) * 1000
+        
+        stage_start = time.perf_counter()
+        dense_results = self.vector_store.search(query_embedding, candidates, similarity_threshold,
+                                                 nprobe=nprobe, ef_search=ef_search, filters=filters)
+        timings['dense_ms'] = (time.perf_counter() - stage_start) * 1000
+        
+        lexical_results = lexical_future.result()
+        
+        stage_start = time.perf_counter()
+        results = self._fuse_results(dense_results, lexical_results, top_k, fusion, dense_weight, rrf_k)
+        timings['fusion_ms'] = (time.perf_counter() - stage_start) * 1000
+        timings['total_ms'] = (time.perf_counter() - start) * 1000
+        
+        return {'results': results, 'timings': timings}
+    
+    @staticmethod
+    def _fuse_results(dense_results: List[Dict], lexical_results: List[Dict], top_k: int,
+                      fusion: str, dense_weight: float, rrf_k: int) -> List[Dict]:
+        """按RRF或加权分数融合两路检索结果"""
+        def normalized(results: List[Dict]) -> Dict[int, float]:
+            # 分数线性缩放到[0, 1]，两路分数的量纲不同（余弦相似度与BM25）
+            if not results:
+                return {}
+            scores = [result['similarity'] for result in results]
+            low, high = min(scores), max(scores)
+            return {result['id']: (result['similarity'] - low) / (high - low) if high > low else 1.0
+                    for result in results}
+        
+        merged = {}
+        for source, results in (('dense', dense_results), ('lexical', lexical_results)):
+            for result in results:
+                entry = merged.setdefault(result['id'], {
+                    'id': result['id'],
+                    'text': result['text'],
+                    'metadata': result['metadata'],
+                    'score': 0.0,
+                    'dense_similarity': None,
+                    'bm25_score': None,
+                    'dense_rank': None,
+                    'lexical_rank': None
+                })
+                entry['dense_similarity' if source == 'dense' else 'bm25_score'] = result['similarity']
+                entry[f'{source}_rank'] = result['rank']
+        
+        if fusion == 'rrf':
+            for entry in merged.values():
+                for rank in (entry['dense_rank'], entry['lexical_rank']):
+                    if rank is not None:
+                        entry['score'] += 1.0 / (rrf_k + rank)
+        else:
+            dense_scores = normalized(dense_results)
+            lexical_scores = normalized(lexical_results)
+            for doc_id, entry in merged.items():
+                entry['score'] = (dense_weight * dense_scores.get(doc_id, 0.0)
+                                  + (1 - dense_weight) * lexical_scores.get(doc_id, 0.0))
+        
+        results = sorted(merged.values(), key=lambda entry: entry['score'], reverse=True)[:top_k]
+        for rank, entry in enumerate(results, 1):
+            entry['rank'] = rank
+        return results
     
     def save(self, filepath: str):
         """保存知识库"""
         self.vector_store.save(filepath)
     
-    def load(self, filepath: str):
+    def load(self, filepath: str, mmap: bool = True):
         """加载知识库"""
-        self.vector_store.load(filepath)
+        self.vector_store.load(filepath, mmap=mmap)
+    
+    def open_wal(self, directory: str, sync: bool = True, merge_bytes: int = 64 * 1024 * 1024):
+        """启用预写日志持久化，参数见VectorStore.open_wal"""
+        self.vector_store.open_wal(directory, sync=sync, merge_bytes=merge_bytes)
 
 # 示例使用
 if __name__ == "__main__":
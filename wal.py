@@ -0,0 +1,347 @@
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 记录帧：魔数、载荷长度、载荷的CRC32；载荷为 JSON头长度 + JSON头 + float32向量
+_MAGIC = b'KBWL'
+_FRAME = struct.Struct('<4sII')
+_HEADER_LENGTH = struct.Struct('<I')
+
+_SEGMENT_PATTERN = re.compile(r'wal-(\d{8})\.log$')
+MANIFEST_NAME = 'MANIFEST.json'
+
+def encode_record(header: Dict, vectors: Optional[np.ndarray] = None) -> bytes:
+    """将操作头和可选的向量矩阵编码为一条日志记录"""
+    header = dict(header)
+    body = b''
+    if vectors is not None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        header['shape'] = list(vectors.shape)
+        body = vectors.tobytes()
+    header_bytes = json.dumps(header, ensure_ascii=False, default=str).encode('utf-8')
+    payload = _HEADER_LENGTH.pack(len(header_bytes)) + header_bytes + body
+    return _FRAME.pack(_MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+def decode_payload(payload: bytes) -> Tuple[Dict, Optional[np.ndarray]]:
+    """解码记录载荷，返回 (操作头, 向量矩阵或None)"""
+    (header_length,) = _HEADER_LENGTH.unpack_from(payload)
+    start = _HEADER_LENGTH.size
+    header = json.loads(payload[start:start + header_length].decode('utf-8'))
+    vectors = None
+    shape = header.pop('shape', None)
+    if shape is not None:
+        vectors = np.frombuffer(payload, dtype=np.float32, offset=start + header_length).reshape(shape)
+    return header, vectors
+
+def read_segment(path: str, repair: bool = False) -> Iterator[Tuple[Dict, Optional[np.ndarray]]]:
+    """
+    按顺序读取一个日志分段
+    
+    写入中途崩溃会在文件末尾留下不完整的记录，读到第一条不完整或校验失败的记录即停止。
+    
+    Args:
+        path: 分段文件路径
+        repair: 是否截断末尾的损坏部分（只应对最后一个分段使用）
+    
+    Returns:
+        (操作头, 向量矩阵或None) 的生成器
+    """
+    valid_end = 0
+    with open(path, 'rb') as f:
+        while True:
+            frame = f.read(_FRAME.size)
+            if not frame:
+                break
+            if len(frame) < _FRAME.size:
+                logger.warning(f"预写日志末尾记录不完整: {path}")
+                break
+            magic, length, checksum = _FRAME.unpack(frame)
+            payload = f.read(length)
+            if magic != _MAGIC or len(payload) < length or zlib.crc32(payload) != checksum:
+                logger.warning(f"预写日志记录损坏，忽略 {path} 中偏移 {valid_end} 之后的内容")
+                break
+            valid_end = f.tell()
+            yield decode_payload(payload)
+    
+    if repair and os.path.getsize(path) > valid_end:
+        with open(path, 'r+b') as f:
+            f.truncate(valid_end)
+
+def list_segments(directory: str) -> List[int]:
+    """目录中已有的日志分段序号（升序）"""
+    if not os.path.isdir(directory):
+        return []
+    sequences = []
+    for name in os.listdir(directory):
+        match = _SEGMENT_PATTERN.match(name)
+        if match:
+            sequences.append(int(match.group(1)))
+    return sorted(sequences)
+
+def segment_path(directory: str, sequence: int) -> str:
+    """日志分段的文件路径"""
+    return os.path.join(directory, f"wal-{sequence:08d}.log")
+
+def read_manifest(directory: str) -> Dict:
+    """
+    读取清单：base为基础快照的文件前缀（相对目录），sequence为已合并进快照的最后一个分段序号
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'base': None, 'sequence': 0}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_manifest(directory: str, manifest: Dict):
+    """原子替换清单文件，替换完成即为新快照生效的时刻"""
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+def _remove_merge_leftovers(directory: str, manifest: Dict):
+    """
+    删除合并中断留下的文件：已合并进当前快照的分段、旧快照和未生效的新快照
+    
+    合并在替换清单之后、清理之前崩溃时，这些文件不会再被读取，也不会被之后的合并删除。
+    """
+    stale = [segment_path(directory, sequence) for sequence in list_segments(directory)
+             if sequence <= manifest['sequence']]
+    stale.extend(os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.startswith('base-') and name.split('.', 1)[0] != manifest['base'])
+    for path in stale:
+        try:
+            os.remove(path)
+            logger.info(f"删除合并中断留下的文件: {path}")
+        except OSError as e:
+            logger.warning(f"删除合并中断留下的文件失败: {path}: {e}")
+
+class WriteAheadLog:
+    """
+    按序号分段的追加写入日志
+    
+    所有写入都追加到当前分段；合并时先切换到新分段，已关闭的分段交给后台合并，
+    合并完成后删除，写入不需要等待合并。
+    """
+    
+    def __init__(self, directory: str, sequence: int, sync: bool = True):
+        """
+        打开新的日志分段用于写入
+        
+        Args:
+            directory: 日志目录
+            sequence: 新分段的序号，应大于已有分段
+            sync: 每条记录写入后是否fsync（关闭后进程崩溃不丢数据，但断电可能丢失最近的写入）
+        """
+        self.directory = directory
+        self.sync = sync
+        self.sequence = sequence
+        self._file = open(segment_path(directory, sequence), 'ab')
+        self.bytes_written = 0  # 当前分段已写入的字节数
+    
+    def append(self, header: Dict, vectors: Optional[np.ndarray] = None) -> int:
+        """
+        追加一条记录（调用方负责串行化）
+        
+        Returns:
+            写入的字节数
+        """
+        record = encode_record(header, vectors)
+        self._file.write(record)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        self.bytes_written += len(record)
+        return len(record)
+    
+    def rotate(self) -> int:
+        """
+        关闭当前分段并开始新分段
+        
+        Returns:
+            已关闭分段的序号
+        """
+        closed = self.sequence
+        self._file.close()
+        self.sequence += 1
+        self._file = open(segment_path(self.directory, self.sequence), 'ab')
+        self.bytes_written = 0
+        return closed
+    
+    def close(self):
+        """关闭日志文件"""
+        if not self._file.closed:
+            self._file.close()
+
+class WriteAheadLogMixin:
+    """
+    为存储类提供基于预写日志的持久化
+    
+    宿主类需提供 _lock（可重入锁）、documents、add_documents、delete_documents、
+    update_documents、update_metadata、save、load、compact，以及 _empty_copy（配置相同的空存储）
+    和 _release_base（删除旧快照前释放对其文件的映射），并在初始化时调用 _init_wal。
+    """
+    
+    def _init_wal(self):
+        """初始化预写日志状态（open_wal启用后每次修改都追加记录）"""
+        self._wal = None
+        self._wal_merge_bytes = 0
+        self._wal_unmerged_bytes = 0  # 尚未合并进基础快照的日志字节数
+        self._merge_lock = threading.Lock()
+        self._merge_thread = None
+    
+    def open_wal(self, directory: str, sync: bool = True, merge_bytes: int = 64 * 1024 * 1024):
+        """
+        启用预写日志持久化
+        
+        目录中保存一个基础快照（宿主类的save格式）和若干日志分段。打开时先加载快照，
+        再按顺序重放快照之后的日志；此后每次添加、删除、更新都只追加一条记录，
+        持久化开销与本次修改的大小成正比，与知识库规模无关。日志累计超过merge_bytes后，
+        后台线程在快照副本上重放日志并保存为新快照，期间搜索和写入都不受影响。
+        
+        Args:
+            directory: 快照和日志所在目录，不存在时创建
+            sync: 每条记录写入后是否fsync
+            merge_bytes: 未合并的日志达到该字节数时触发后台合并，0表示只手动合并
+        """
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            if self._wal is not None:
+                raise ValueError("预写日志已启用")
+            if len(self.documents) > 0:
+                raise ValueError("open_wal只能在空的向量存储上调用")
+            
+            manifest = read_manifest(directory)
+            _remove_merge_leftovers(directory, manifest)
+            if manifest['base']:
+                self.load(os.path.join(directory, manifest['base']))
+            segments = [sequence for sequence in list_segments(directory) if sequence > manifest['sequence']]
+            records = 0
+            for i, sequence in enumerate(segments):
+                # 只有最后一个分段可能因崩溃留下不完整的记录
+                for header, vectors in read_segment(segment_path(directory, sequence),
+                                                    repair=i == len(segments) - 1):
+                    self._apply_wal_record(header, vectors)
+                    records += 1
+            
+            # 每次打开都从新分段开始写入，此前没有写入任何记录的空分段直接删除
+            for sequence in segments:
+                if os.path.getsize(segment_path(directory, sequence)) == 0:
+                    os.remove(segment_path(directory, sequence))
+            self._wal_unmerged_bytes = sum(os.path.getsize(segment_path(directory, sequence))
+                                           for sequence in segments
+                                           if os.path.exists(segment_path(directory, sequence)))
+            self._wal_merge_bytes = merge_bytes
+            self._wal = WriteAheadLog(directory, max(segments + [manifest['sequence']]) + 1, sync)
+        
+        logger.info(f"预写日志已启用: {directory}，重放了 {len(segments)} 个分段中的 {records} 条记录")
+        self._maybe_merge_wal()
+    
+    def close_wal(self):
+        """等待进行中的合并完成并关闭预写日志"""
+        with self._merge_lock:
+            with self._lock:
+                if self._wal is not None:
+                    self._wal.close()
+                    self._wal = None
+    
+    def _log_wal(self, header: Dict, vectors: Optional[np.ndarray] = None):
+        """追加一条预写日志记录（调用方需持有锁）"""
+        if self._wal is not None:
+            self._wal_unmerged_bytes += self._wal.append(header, vectors)
+    
+    def _apply_wal_record(self, header: Dict, vectors: Optional[np.ndarray]):
+        """重放一条预写日志记录"""
+        op = header['op']
+        if op == 'add':
+            ids = self.add_documents(header['texts'], vectors, header['metadata'])
+            if ids != header['ids']:
+                raise ValueError("预写日志与基础快照不一致：重放得到的文档ID不匹配")
+        elif op == 'delete':
+            self.delete_documents(header['ids'])
+        elif op == 'update':
+            self.update_documents(header['ids'], header['texts'], vectors, header['metadata'])
+        elif op == 'update_metadata':
+            self.update_metadata(header['ids'], header['metadata'])
+        else:
+            raise ValueError(f"未知的预写日志操作: {op}")
+    
+    def _maybe_merge_wal(self):
+        """未合并的日志超过阈值时启动后台合并"""
+        if self._wal is None or not self._wal_merge_bytes or self._wal_unmerged_bytes < self._wal_merge_bytes:
+            return
+        with self._lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(target=self.merge_wal, daemon=True,
+                                                  name="vector-store-wal-merge")
+            self._merge_thread.start()
+    
+    def merge_wal(self) -> Optional[str]:
+        """
+        将已有的日志分段合并为新的基础快照
+        
+        只在切换日志分段时短暂持有锁；之后在独立的空存储上加载旧快照、重放已关闭的分段并保存，
+        最后原子替换清单文件，再删除已合并的分段和旧快照。合并过程中崩溃时清单仍指向旧快照，
+        重启后按旧快照加日志恢复。
+        
+        Returns:
+            新快照的文件前缀（相对目录），没有需要合并的日志时返回None
+        """
+        with self._merge_lock:
+            with self._lock:
+                if self._wal is None:
+                    raise ValueError("未启用预写日志")
+                directory = self._wal.directory
+                manifest = read_manifest(directory)
+                segments = [sequence for sequence in list_segments(directory)
+                            if manifest['sequence'] < sequence < self._wal.sequence]
+                if self._wal.bytes_written > 0:
+                    segments.append(self._wal.rotate())
+            if not segments:
+                return None
+            
+            started = time.time()
+            shadow = self._empty_copy()
+            if manifest['base']:
+                shadow.load(os.path.join(directory, manifest['base']))
+            for sequence in segments:
+                for header, vectors in read_segment(segment_path(directory, sequence)):
+                    shadow._apply_wal_record(header, vectors)
+            shadow.compact()
+            
+            base = f"base-{segments[-1]:08d}"
+            shadow.save(os.path.join(directory, base))
+            merged_bytes = sum(os.path.getsize(segment_path(directory, sequence)) for sequence in segments)
+            write_manifest(directory, {'base': base, 'sequence': segments[-1]})
+            with self._lock:
+                self._wal_unmerged_bytes = max(0, self._wal_unmerged_bytes - merged_bytes)
+                if manifest['base']:
+                    self._release_base(os.path.join(directory, manifest['base']))
+            
+            # 清除已合并的分段和旧快照（正在映射旧快照的读取者不受影响）
+            stale = [segment_path(directory, sequence) for sequence in segments]
+            if manifest['base']:
+                stale.extend(os.path.join(directory, name) for name in os.listdir(directory)
+                             if name.startswith(f"{manifest['base']}."))
+            for path in stale:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"删除已合并的文件失败: {path}: {e}")
+        
+        logger.info(f"预写日志合并完成: {len(segments)} 个分段 -> {base}，耗时 {time.time() - started:.2f}s")
+        return base